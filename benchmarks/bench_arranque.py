@@ -0,0 +1,101 @@
+"""Benchmark del arranque de la app de Streamlit: importación y primer render.
+
+Cada medición corre en un proceso nuevo (arranque en frío, como un contenedor recién
+escalado) y ejecuta `src/main.py` con `streamlit.testing.v1.AppTest`: el primer run
+incluye importar los módulos de la app y dibujar la página; el segundo es un rerun
+(lo que ocurre en cada interacción). También informa si OpenCV y google.generativeai
+quedaron cargados tras el primer render.
+
+Con `--comparar REF` mide además el `src/` de otra revisión de git (p. ej. el commit
+anterior) para ver el antes y el después.
+
+Uso:
+    python benchmarks/bench_arranque.py [--repeticiones 5] [--comparar HEAD~1] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Se ejecuta en un proceso nuevo; recibe la ruta de main.py y devuelve una línea JSON
+MEDICION = """
+import json, sys, time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+importar_streamlit = time.perf_counter() - inicio
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+inicio = time.perf_counter()
+app.run()
+primer_render = time.perf_counter() - inicio
+inicio = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - inicio
+print(json.dumps({
+    "importar_streamlit": importar_streamlit,
+    "primer_render": primer_render,
+    "rerun": rerun,
+    "cv2_cargado": "cv2" in sys.modules,
+    "genai_cargado": "google.generativeai" in sys.modules,
+    "excepciones": [str(e.value) for e in app.exception],
+}))
+"""
+
+
+# Función para medir el arranque de una copia de src/ en procesos nuevos
+def medir(directorio_src, repeticiones):
+    entorno = dict(os.environ, PYTHONWARNINGS="ignore")
+    mediciones = []
+    with tempfile.TemporaryDirectory() as cache:
+        # Cache y catálogo vacíos, como en un contenedor nuevo
+        entorno.update({"HDU_CACHE_DIR": cache, "HDU_CATALOGO": os.path.join(cache, "catalogo.sqlite3")})
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, "-c", MEDICION, os.path.join(directorio_src, "main.py")],
+                                    capture_output=True, text=True, check=True, env=entorno, cwd=directorio_src)
+            mediciones.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    resumen = {clave: round(statistics.median(m[clave] for m in mediciones), 3) for clave in ("importar_streamlit", "primer_render", "rerun")}
+    resumen.update({
+        "cv2_cargado": mediciones[-1]["cv2_cargado"],
+        "genai_cargado": mediciones[-1]["genai_cargado"],
+        "excepciones": mediciones[-1]["excepciones"],
+    })
+    return resumen
+
+
+# Función para extraer el src/ de otra revisión en un directorio temporal
+def exportar_revision(ref, destino):
+    archivo = subprocess.run(["git", "archive", ref, "src"], cwd=RAIZ, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", destino], input=archivo, check=True)
+    return os.path.join(destino, "src")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--comparar", metavar="REF", help="Revisión de git con la que comparar (p. ej. HEAD~1)")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado como JSON")
+    args = parser.parse_args()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.comparar:
+            resultados[args.comparar] = medir(exportar_revision(args.comparar, tmpdir), args.repeticiones)
+        resultados["actual"] = medir(os.path.join(RAIZ, "src"), args.repeticiones)
+
+    if args.json:
+        print(json.dumps(resultados, ensure_ascii=False))
+        return
+    print(f"{'versión':>10} {'import streamlit (s)':>21} {'primer render (s)':>18} {'rerun (s)':>10} {'cv2':>5} {'genai':>6}")
+    for version, r in resultados.items():
+        print(f"{version:>10} {r['importar_streamlit']:>21.3f} {r['primer_render']:>18.3f} {r['rerun']:>10.3f} "
+              f"{'sí' if r['cv2_cargado'] else 'no':>5} {'sí' if r['genai_cargado'] else 'no':>6}")
+        for excepcion in r["excepciones"]:
+            print(f"  ⚠️ {excepcion}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark de extracción de frames: seek por segundo vs. pasada secuencial.
+
+Genera videos sintéticos tipo grabación de pantalla (30s, 2min y 10min) y compara
+el loop original con `cap.set(cv2.CAP_PROP_POS_MSEC, ...)` contra `muestrear_frames`, y
+mide la selección por cambios de escena como múltiplo del tiempo real (debe ser > 1x).
+
+Uso:
+    python benchmarks/bench_extraccion.py [--duraciones 30 120 600] [--fps 30] [--gop 60 300 0]
+
+Con `--gop` los videos se codifican en H.264 con ese intervalo entre keyframes
+(0 = solo el keyframe inicial); requiere `pip install imageio-ffmpeg`. El seek es
+barato con keyframes densos y se vuelve cuadrático con keyframes escasos, que es
+el caso de las grabaciones de pantalla; la pasada secuencial no depende del GOP.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from video import calcular_objetivos, calcular_parametros_video, leer_metadata, muestrear_frames  # noqa: E402
+from escenas import seleccionar_escenas  # noqa: E402
+
+
+# Función para dibujar una "pantalla" de app con un layout propio
+def dibujar_pantalla(numero, ancho, alto, rng):
+    pantalla = np.full((alto, ancho, 3), 245, dtype=np.uint8)
+    cv2.rectangle(pantalla, (0, 0), (ancho, alto // 9), rng.integers(0, 255, size=3).tolist(), -1)
+    cv2.putText(pantalla, f"Pantalla {numero}", (ancho // 30, alto // 14), cv2.FONT_HERSHEY_SIMPLEX, alto / 500, (255, 255, 255), 2)
+    # Tarjetas, botones e imágenes en posiciones distintas para cada pantalla
+    for _ in range(rng.integers(3, 8)):
+        x, y = int(rng.integers(0, ancho * 3 // 4)), int(rng.integers(alto // 8, alto * 7 // 8))
+        w, h = int(rng.integers(ancho // 10, ancho // 3)), int(rng.integers(alto // 12, alto // 4))
+        cv2.rectangle(pantalla, (x, y), (x + w, y + h), rng.integers(0, 230, size=3).tolist(), -1)
+    return pantalla
+
+
+# Función para generar un video sintético que simula una grabación de pantalla
+def generar_video_sintetico(path, duracion, fps=30, ancho=1280, alto=720, gop=None, semilla=0):
+    """Escribe un video con 'pantallas' que cambian cada 3 segundos y un cursor en movimiento.
+
+    Con `gop` (requiere imageio-ffmpeg) se re-codifica en H.264 con un keyframe cada
+    `gop` frames (0 = solo el keyframe inicial), como las grabaciones de pantalla reales.
+    OpenCV por sí solo escribe MPEG-4 con un keyframe cada 12 frames. Con otra
+    `semilla` las pantallas cambian (videos distintos de la misma duración).
+    """
+    destino = path if gop is None else path + ".mp4v.mp4"
+    writer = cv2.VideoWriter(destino, cv2.VideoWriter_fourcc(*"mp4v"), fps, (ancho, alto))
+    rng = np.random.default_rng(semilla)
+    pantalla = None
+    for i in range(int(duracion * fps)):
+        if i % (fps * 3) == 0:
+            pantalla = dibujar_pantalla(i // (fps * 3), ancho, alto, rng)
+        frame = pantalla.copy()
+        # Cursor en movimiento para que cada frame sea distinto
+        cv2.circle(frame, ((i * 7) % ancho, alto // 2), 12, (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+    if gop is not None:
+        import imageio_ffmpeg
+        keyint = gop or int(duracion * fps) + 1
+        subprocess.run([
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-i", destino,
+            "-c:v", "libx264", "-preset", "veryfast", "-g", str(keyint), "-keyint_min", str(keyint),
+            "-sc_threshold", "0", path,
+        ], check=True)
+        os.remove(destino)
+
+
+# Loop original basado en seek (referencia)
+def muestrear_con_seek(video_path, frame_interval, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    duration = total_frames / fps if fps else 0
+    frames = []
+    for sec in range(0, int(duration), frame_interval):
+        cap.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
+        ret, frame = cap.read()
+        if ret:
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if len(frames) >= max_frames:
+                break
+    cap.release()
+    return frames
+
+
+# Pasada secuencial con grab()/retrieve()
+def muestrear_secuencial(video_path, frame_interval, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    metadata = leer_metadata(cap)
+    frames_bgr, _ = muestrear_frames(cap, calcular_objetivos(metadata, frame_interval, max_frames))
+    cap.release()
+    return [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames_bgr]
+
+
+# Selección por cambios de escena (mismo presupuesto de frames)
+def muestrear_escenas(video_path, frame_interval, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    metadata = leer_metadata(cap)
+    frames_bgr, _, _ = seleccionar_escenas(cap, metadata, max_frames)
+    cap.release()
+    return frames_bgr
+
+
+def medir(funcion, *args, repeticiones=3):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duraciones", type=int, nargs="+", default=[30, 120, 600])
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--gop", type=int, nargs="+", default=None, help="Intervalos entre keyframes a probar (requiere imageio-ffmpeg)")
+    args = parser.parse_args()
+
+    gops = args.gop or [None]
+    print(f"{'duración':>10} {'GOP':>8} {'frames':>7} {'seek (s)':>10} {'secuencial (s)':>15} {'speedup':>8} {'escenas (s)':>12} {'x tiempo real':>14}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for duracion in args.duraciones:
+            for gop in gops:
+                path = os.path.join(tmpdir, f"sintetico_{duracion}s_{gop}.mp4")
+                generar_video_sintetico(path, duracion, fps=args.fps, gop=gop)
+                frame_interval, max_frames, _ = calcular_parametros_video(path)
+                t_seek, frames_seek = medir(muestrear_con_seek, path, frame_interval, max_frames, repeticiones=args.repeticiones)
+                t_seq, frames_seq = medir(muestrear_secuencial, path, frame_interval, max_frames, repeticiones=args.repeticiones)
+                t_escenas, _ = medir(muestrear_escenas, path, frame_interval, max_frames, repeticiones=args.repeticiones)
+                if len(frames_seek) != len(frames_seq):
+                    print(f"  ⚠️ Cantidad de frames distinta: seek={len(frames_seek)} secuencial={len(frames_seq)}")
+                etiqueta_gop = "mp4v/12" if gop is None else ("único" if gop == 0 else str(gop))
+                print(f"{duracion:>9}s {etiqueta_gop:>8} {len(frames_seq):>7} {t_seek:>10.3f} {t_seq:>15.3f} {t_seek / t_seq:>7.1f}x {t_escenas:>12.3f} {duracion / t_escenas:>13.1f}x")
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark de la inspección previa de una carpeta (modo carpeta, antes de procesar).
+
+Compara leer la metadata de cada video en serie (un `cv2.VideoCapture` por archivo,
+uno tras otro) con `inspeccion.inspeccionar_carpeta` en un pool de procesos, en frío
+(catálogo vacío) y memoizada (segunda pasada: solo consulta el catálogo), y mide
+`inspeccion.estimar_lote` sobre el resultado. Por defecto genera un video sintético y
+lo copia `--videos` veces (más un archivo dañado); con `--carpeta` mide una carpeta
+existente, p. ej. un recurso de red, donde la latencia de abrir cada archivo domina.
+
+Uso:
+    python benchmarks/bench_inspeccion.py [--videos 2000] [--procesos 8] [--carpeta RUTA] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from bench_extraccion import generar_video_sintetico  # noqa: E402
+
+
+# Función para generar una carpeta con copias de un video sintético y un archivo dañado
+def generar_carpeta(carpeta, videos):
+    base = os.path.join(carpeta, "base.mp4")
+    generar_video_sintetico(base, 10, fps=10, ancho=640, alto=360)
+    for i in range(videos - 1):
+        shutil.copyfile(base, os.path.join(carpeta, f"video_{i:05d}.mp4"))
+    with open(os.path.join(carpeta, "danado.mp4"), "wb") as f:
+        f.write(b"\0" * 4096)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=2000)
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos de inspección (por defecto, uno por CPU)")
+    parser.add_argument("--carpeta", help="Carpeta existente a inspeccionar en lugar de generar videos")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado como JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ["HDU_CATALOGO"] = os.path.join(tmpdir, "catalogo.sqlite3")
+        from catalogo import Catalogo
+        from hdu import default_prompt
+        from inspeccion import inspeccionar_carpeta, estimar_lote
+        from opciones import normalizar_opciones
+        from video import leer_metadata_archivo
+
+        carpeta = args.carpeta
+        if not carpeta:
+            carpeta = os.path.join(tmpdir, "videos")
+            os.makedirs(carpeta)
+            print(f"Generando {args.videos} videos...", file=sys.stderr)
+            generar_carpeta(carpeta, args.videos)
+        catalogo = Catalogo()
+        catalogo.actualizar(carpeta)
+        videos = [path for path, _ in catalogo.videos(carpeta)]
+
+        inicio = time.perf_counter()
+        for path in videos:
+            leer_metadata_archivo(path)
+        serie = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        metadatas = inspeccionar_carpeta(catalogo, carpeta, args.procesos)
+        paralelo = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        inspeccionar_carpeta(catalogo, carpeta, args.procesos)
+        memoizado = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        estimacion = estimar_lote(metadatas, normalizar_opciones(None), default_prompt(), "", 4, 4)
+        estimar = time.perf_counter() - inicio
+
+    resultado = {
+        "videos": len(videos),
+        "ilegibles": len(estimacion["ilegibles"]),
+        "procesos": args.procesos or os.cpu_count(),
+        "serie_s": round(serie, 3),
+        "paralelo_frio_s": round(paralelo, 3),
+        "memoizado_s": round(memoizado, 3),
+        "estimar_s": round(estimar, 3),
+        "estimacion": {clave: estimacion[clave] for clave in ("frames", "solicitudes", "tokens", "segundos")},
+    }
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False))
+        return
+    print(f"{resultado['videos']} videos ({resultado['ilegibles']} ilegibles), {resultado['procesos']} procesos")
+    print(f"  en serie:              {serie:8.3f}s")
+    print(f"  en paralelo (en frío): {paralelo:8.3f}s")
+    print(f"  memoizado (catálogo):  {memoizado:8.3f}s")
+    print(f"  estimación del lote:   {estimar:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark de memoria de la extracción de frames por video en curso.
+
+Genera una grabación sintética de alta resolución (4K por defecto) y mide con
+`tracemalloc` la memoria pico de `video.extraer_frames_codificados` (los frames de
+OpenCV son arrays de NumPy, que tracemalloc registra) para cada modo de muestreo,
+con y sin deduplicación. Compara el pico con la cota documentada
+`video.memoria_maxima_extraccion` y con lo que ocuparían los candidatos a resolución
+completa.
+
+Es un benchmark que se corre a mano: el repositorio no tiene una suite de tests que lo
+ejecute. Con `--estricto` termina con código 1 si algún pico supera la cota, para usarlo
+como chequeo en un script o en CI.
+
+Uso:
+    python benchmarks/bench_memoria.py [--ancho 3840] [--alto 2160] [--duracion 30] [--fps 10] [--json] [--estricto]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from bench_extraccion import generar_video_sintetico  # noqa: E402
+from opciones import CONFIG_IMAGEN_DEFAULT  # noqa: E402
+from video import FACTOR_CANDIDATOS, calcular_parametros_video, extraer_frames_codificados, leer_metadata_archivo, memoria_maxima_extraccion  # noqa: E402
+
+MB = 1024 * 1024
+
+
+# Función para medir la memoria pico de una extracción
+def medir_pico(video_path, muestreo, deduplicacion):
+    tracemalloc.start()
+    try:
+        frames, _, parametros, _, _ = extraer_frames_codificados(video_path, CONFIG_IMAGEN_DEFAULT, muestreo, deduplicacion)
+        return tracemalloc.get_traced_memory()[1], len(frames), parametros[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ancho", type=int, default=3840)
+    parser.add_argument("--alto", type=int, default=2160)
+    parser.add_argument("--duracion", type=int, default=30)
+    parser.add_argument("--fps", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado como JSON")
+    parser.add_argument("--estricto", action="store_true", help="Terminar con código 1 si algún pico supera la cota")
+    args = parser.parse_args()
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "grabacion.mp4")
+        print(f"Generando video sintético ({args.ancho}x{args.alto}, {args.duracion}s, {args.fps} fps)...", file=sys.stderr)
+        generar_video_sintetico(path, args.duracion, fps=args.fps, ancho=args.ancho, alto=args.alto)
+        metadata = leer_metadata_archivo(path)
+        max_frames = calcular_parametros_video(path, metadata)[1]
+        frame_completo = args.ancho * args.alto * 3
+        for modo in ("escenas", "intervalo"):
+            for dedup in (True, False):
+                pico, frames, max_frames = medir_pico(path, {"modo": modo}, {"activa": dedup})
+                cota = memoria_maxima_extraccion(metadata, CONFIG_IMAGEN_DEFAULT, max_frames, dedup)
+                resultados.append({
+                    "muestreo": modo,
+                    "deduplicacion": dedup,
+                    "frames": frames,
+                    "pico_mb": round(pico / MB, 1),
+                    "cota_mb": round(cota / MB, 1),
+                    # Candidatos retenidos a resolución completa (sin reducirlos al decodificar)
+                    "sin_reducir_mb": round(max_frames * (FACTOR_CANDIDATOS if dedup else 1) * frame_completo / MB, 1),
+                    "dentro_de_la_cota": pico <= cota,
+                })
+
+    if args.json:
+        print(json.dumps(resultados, ensure_ascii=False))
+    else:
+        print(f"{'muestreo':>10} {'dedup':>6} {'frames':>7} {'pico (MB)':>10} {'cota (MB)':>10} {'sin reducir (MB)':>17}")
+        for r in resultados:
+            print(f"{r['muestreo']:>10} {'sí' if r['deduplicacion'] else 'no':>6} {r['frames']:>7} {r['pico_mb']:>10.1f} "
+                  f"{r['cota_mb']:>10.1f} {r['sin_reducir_mb']:>17.1f}{'' if r['dentro_de_la_cota'] else '  ⚠️ supera la cota'}")
+    if args.estricto and not all(r["dentro_de_la_cota"] for r in resultados):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Benchmark del procesamiento masivo de punta a punta sin red ni API key.
+
+Genera videos sintéticos tipo grabación de pantalla y los procesa con el mismo flujo
+que el modo carpeta (`lote.ejecutar_pipeline` con `pipeline.preparar_video` en un pool
+de procesos y `pipeline.solicitar_hdu` en un pool de hilos), usando el sustituto local
+de Gemini (`GEMINI_BACKEND=local`) con latencia, tasa de errores y streaming configurables.
+El cache de resultados y de frames vive en un directorio temporal: la primera pasada
+decodifica todo y las siguientes (`--pasadas`) miden el camino con cache.
+
+Reporta videos por minuto, percentiles de latencia por etapa, RSS máximo (proceso
+principal y procesos de extracción) y bytes enviados a la API. Con `--salida` agrega
+el resultado como una línea JSON al archivo indicado (`-` = stdout) para comparar
+corridas en el tiempo.
+
+Uso:
+    python benchmarks/bench_pipeline.py [--videos 8] [--duraciones 20 45 90] [--latencia 1.5]
+        [--tasa-error 0.05] [--streaming] [--pasadas 2] [--salida bench_pipeline.jsonl]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from bench_extraccion import generar_video_sintetico  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+# Función para calcular un percentil con interpolación lineal
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+# Función para resumir las latencias por etapa de una pasada
+def resumir_etapas(lista_tiempos):
+    """Recibe una lista de dicts {etapa: segundos} y devuelve {etapa: {p50, p90, p99, max, n}}"""
+    por_etapa = {}
+    for tiempos in lista_tiempos:
+        for etapa, segundos in tiempos.items():
+            por_etapa.setdefault(etapa, []).append(segundos)
+    return {
+        etapa: {**{f"p{p}": round(percentil(valores, p), 4) for p in PERCENTILES}, "max": round(max(valores), 4), "n": len(valores)}
+        for etapa, valores in sorted(por_etapa.items())
+    }
+
+
+# Función para leer el RSS máximo en MB (ru_maxrss está en KB en Linux y en bytes en macOS)
+def rss_max_mb(quien):
+    rss = resource.getrusage(quien).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# Función para obtener el commit actual (None fuera de un repositorio git)
+def commit_actual():
+    try:
+        salida = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return salida.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Función para procesar todos los videos una vez con el flujo del modo carpeta
+def ejecutar_pasada(videos, args, cliente, limitador):
+    from pipeline import Empaquetador, preparar_video, preparado_con_error, solicitar_hdu, normalizar_opciones
+    from opciones import EMPAQUETADO_DEFAULT
+    from lote import ejecutar_pipeline, resumir_tokens
+    from ruteo import resumir_ruteo
+    import hdu
+
+    prompt = hdu.default_prompt()
+    opciones = normalizar_opciones({"muestreo": {"modo": args.muestreo}, "segmentacion": {"activa": args.segmentado}})
+    al_recibir = (lambda texto: None) if args.streaming else None
+    solicitar = lambda preparado: solicitar_hdu(preparado, prompt, "", args.modelo, limitador, al_recibir)
+    empaquetado = None
+    if args.empaquetar:
+        empaquetado = dict(EMPAQUETADO_DEFAULT, activo=True)
+        solicitar = Empaquetador(prompt, "", args.modelo, limitador, empaquetado).solicitar
+    solicitudes, bytes_enviados = cliente.solicitudes, cliente.bytes_enviados
+
+    inicio = time.perf_counter()
+    resultados = list(ejecutar_pipeline(
+        videos,
+        partial(preparar_video, prompt=prompt, extra_context="", selected_model=args.modelo, opciones=opciones, empaquetado=empaquetado),
+        solicitar,
+        max_procesos=args.procesos,
+        max_concurrentes=args.concurrentes,
+        max_en_memoria=args.en_memoria,
+        al_fallar=preparado_con_error,
+    ))
+    segundos = time.perf_counter() - inicio
+
+    infos = [info for _, _, (_, _, _, info) in resultados]
+    errores = [error for _, _, (_, _, error, _) in resultados if error]
+    return {
+        "videos": len(videos),
+        "errores": len(errores),
+        "desde_cache": sum(1 for info in infos if info.get("cache")),
+        "empaquetados": sum(1 for info in infos if info.get("paquete")),
+        "segundos": round(segundos, 3),
+        "videos_por_minuto": round(len(videos) / segundos * 60, 2),
+        "etapas": resumir_etapas([info["tiempos"] for info in infos]),
+        "solicitudes": cliente.solicitudes - solicitudes,
+        "bytes_enviados": cliente.bytes_enviados - bytes_enviados,
+        "frames": sum(len(info.get("timestamps") or []) for info in infos),
+        "tokens": resumir_tokens([info.get("tokens") for info in infos]),
+        "reintentos": sum(info.get("contadores", {}).get("reintentos", 0) for info in infos),
+        "limitados": sum(info.get("contadores", {}).get("limitados", 0) for info in infos),
+        "ruteo": resumir_ruteo([info.get("ruteo") for info in infos]),
+        "ejemplos_error": sorted(set(errores))[:3],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=8)
+    parser.add_argument("--duraciones", type=int, nargs="+", default=[20, 45, 90], help="Se reparten en ciclo entre los videos")
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--ancho", type=int, default=1280)
+    parser.add_argument("--alto", type=int, default=720)
+    parser.add_argument("--latencia", type=float, default=1.0, help="Segundos por respuesta del sustituto de Gemini")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de solicitudes que fallan (429 o 503 simulados, se reintentan)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--streaming", action="store_true", help="Pedir las respuestas en streaming")
+    parser.add_argument("--muestreo", choices=["escenas", "intervalo"], default="escenas")
+    parser.add_argument("--segmentado", action="store_true", help="Activar el modo segmentado (videos largos)")
+    parser.add_argument("--empaquetar", action="store_true", help="Agrupar clips cortos en solicitudes con varios videos")
+    parser.add_argument("--modelo", default="gemini-1.5-flash", help="auto = ruteo por video")
+    parser.add_argument("--incompletas", type=float, default=0.0, help="Fracción de respuestas de modelos flash sin estructura (fuerzan el escalado con --modelo auto)")
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--concurrentes", type=int, default=4)
+    parser.add_argument("--en-memoria", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--tpm", type=int, default=0)
+    parser.add_argument("--pasadas", type=int, default=1, help="Pasadas sobre los mismos videos (desde la 2ª se usa el cache)")
+    parser.add_argument("--salida", help="Archivo JSONL donde agregar el resultado (- = stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # El entorno se fija antes de importar el pipeline: los procesos de extracción lo heredan
+        os.environ.update({
+            "GEMINI_BACKEND": "local",
+            "GEMINI_LOCAL_LATENCIA": str(args.latencia),
+            "GEMINI_LOCAL_ERRORES": str(args.tasa_error),
+            "GEMINI_LOCAL_SEMILLA": str(args.semilla),
+            "GEMINI_LOCAL_INCOMPLETAS": str(args.incompletas),
+            "HDU_CACHE_DIR": os.path.join(tmpdir, "cache"),
+        })
+        import cv2
+        from gemini import obtener_cliente
+        from lote import LimitadorTasa
+        from video import calcular_parametros_video
+
+        cliente = obtener_cliente()
+        limitador = LimitadorTasa(rpm=args.rpm, tpm=args.tpm)
+
+        print(f"Generando {args.videos} videos sintéticos ({args.ancho}x{args.alto}, {args.fps} fps)...", file=sys.stderr)
+        videos = []
+        for i in range(args.videos):
+            duracion = args.duraciones[i % len(args.duraciones)]
+            path = os.path.join(tmpdir, f"video_{i:03d}_{duracion}s.mp4")
+            generar_video_sintetico(path, duracion, fps=args.fps, ancho=args.ancho, alto=args.alto, semilla=i)
+            videos.append(path)
+        estrategias = sorted({calcular_parametros_video(path)[2] for path in videos})
+
+        pasadas = []
+        for numero in range(1, args.pasadas + 1):
+            pasada = ejecutar_pasada(videos, args, cliente, limitador)
+            pasadas.append({"pasada": numero, **pasada})
+            print(f"\nPasada {numero}: {pasada['videos']} videos en {pasada['segundos']:.2f}s -> "
+                  f"{pasada['videos_por_minuto']:.1f} videos/min ({pasada['errores']} errores, {pasada['desde_cache']} desde cache, {pasada['empaquetados']} empaquetados, "
+                  f"{pasada['solicitudes']} solicitudes, {pasada['reintentos']} reintentos, {pasada['bytes_enviados'] / (1024 * 1024):.2f} MB enviados)", file=sys.stderr)
+            print(f"  {'etapa':<14} {'p50 (s)':>9} {'p90 (s)':>9} {'p99 (s)':>9} {'máx (s)':>9}", file=sys.stderr)
+            for etapa, valores in pasada["etapas"].items():
+                print(f"  {etapa:<14} {valores['p50']:>9.3f} {valores['p90']:>9.3f} {valores['p99']:>9.3f} {valores['max']:>9.3f}", file=sys.stderr)
+            for ruta, r in pasada["ruteo"].items():
+                print(f"  ruta {ruta}: {r['videos']} videos, {r['escalados']} escalados, "
+                      f"latencia promedio {r['api'] / r['videos']:.2f}s, {r['tokens'] // r['videos']} tokens promedio", file=sys.stderr)
+            for error in pasada["ejemplos_error"]:
+                print(f"  ⚠️ {error}", file=sys.stderr)
+
+    resultado = {
+        "benchmark": "pipeline",
+        "fecha": datetime.now().isoformat(),
+        "commit": commit_actual(),
+        "entorno": {"python": platform.python_version(), "opencv": cv2.__version__, "cpus": os.cpu_count(), "plataforma": platform.platform()},
+        "config": vars(args),
+        "estrategias": estrategias,
+        "pasadas": pasadas,
+        "rss_max_mb": {"principal": rss_max_mb(resource.RUSAGE_SELF), "procesos": rss_max_mb(resource.RUSAGE_CHILDREN)},
+    }
+    print(f"\nRSS máximo: {resultado['rss_max_mb']['principal']} MB (principal), {resultado['rss_max_mb']['procesos']} MB (procesos de extracción)", file=sys.stderr)
+    if args.salida == "-":
+        print(json.dumps(resultado, ensure_ascii=False))
+    elif args.salida:
+        with open(args.salida, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
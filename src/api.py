@@ -0,0 +1,257 @@
+"""Servicio HTTP (sin navegador) para generar historias de usuario a partir de videos.
+
+Uso:
+    uvicorn api:app --app-dir src --host 0.0.0.0 --port 8000
+
+Endpoints:
+    POST /trabajos              multipart: video, [prompt], [extra_context], [modelo] ("auto" = ruteo por video)
+    GET  /trabajos/{id}         estado del trabajo
+    GET  /trabajos/{id}/hdu     historia de usuario generada (hdu_text, hdu_json)
+    GET  /metrics               métricas por etapa y contadores (formato de texto de Prometheus)
+"""
+import os
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+import hdu
+import metricas
+from cache import EscrituraStream
+from lote import LimitadorTasa
+from pipeline import generar_hdu
+from ruteo import MODELO_AUTO
+
+hdu.configurar_gemini()
+
+# Configuración (variables de entorno / .env)
+API_WORKERS = int(os.getenv("API_WORKERS", "4"))
+API_MAX_MB = float(os.getenv("API_MAX_MB", "1024"))
+API_RETENCION_HORAS = float(os.getenv("API_RETENCION_HORAS", "24"))
+EXTENSIONES_VIDEO = (".mp4", ".mov", ".avi")
+CAMPOS_MAX_BYTES = 1024 * 1024  # prompt + extra_context + modelo; también es el margen de encabezados multipart
+
+app = FastAPI(title="User Story Pro API", description="Video to User Story with Gemini Vision")
+
+# Un único pool de trabajo y un único presupuesto de RPM/TPM compartido por todos los clientes
+pool = ThreadPoolExecutor(max_workers=API_WORKERS)
+limitador = LimitadorTasa(rpm=int(os.getenv("GEMINI_RPM", "0")), tpm=int(os.getenv("GEMINI_TPM", "0")))
+trabajos = {}
+trabajos_lock = threading.Lock()
+
+
+# Función para actualizar el estado de un trabajo
+def actualizar_trabajo(trabajo_id, **campos):
+    with trabajos_lock:
+        trabajos[trabajo_id].update(campos)
+
+
+# Función para olvidar trabajos terminados hace más de API_RETENCION_HORAS
+def purgar_trabajos():
+    limite = time.time() - API_RETENCION_HORAS * 3600
+    with trabajos_lock:
+        for trabajo_id in [t for t, trabajo in trabajos.items() if trabajo.get("fin") and trabajo["fin"] < limite]:
+            del trabajos[trabajo_id]
+
+
+# Función que ejecuta un trabajo en el pool (extracción + generación)
+def ejecutar_trabajo(trabajo_id):
+    with trabajos_lock:
+        trabajo = dict(trabajos[trabajo_id])
+    actualizar_trabajo(trabajo_id, estado="procesando")
+    try:
+        hdu_text, hdu_json, error, info = generar_hdu(
+            trabajo["video_path"], trabajo["prompt"], trabajo["extra_context"], trabajo["modelo"],
+            video_hash=trabajo["video_hash"], limitador=limitador,
+        )
+    except Exception as e:
+        hdu_text, hdu_json, error, info = None, None, str(e), {}
+    finally:
+        # El video subido solo se necesita hasta terminar la extracción
+        os.remove(trabajo["video_path"])
+    if hdu_json is not None:
+        hdu_json.update({"video": trabajo["video"], "ruta": trabajo["video"]})
+    actualizar_trabajo(
+        trabajo_id,
+        estado="error" if error else "listo",
+        error=error,
+        cache=info.get("cache", False),
+        hdu_text=hdu_text,
+        hdu_json=hdu_json,
+        fin=time.time(),
+    )
+
+
+# Clase que recibe el formulario multipart bloque a bloque
+class FormularioStream:
+    """Escribe la parte `video` directo a su archivo definitivo mientras llega (una sola copia, memoria O(chunk)).
+
+    Los demás campos se acumulan en memoria hasta CAMPOS_MAX_BYTES. Los errores se lanzan como HTTPException
+    desde los callbacks del parser, así la subida se corta en cuanto se detecta el problema.
+    """
+
+    def __init__(self, boundary, max_bytes):
+        self.max_bytes = max_bytes
+        self.campos = {}
+        self.video = None
+        self.video_path = None
+        self.video_hash = None
+        self.total = 0
+        self._escritura = None
+        self._bytes_campos = 0
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._al_empezar_parte,
+            "on_header_field": self._al_recibir_encabezado,
+            "on_header_value": self._al_recibir_valor,
+            "on_header_end": self._al_terminar_encabezado,
+            "on_headers_finished": self._al_terminar_encabezados,
+            "on_part_data": self._al_recibir_datos,
+            "on_part_end": self._al_terminar_parte,
+        })
+
+    def _al_empezar_parte(self):
+        self._encabezados = {}
+        self._campo, self._valor = b"", b""
+        self._nombre = None
+        self._datos = []
+
+    def _al_recibir_encabezado(self, data, start, end):
+        self._campo += data[start:end]
+
+    def _al_recibir_valor(self, data, start, end):
+        self._valor += data[start:end]
+
+    def _al_terminar_encabezado(self):
+        self._encabezados[self._campo.decode("latin-1").lower()] = self._valor
+        self._campo, self._valor = b"", b""
+
+    def _al_terminar_encabezados(self):
+        _, parametros = parse_options_header(self._encabezados.get("content-disposition", b""))
+        self._nombre = parametros.get(b"name", b"").decode("utf-8")
+        if self._nombre != "video":
+            return
+        if self.video is not None:
+            raise HTTPException(status_code=422, detail="Se recibió más de un video")
+        self.video = parametros.get(b"filename", b"").decode("utf-8")
+        extension = os.path.splitext(self.video)[1].lower()
+        if extension not in EXTENSIONES_VIDEO:
+            raise HTTPException(status_code=415, detail=f"Formato no soportado: use {', '.join(EXTENSIONES_VIDEO)}")
+        fd, self.video_path = tempfile.mkstemp(suffix=extension)
+        os.close(fd)
+        self._escritura = EscrituraStream(self.video_path, max_bytes=self.max_bytes)
+
+    def _al_recibir_datos(self, data, start, end):
+        if self._nombre == "video":
+            try:
+                self._escritura.escribir(data[start:end])
+            except ValueError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            return
+        self._bytes_campos += end - start
+        if self._bytes_campos > CAMPOS_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Los campos del formulario son demasiado grandes")
+        self._datos.append(data[start:end])
+
+    def _al_terminar_parte(self):
+        if self._nombre == "video":
+            self.video_hash, self.total = self._escritura.cerrar()
+            self._escritura = None
+        elif self._nombre:
+            self.campos[self._nombre] = b"".join(self._datos).decode("utf-8")
+
+    def descartar(self):
+        """Borra el video (parcial o completo) si la subida no termina en un trabajo"""
+        if self._escritura is not None:
+            self._escritura.descartar()
+        if self.video_path and os.path.exists(self.video_path):
+            os.remove(self.video_path)
+
+
+@app.post("/trabajos", status_code=202)
+async def crear_trabajo(request: Request):
+    """Recibe el video por bloques directo a disco (una copia, memoria O(chunk)), lo encola y devuelve el id del trabajo"""
+    max_bytes = API_MAX_MB * 1024 * 1024
+    # Rechazar antes de leer el cuerpo si el cliente ya declara un tamaño mayor al permitido
+    largo = request.headers.get("content-length", "")
+    if largo.isdigit() and int(largo) > max_bytes + CAMPOS_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"El video supera el máximo de {API_MAX_MB:.0f} MB")
+    tipo, parametros = parse_options_header(request.headers.get("content-type", ""))
+    if tipo != b"multipart/form-data" or not parametros.get(b"boundary"):
+        raise HTTPException(status_code=422, detail="Se espera un formulario multipart/form-data")
+
+    # Escribir el video a disco a medida que llega, calculando el hash mientras se escribe
+    formulario = FormularioStream(parametros[b"boundary"], max_bytes)
+    try:
+        async for bloque in request.stream():
+            await run_in_threadpool(formulario.parser.write, bloque)
+        formulario.parser.finalize()
+        if formulario.video_hash is None:
+            raise HTTPException(status_code=422, detail="Falta el video")
+        prompt = formulario.campos.get("prompt")
+        extra_context = formulario.campos.get("extra_context", "")
+        modelo = formulario.campos.get("modelo") or hdu.default_gemini_models[0]
+        if modelo not in hdu.default_gemini_models and modelo != MODELO_AUTO:
+            raise HTTPException(status_code=422, detail=f"Modelo no soportado: {modelo}")
+    except MultipartParseError as e:
+        formulario.descartar()
+        raise HTTPException(status_code=400, detail=f"Formulario multipart inválido: {e}")
+    except BaseException:
+        formulario.descartar()
+        raise
+    purgar_trabajos()
+    video_path, video_hash, total = formulario.video_path, formulario.video_hash, formulario.total
+
+    trabajo_id = uuid.uuid4().hex
+    with trabajos_lock:
+        trabajos[trabajo_id] = {
+            "id": trabajo_id,
+            "estado": "en_cola",
+            "video": formulario.video,
+            "video_path": video_path,
+            "video_hash": video_hash,
+            "bytes": total,
+            "modelo": modelo,
+            "prompt": prompt or hdu.default_prompt(),
+            "extra_context": extra_context,
+            "creado": datetime.now().isoformat(),
+            "fin": None,
+            "error": None,
+        }
+    pool.submit(ejecutar_trabajo, trabajo_id)
+    return {"id": trabajo_id, "estado": "en_cola"}
+
+
+# Función para obtener un trabajo o responder 404
+def obtener_trabajo(trabajo_id):
+    with trabajos_lock:
+        trabajo = trabajos.get(trabajo_id)
+        if trabajo is None:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        return dict(trabajo)
+
+
+@app.get("/trabajos/{trabajo_id}")
+def estado_trabajo(trabajo_id: str):
+    trabajo = obtener_trabajo(trabajo_id)
+    campos = ("id", "estado", "video", "video_hash", "bytes", "modelo", "creado", "error", "cache")
+    return {campo: trabajo.get(campo) for campo in campos}
+
+
+@app.get("/trabajos/{trabajo_id}/hdu")
+def hdu_trabajo(trabajo_id: str):
+    trabajo = obtener_trabajo(trabajo_id)
+    if trabajo["estado"] == "error":
+        raise HTTPException(status_code=500, detail=trabajo["error"])
+    if trabajo["estado"] != "listo":
+        raise HTTPException(status_code=409, detail=f"El trabajo aún no termina (estado: {trabajo['estado']})")
+    return {"hdu_text": trabajo["hdu_text"], "hdu_json": trabajo["hdu_json"]}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def exponer_metricas():
+    return PlainTextResponse(metricas.registro.exponer(), media_type="text/plain; version=0.0.4")
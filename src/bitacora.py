@@ -0,0 +1,94 @@
+import os
+import json
+from datetime import datetime
+
+# Bitácora append-only de cada corrida del procesamiento masivo (una línea JSON por evento)
+PREFIJO_BITACORA = "procesamiento_hdu_"
+EXTENSION_BITACORA = ".jsonl"
+# Estados con los que un video se considera terminado (los errores se reintentan al reanudar)
+ESTADOS_TERMINADOS = ("ok", "omitido")
+
+
+class Bitacora:
+    """Registro append-only de una corrida: inicio, un evento por video y fin.
+
+    Cada evento se escribe y sincroniza a disco apenas ocurre, de modo que un rerun
+    de Streamlit o una caída a mitad del lote no pierde el avance. Una línea final
+    truncada por una caída se ignora al leer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def crear(cls, carpeta, videos, **config):
+        """Crea la bitácora de una corrida nueva con la lista de videos a procesar"""
+        path = os.path.join(carpeta, f"{PREFIJO_BITACORA}{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXTENSION_BITACORA}")
+        bitacora = cls(path)
+        bitacora._escribir({"tipo": "inicio", "fecha": datetime.now().isoformat(), "videos": list(videos), "config": config})
+        return bitacora
+
+    def _escribir(self, evento):
+        linea = (json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.path, "ab+") as f:
+            # Si una caída dejó una línea truncada, el evento empieza en una línea nueva
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    linea = b"\n" + linea
+            f.write(linea)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def registrar(self, video_path, estado, **datos):
+        """Registra el resultado de un video: "ok", "error" u "omitido" """
+        self._escribir({"tipo": "video", "fecha": datetime.now().isoformat(), "video": video_path, "estado": estado, **datos})
+
+    def reanudar(self):
+        self._escribir({"tipo": "reanudacion", "fecha": datetime.now().isoformat()})
+
+    def finalizar(self, resumen):
+        self._escribir({"tipo": "fin", "fecha": datetime.now().isoformat(), "resumen": resumen})
+
+    def leer(self):
+        """Devuelve (inicio, eventos_de_video, finalizada)"""
+        inicio, videos, finalizada = None, [], False
+        with open(self.path, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    evento = json.loads(linea)
+                except ValueError:
+                    continue
+                if evento["tipo"] == "inicio":
+                    inicio = evento
+                elif evento["tipo"] == "video":
+                    videos.append(evento)
+                elif evento["tipo"] == "fin":
+                    finalizada = True
+        return inicio, videos, finalizada
+
+    def estados(self):
+        """Último estado registrado de cada video {video_path: evento}"""
+        return {evento["video"]: evento for evento in self.leer()[1]}
+
+    def pendientes(self):
+        """Videos de la corrida que aún no terminan, en el orden original (sin revisar archivos _HDU)"""
+        inicio, _, _ = self.leer()
+        estados = self.estados()
+        return [video for video in inicio["videos"] if estados.get(video, {}).get("estado") not in ESTADOS_TERMINADOS]
+
+
+# Función para encontrar la última corrida sin terminar de una carpeta
+def ultima_bitacora_pendiente(carpeta):
+    """Devuelve la Bitacora de la corrida más reciente si quedó a medias, o None"""
+    nombres = sorted(
+        entry.name for entry in os.scandir(carpeta)
+        if entry.is_file() and entry.name.startswith(PREFIJO_BITACORA) and entry.name.endswith(EXTENSION_BITACORA)
+    )
+    if not nombres:
+        return None
+    bitacora = Bitacora(os.path.join(carpeta, nombres[-1]))
+    inicio, _, finalizada = bitacora.leer()
+    if inicio is None or finalizada:
+        return None
+    return bitacora
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+# Configuración por defecto (se puede sobreescribir con variables de entorno / .env)
+CACHE_DIR_DEFAULT = os.path.join(os.path.expanduser("~"), ".cache", "user-stories-ai")
+CACHE_MAX_MB_DEFAULT = 200
+CACHE_MAX_DIAS_DEFAULT = 30
+CACHE_FRAMES_MAX_MB_DEFAULT = 500
+CHUNK_SIZE = 1024 * 1024
+
+
+# Función para obtener el directorio de una sección del cache
+def directorio_cache(seccion):
+    """Devuelve (y crea si no existe) el directorio del cache para `seccion`"""
+    base = os.getenv("HDU_CACHE_DIR", CACHE_DIR_DEFAULT)
+    path = os.path.join(base, seccion)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Función para calcular el hash del contenido de un video
+def calcular_hash_video(video_path, chunk_size=CHUNK_SIZE):
+    """Calcula el SHA-256 del archivo leyendo por bloques (memoria O(chunk))"""
+    h = hashlib.sha256()
+    with open(video_path, "rb") as f:
+        for bloque in iter(lambda: f.read(chunk_size), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+# Clase para escribir a disco por bloques calculando el hash
+class EscrituraStream:
+    """Escribe bloques en un temporal junto a `path` y lo publica atómicamente con `cerrar`.
+
+    Lanza ValueError al superar `max_bytes`; `descartar` borra el temporal sin dejar archivos parciales.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        self._archivo = os.fdopen(fd, "wb")
+
+    def escribir(self, bloque):
+        self.total += len(bloque)
+        if self.max_bytes is not None and self.total > self.max_bytes:
+            raise ValueError(f"El video supera el máximo de {self.max_bytes / (1024 * 1024):.0f} MB")
+        self._hash.update(bloque)
+        self._archivo.write(bloque)
+
+    def cerrar(self):
+        """Publica el archivo en `path` y devuelve (hash_sha256, bytes_copiados)"""
+        self._archivo.close()
+        os.replace(self._tmp_path, self.path)
+        return self._hash.hexdigest(), self.total
+
+    def descartar(self):
+        self._archivo.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+# Función para copiar un stream a disco por bloques calculando su hash
+def guardar_stream(fuente, path, max_bytes=None, chunk_size=CHUNK_SIZE):
+    """Copia `fuente` (objeto con .read()) a `path` de forma atómica y sin cargarlo completo en memoria.
+
+    Devuelve (hash_sha256, bytes_copiados). Lanza ValueError si se superan `max_bytes`;
+    en ese caso no queda ningún archivo parcial.
+    """
+    escritura = EscrituraStream(path, max_bytes)
+    try:
+        for bloque in iter(lambda: fuente.read(chunk_size), b""):
+            escritura.escribir(bloque)
+        return escritura.cerrar()
+    except BaseException:
+        escritura.descartar()
+        raise
+
+
+# Función para construir la clave del cache de resultados
+def clave_resultado(video_hash, selected_model, prompt, extra_context, opciones=None):
+    """Clave determinística a partir del contenido del video, modelo, prompts y opciones de generación"""
+    payload = json.dumps([video_hash, selected_model, prompt, extra_context, opciones or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Función para construir la clave del cache de frames extraídos
+def clave_frames(video_hash, opciones):
+    """Clave a partir del contenido del video y de las opciones que determinan qué frames se extraen y cómo se codifican"""
+    payload = json.dumps([video_hash, opciones], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Función para escribir un archivo de forma atómica
+def escribir_atomico(path, data):
+    """Escribe `data` (bytes) en un temporal del mismo directorio y lo renombra"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp crea el archivo con permisos 0600; conservar los del archivo reemplazado
+        os.chmod(tmp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Función para eliminar entradas vencidas y mantener el cache bajo el tamaño máximo
+def purgar_cache(seccion, max_mb=None, max_dias=None):
+    """Elimina entradas más antiguas que `max_dias` y luego las menos usadas hasta quedar bajo `max_mb`"""
+    if max_mb is None:
+        max_mb = float(os.getenv("HDU_CACHE_MAX_MB", CACHE_MAX_MB_DEFAULT))
+    if max_dias is None:
+        max_dias = float(os.getenv("HDU_CACHE_MAX_DIAS", CACHE_MAX_DIAS_DEFAULT))
+    directorio = directorio_cache(seccion)
+    ahora = time.time()
+    entradas = []
+    for entry in os.scandir(directorio):
+        if not entry.is_file() or entry.name.startswith(".tmp_"):
+            continue
+        stat = entry.stat()
+        if ahora - stat.st_mtime > max_dias * 86400:
+            os.remove(entry.path)
+            continue
+        entradas.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entradas)
+    limite = max_mb * 1024 * 1024
+    # Las entradas con mtime más antiguo son las usadas hace más tiempo (se "tocan" en cada hit)
+    for _, size, path in sorted(entradas):
+        if total <= limite:
+            break
+        os.remove(path)
+        total -= size
+
+
+# Función para buscar una entrada JSON en una sección del cache
+def buscar_entrada(seccion, clave, max_dias=None):
+    """Devuelve la entrada (dict) si existe y está vigente, o None"""
+    if max_dias is None:
+        max_dias = float(os.getenv("HDU_CACHE_MAX_DIAS", CACHE_MAX_DIAS_DEFAULT))
+    path = os.path.join(directorio_cache(seccion), clave + ".json")
+    try:
+        if time.time() - os.path.getmtime(path) > max_dias * 86400:
+            os.remove(path)
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entrada = json.load(f)
+        os.utime(path)  # Marcar como usada recientemente
+        return entrada
+    except (OSError, ValueError):
+        return None
+
+
+# Función para guardar una entrada JSON en una sección del cache
+def guardar_entrada(seccion, clave, entrada):
+    """Guarda la entrada de forma atómica y aplica la política de expulsión de la sección"""
+    path = os.path.join(directorio_cache(seccion), clave + ".json")
+    escribir_atomico(path, json.dumps(entrada, ensure_ascii=False).encode("utf-8"))
+    purgar_cache(seccion)
+
+
+# Función para buscar un resultado en el cache
+def buscar_resultado(clave, max_dias=None):
+    """Devuelve (hdu_text, hdu_json) si existe una entrada vigente, o (None, None)"""
+    entrada = buscar_entrada("hdu", clave, max_dias)
+    if entrada is None or "hdu_text" not in entrada:
+        return None, None
+    return entrada["hdu_text"], entrada["hdu_json"]
+
+
+# Función para guardar un resultado en el cache
+def guardar_resultado(clave, hdu_text, hdu_json):
+    guardar_entrada("hdu", clave, {"hdu_text": hdu_text, "hdu_json": hdu_json})
+
+
+# Función para buscar una entrada binaria (cabecera JSON + bloques de bytes) en una sección del cache
+def buscar_binario(seccion, clave):
+    """Devuelve (cabecera, bloques) o (None, None). Marca la entrada como usada recientemente"""
+    path = os.path.join(directorio_cache(seccion), clave + ".bin")
+    try:
+        with open(path, "rb") as f:
+            largo = int.from_bytes(f.read(8), "little")
+            cabecera = json.loads(f.read(largo).decode("utf-8"))
+            tamanos = cabecera.pop("_tamanos")
+            bloques = [f.read(tamano) for tamano in tamanos]
+        if [len(bloque) for bloque in bloques] != tamanos:
+            return None, None
+        os.utime(path)
+        return cabecera, bloques
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+# Función para guardar una entrada binaria en una sección del cache
+def guardar_binario(seccion, clave, cabecera, bloques, max_mb=None):
+    """Guarda `cabecera` (dict serializable) y `bloques` (bytes) en un solo archivo y aplica LRU por bytes"""
+    encabezado = json.dumps(dict(cabecera, _tamanos=[len(bloque) for bloque in bloques]), ensure_ascii=False).encode("utf-8")
+    path = os.path.join(directorio_cache(seccion), clave + ".bin")
+    escribir_atomico(path, len(encabezado).to_bytes(8, "little") + encabezado + b"".join(bloques))
+    purgar_cache(seccion, max_mb)
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from cache import directorio_cache
+
+# Catálogo local (SQLite) de videos y sus HDU, actualizado de forma incremental
+EXTENSIONES_VIDEO = (".mp4", ".mov", ".avi")
+SUFIJOS_HDU = ("_HDU.txt", "_HDU.json")
+# Un directorio modificado hace menos de esto se vuelve a listar en la próxima pasada
+# (sistemas de archivos con mtime de baja resolución, p. ej. recursos de red)
+MARGEN_MTIME_SEGUNDOS = 2
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS directorios (
+    path TEXT PRIMARY KEY,
+    padre TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS directorios_padre ON directorios(padre);
+CREATE TABLE IF NOT EXISTS videos (
+    path TEXT PRIMARY KEY,
+    directorio TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT,
+    tiene_hdu INTEGER NOT NULL DEFAULT 0,
+    modelo TEXT,
+    generado TEXT,
+    hdu_text TEXT,
+    hdu_json TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS videos_directorio ON videos(directorio);
+"""
+
+
+# Función para obtener los límites de un rango de paths con el mismo prefijo (usa el índice de la clave)
+def rango_prefijo(carpeta):
+    prefijo = os.path.join(carpeta, "")
+    return prefijo, prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+
+class Catalogo:
+    """Índice de videos por path (con tamaño, mtime y hash de contenido) y de sus HDU generadas.
+
+    `actualizar(carpeta)` recorre la carpeta con `os.scandir` y solo vuelve a listar los
+    directorios cuyo mtime cambió desde la pasada anterior (agregar, borrar o renombrar
+    archivos, incluido escribir un _HDU de forma atómica, cambia el mtime del
+    directorio). El resto de las consultas se responde desde el índice. Cada
+    operación abre su propia conexión, así que se puede usar desde cualquier hilo.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("HDU_CATALOGO") or os.path.join(directorio_cache("catalogo"), "catalogo.sqlite3")
+        with self._conectar() as con:
+            con.executescript(ESQUEMA)
+            # Catálogos creados antes de guardar la metadata de cada video
+            if "metadata" not in {columna for _, columna, *_ in con.execute("PRAGMA table_info(videos)")}:
+                con.execute("ALTER TABLE videos ADD COLUMN metadata TEXT")
+
+    @contextmanager
+    def _conectar(self):
+        """Conexión que confirma la transacción al salir (o la deshace si hubo error) y se cierra"""
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def actualizar(self, carpeta):
+        """Sincroniza el catálogo con `carpeta`. Devuelve la cantidad de directorios listados"""
+        carpeta = os.path.abspath(carpeta)
+        listados = 0
+        with self._conectar() as con:
+            pendientes = [(carpeta, None)]
+            while pendientes:
+                directorio, padre = pendientes.pop()
+                try:
+                    mtime_ns = os.stat(directorio).st_mtime_ns
+                except OSError:
+                    self._olvidar(con, directorio)
+                    continue
+                fila = con.execute("SELECT mtime_ns FROM directorios WHERE path = ?", (directorio,)).fetchone()
+                if fila is not None and fila[0] == mtime_ns:
+                    # Directorio sin cambios: no se lista, solo se baja a sus subdirectorios conocidos
+                    hijos = con.execute("SELECT path FROM directorios WHERE padre = ?", (directorio,)).fetchall()
+                    pendientes.extend((hijo, directorio) for hijo, in hijos)
+                    continue
+                subdirectorios = self._listar(con, directorio)
+                listados += 1
+                # Con un mtime muy reciente pueden llegar más cambios en el mismo "tic" del reloj del FS
+                if time.time() - mtime_ns / 1e9 < MARGEN_MTIME_SEGUNDOS:
+                    mtime_ns = -1
+                con.execute(
+                    "INSERT INTO directorios (path, padre, mtime_ns) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET padre = COALESCE(excluded.padre, padre), mtime_ns = excluded.mtime_ns",
+                    (directorio, padre, mtime_ns),
+                )
+                for hijo, in con.execute("SELECT path FROM directorios WHERE padre = ?", (directorio,)).fetchall():
+                    if hijo not in subdirectorios:
+                        self._olvidar(con, hijo)
+                pendientes.extend((hijo, directorio) for hijo in subdirectorios)
+        return listados
+
+    def _listar(self, con, directorio):
+        """Lista un directorio, actualiza sus videos y devuelve sus subdirectorios"""
+        subdirectorios = set()
+        archivos = {}
+        nombres = set()
+        with os.scandir(directorio) as entradas:
+            for entry in entradas:
+                # Igual que glob: se ignoran archivos y carpetas ocultos
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectorios.add(entry.path)
+                elif entry.is_file():
+                    nombres.add(entry.name)
+                    if entry.name.endswith(EXTENSIONES_VIDEO):
+                        stat = entry.stat()
+                        archivos[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        anteriores = dict(con.execute("SELECT path, size || ':' || mtime_ns FROM videos WHERE directorio = ?", (directorio,)).fetchall())
+        for path in anteriores.keys() - archivos.keys():
+            con.execute("DELETE FROM videos WHERE path = ?", (path,))
+        for path, (size, mtime_ns) in archivos.items():
+            base = os.path.splitext(os.path.basename(path))[0]
+            tiene_hdu = all(base + sufijo in nombres for sufijo in SUFIJOS_HDU)
+            if anteriores.get(path) == f"{size}:{mtime_ns}":
+                con.execute("UPDATE videos SET tiene_hdu = ? WHERE path = ?", (tiene_hdu, path))
+            else:
+                # Video nuevo o modificado: el hash y la HDU guardados ya no corresponden a su contenido
+                con.execute(
+                    "INSERT OR REPLACE INTO videos (path, directorio, size, mtime_ns, tiene_hdu) VALUES (?, ?, ?, ?, ?)",
+                    (path, directorio, size, mtime_ns, tiene_hdu),
+                )
+        return subdirectorios
+
+    def _olvidar(self, con, directorio):
+        """Elimina un directorio eliminado (y todo lo que contenía) del catálogo"""
+        desde, hasta = rango_prefijo(directorio)
+        con.execute("DELETE FROM directorios WHERE path = ? OR (path >= ? AND path < ?)", (directorio, desde, hasta))
+        con.execute("DELETE FROM videos WHERE path >= ? AND path < ?", (desde, hasta))
+
+    def videos(self, carpeta):
+        """Devuelve [(video_path, tiene_hdu)] de la carpeta (recursivo), ordenados por path"""
+        desde, hasta = rango_prefijo(os.path.abspath(carpeta))
+        with self._conectar() as con:
+            filas = con.execute("SELECT path, tiene_hdu FROM videos WHERE path >= ? AND path < ? ORDER BY path", (desde, hasta)).fetchall()
+        return [(path, bool(tiene_hdu)) for path, tiene_hdu in filas]
+
+    def archivos(self, carpeta):
+        """Devuelve {video_path: (size, mtime_ns, tiene_hdu)} de la carpeta (recursivo)"""
+        desde, hasta = rango_prefijo(os.path.abspath(carpeta))
+        with self._conectar() as con:
+            filas = con.execute("SELECT path, size, mtime_ns, tiene_hdu FROM videos WHERE path >= ? AND path < ?", (desde, hasta)).fetchall()
+        return {path: (size, mtime_ns, bool(tiene_hdu)) for path, size, mtime_ns, tiene_hdu in filas}
+
+    def metadatas(self, carpeta):
+        """Devuelve {video_path: metadata} de la carpeta (recursivo); None si el video aún no se inspeccionó
+        o cambió desde entonces (al cambiar el tamaño o el mtime la fila se reemplaza y la metadata se descarta)
+        """
+        desde, hasta = rango_prefijo(os.path.abspath(carpeta))
+        with self._conectar() as con:
+            filas = con.execute("SELECT path, metadata FROM videos WHERE path >= ? AND path < ?", (desde, hasta)).fetchall()
+        return {path: json.loads(metadata) if metadata else None for path, metadata in filas}
+
+    def registrar_metadatas(self, inspeccionados):
+        """Guarda {video_path: (size, mtime_ns, metadata)} (ver `inspeccion.inspeccionar_videos`).
+
+        Si el archivo cambió entre el listado y la inspección no se guarda (se inspecciona en la
+        próxima pasada). Los fallos sin tamaño ni mtime (tiempo agotado) se guardan igual, para no
+        esperarlos en cada pasada: se reintentan cuando el archivo cambia
+        """
+        with self._conectar() as con:
+            for path, (size, mtime_ns, metadata) in inspeccionados.items():
+                if size is None:
+                    con.execute("UPDATE videos SET metadata = ? WHERE path = ?", (json.dumps(metadata), path))
+                else:
+                    con.execute("UPDATE videos SET metadata = ? WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                (json.dumps(metadata), path, size, mtime_ns))
+
+    def historial(self, carpeta):
+        """Devuelve [(metadata, hdu_json)] de los videos de la carpeta con HDU registrada y metadata"""
+        desde, hasta = rango_prefijo(os.path.abspath(carpeta))
+        with self._conectar() as con:
+            filas = con.execute("SELECT metadata, hdu_json FROM videos WHERE path >= ? AND path < ? AND metadata IS NOT NULL "
+                                "AND hdu_json IS NOT NULL", (desde, hasta)).fetchall()
+        return [(json.loads(metadata), json.loads(hdu_json)) for metadata, hdu_json in filas]
+
+    def registrar_hdu(self, video_path, hdu_text, hdu_json):
+        """Guarda la HDU generada (y el hash del contenido) de un video del catálogo"""
+        with self._conectar() as con:
+            con.execute(
+                "UPDATE videos SET tiene_hdu = 1, hash = ?, modelo = ?, generado = ?, hdu_text = ?, hdu_json = ? WHERE path = ?",
+                (hdu_json.get("video_hash"), hdu_json.get("modelo"), hdu_json.get("timestamp") or datetime.now().isoformat(),
+                 hdu_text, json.dumps(hdu_json, ensure_ascii=False), os.path.abspath(video_path)),
+            )
@@ -0,0 +1,125 @@
+import heapq
+import cv2
+import numpy as np
+
+# Ancho de las miniaturas en escala de grises usadas para comparar frames
+ANCHO_MINIATURA = 64
+BINS_HISTOGRAMA = 32
+# Lado del dHash: 16 => hash de 256 bits (más fino que 8x8 para pantallas de apps muy parecidas)
+TAMANO_HASH = 16
+
+
+# Función para reducir un frame a una miniatura en escala de grises
+def miniatura(frame):
+    alto, ancho = frame.shape[:2]
+    alto_miniatura = max(1, round(alto * ANCHO_MINIATURA / ancho))
+    gris = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gris, (ANCHO_MINIATURA, alto_miniatura), interpolation=cv2.INTER_AREA)
+
+
+# Función para calcular la diferencia visual entre dos miniaturas
+def diferencia(a, b):
+    """Promedio entre la diferencia media por píxel y la distancia L1 de histogramas (ambas en [0, 1])"""
+    pixeles = np.abs(a.astype(np.int16) - b.astype(np.int16)).mean() / 255
+    hist_a = np.bincount((a // (256 // BINS_HISTOGRAMA)).ravel(), minlength=BINS_HISTOGRAMA) / a.size
+    hist_b = np.bincount((b // (256 // BINS_HISTOGRAMA)).ravel(), minlength=BINS_HISTOGRAMA) / b.size
+    histograma = np.abs(hist_a - hist_b).sum() / 2
+    return float((pixeles + histograma) / 2)
+
+
+# Función para seleccionar los momentos visualmente distintos de un video
+def seleccionar_escenas(cap, metadata, max_frames, umbral=0.08, fps_analisis=2, conteo=None, reducir=None):
+    """Recorre el video una vez y elige hasta `max_frames` frames en cambios de pantalla.
+
+    Se analizan `fps_analisis` frames por segundo (el resto solo se hace grab()). Un
+    frame es candidato cuando su miniatura difiere de la última pantalla de referencia
+    en más de `umbral`; se conservan el primer frame y los candidatos con mayor
+    diferencia, de modo que en memoria nunca hay más de `max_frames` frames completos.
+    Devuelve (frames_bgr, timestamps, puntajes) ordenados por tiempo. Con `conteo` (dict)
+    se registran en `conteo["pantallas"]` todas las pantallas detectadas, no solo las conservadas.
+    Con `reducir` (función frame -> frame) cada frame se reduce apenas se conserva, así que
+    en memoria hay a lo sumo un frame completo (el actual) y `max_frames` frames reducidos.
+    """
+    reducir = reducir or (lambda frame: frame)
+    fps = metadata["fps"]
+    if not fps or max_frames <= 0:
+        return [], [], []
+    paso = max(1, round(fps / fps_analisis))
+    mejores = []  # heap de (puntaje, indice, frame)
+    pantallas = 0
+    referencia = None
+    idx = 0
+    while cap.grab():
+        if idx % paso == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                actual = miniatura(frame)
+                if referencia is None:
+                    # El primer frame siempre se conserva (puntaje infinito)
+                    heapq.heappush(mejores, (float("inf"), idx, reducir(frame)))
+                    referencia = actual
+                    pantallas = 1
+                else:
+                    puntaje = diferencia(referencia, actual)
+                    if puntaje > umbral:
+                        referencia = actual
+                        pantallas += 1
+                        if len(mejores) < max_frames:
+                            heapq.heappush(mejores, (puntaje, idx, reducir(frame)))
+                        elif puntaje > mejores[0][0]:
+                            heapq.heapreplace(mejores, (puntaje, idx, reducir(frame)))
+        idx += 1
+    if conteo is not None:
+        conteo["pantallas"] = pantallas
+    seleccion = sorted(mejores, key=lambda item: item[1])
+    return [frame for _, _, frame in seleccion], [round(i / fps, 1) for _, i, _ in seleccion], [p for p, _, _ in seleccion]
+
+
+# Función para calcular el hash perceptual (dHash) de un frame
+def dhash(frame, tamano=TAMANO_HASH):
+    """Compara píxeles vecinos de una miniatura de (tamano+1)x tamano; devuelve tamano² bits empaquetados"""
+    gris = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    pequeno = cv2.resize(gris, (tamano + 1, tamano), interpolation=cv2.INTER_AREA)
+    return np.packbits(pequeno[:, 1:] > pequeno[:, :-1])
+
+
+# Función para calcular la distancia de Hamming entre dos hashes
+def distancia_hamming(a, b):
+    return int(np.unpackbits(np.bitwise_xor(a, b)).sum())
+
+
+# Función para descartar frames casi idénticos y completar con otros candidatos
+def deduplicar_frames(candidatos, max_frames, umbral=10):
+    """Recorre `candidatos` [(frame, segundo)] en orden de prioridad y conserva hasta `max_frames`.
+
+    Un candidato se fusiona (descarta) si su dHash está a distancia de Hamming ≤ `umbral`
+    de un frame ya conservado; su cupo queda para el siguiente candidato. Devuelve
+    (frames, timestamps, registro) ordenados por tiempo, donde `registro` indica qué
+    instantes se conservaron y cuáles se fusionaron con cuál, para poder auditar el ahorro.
+    """
+    conservados = []  # (segundo, frame, hash)
+    fusionados = []
+    evaluados = 0
+    for frame, sec in candidatos:
+        if len(conservados) >= max_frames:
+            break
+        evaluados += 1
+        hash_frame = dhash(frame)
+        duplicado = None
+        for sec_conservado, _, hash_conservado in conservados:
+            distancia = distancia_hamming(hash_frame, hash_conservado)
+            if distancia <= umbral:
+                duplicado = (sec_conservado, distancia)
+                break
+        if duplicado is None:
+            conservados.append((sec, frame, hash_frame))
+        else:
+            fusionados.append({"timestamp": sec, "fusionado_con": duplicado[0], "distancia": duplicado[1]})
+    conservados.sort(key=lambda item: item[0])
+    registro = {
+        "umbral": umbral,
+        "candidatos_evaluados": evaluados,
+        "conservados": [sec for sec, _, _ in conservados],
+        "fusionados": fusionados,
+    }
+    return [frame for _, frame, _ in conservados], [sec for sec, _, _ in conservados], registro
@@ -0,0 +1,367 @@
+import os
+import re
+import time
+import random
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+from lote import ConcurrenciaAdaptativa
+from metricas import registro
+
+# Configuración del cache de contexto (variables de entorno / .env)
+CONTEXTO_TTL_MIN_DEFAULT = 60
+# Se renueva el contexto este número de segundos antes de que venza en el servidor
+CONTEXTO_MARGEN_SEGUNDOS = 60
+# Mínimo de tokens que la API acepta en un contenido cacheado, por prefijo del modelo (documentación de
+# Gemini); HDU_CONTEXTO_MIN_TOKENS lo reemplaza para todos. Bajo el mínimo el prompt se envía completo
+CONTEXTO_MIN_TOKENS = {"gemini-1.5": 32768, "gemini-2.5-pro": 4096, "gemini-2.5-flash": 1024}
+CONTEXTO_MIN_TOKENS_DEFAULT = 4096
+
+# Reintentos ante errores transitorios (variables de entorno / .env): cantidad máxima y
+# backoff exponencial con jitter completo entre 0 y min(tope, base * 2^intento) segundos
+REINTENTOS_DEFAULT = 5
+REINTENTO_BASE_SEGUNDOS = 1.0
+REINTENTO_TOPE_SEGUNDOS = 60.0
+# Máximo de solicitudes simultáneas a Gemini en el proceso (el límite adaptativo nunca lo supera)
+CONCURRENCIA_MAX_DEFAULT = 32
+# Códigos HTTP que indican un error transitorio: tiempo agotado, cuota (429) y errores del servidor
+CODIGOS_REINTENTABLES = (408, 429, 500, 502, 503, 504)
+CODIGO_LIMITE_CUOTA = 429
+
+log = logging.getLogger("gemini")
+# Códigos con los que la API rechaza un contexto cacheado vencido o eliminado (NotFound, PermissionDenied)
+CODIGOS_CONTEXTO_INVALIDO = (403, 404)
+
+
+# Función para calcular los bytes de una solicitud (textos en UTF-8 y blobs {mime_type, data})
+def bytes_contenido(contenido):
+    return sum(len(parte.encode("utf-8")) if isinstance(parte, str) else len(parte["data"]) for parte in contenido)
+
+
+# Función para obtener el código HTTP de un error de la API
+def codigo_error(error):
+    """Usa `error.code` (excepciones de google.api_core) o el código al inicio del mensaje ("429 ...")"""
+    codigo = getattr(error, "code", None)
+    if isinstance(codigo, int):
+        return codigo
+    coincidencia = re.match(r"\s*(\d{3})\b", str(error))
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+# Función para distinguir los errores transitorios (se reintentan) de los definitivos
+def es_reintentable(error):
+    return codigo_error(error) in CODIGOS_REINTENTABLES or isinstance(error, (ConnectionError, TimeoutError))
+
+
+# Función para reconocer los errores de un contexto cacheado que ya no existe en el servidor (se vuelve a crear)
+def es_contexto_invalido(error):
+    return codigo_error(error) in CODIGOS_CONTEXTO_INVALIDO
+
+
+class ClienteGemini:
+    """Cliente real de Gemini (google.generativeai, que se importa recién al crear el cliente)"""
+
+    def __init__(self):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self.genai = genai
+
+    def generar(self, selected_model, contenido, contexto=None, stream=False):
+        """Llama a generate_content; con `contexto` el prompt estático no se reenvía"""
+        if contexto is not None:
+            modelo = self.genai.GenerativeModel.from_cached_content(contexto)
+        else:
+            modelo = obtener_modelo(selected_model)
+        return modelo.generate_content(contenido, stream=stream)
+
+    def minimo_tokens_contexto(self, selected_model):
+        if os.getenv("HDU_CONTEXTO_MIN_TOKENS"):
+            return int(os.getenv("HDU_CONTEXTO_MIN_TOKENS"))
+        return next((minimo for prefijo, minimo in CONTEXTO_MIN_TOKENS.items() if selected_model.startswith(prefijo)), CONTEXTO_MIN_TOKENS_DEFAULT)
+
+    def crear_contexto(self, selected_model, texto, ttl_segundos):
+        """Registra `texto` como contenido cacheado del modelo y devuelve el handle"""
+        return self.genai.caching.CachedContent.create(model=selected_model, contents=[texto], ttl=timedelta(seconds=ttl_segundos))
+
+    def eliminar_contexto(self, contexto):
+        contexto.delete()
+
+
+# Función para obtener el modelo de Gemini (una instancia compartida por nombre de modelo)
+@lru_cache(maxsize=None)
+def obtener_modelo(selected_model):
+    import google.generativeai as genai
+    return genai.GenerativeModel(selected_model)
+
+
+class RespuestaLocal:
+    """Respuesta con la misma forma que la de google.generativeai (text, parts, usage_metadata, iterable en streaming)"""
+
+    def __init__(self, fragmentos, usage_metadata, latencia=0.0):
+        self._fragmentos = fragmentos
+        self._latencia = latencia
+        self.text = "".join(fragmentos)
+        self.parts = [self.text]
+        self.usage_metadata = usage_metadata
+
+    def __iter__(self):
+        for fragmento in self._fragmentos:
+            time.sleep(self._latencia / len(self._fragmentos))
+            yield SimpleNamespace(text=fragmento, parts=[fragmento])
+
+
+class ClienteLocal:
+    """Sustituto local de Gemini para pruebas sin red ni API key (GEMINI_BACKEND=local).
+
+    Devuelve una historia de usuario determinística, reporta `usage_metadata` con
+    tokens estimados (~4 caracteres por token, 258 por imagen) y simula el cache de
+    contexto: los contextos vencen a los `ttl_segundos` y usarlos vencidos falla
+    igual que en el servidor. `latencia` simula los segundos de cada respuesta,
+    `min_tokens_contexto` el mínimo de tokens que exige la API para cachear y
+    `tasa_error` la fracción de solicitudes que fallan con un error transitorio
+    (reproducible con `semilla`) y `tasa_incompletas` la fracción de respuestas de
+    modelos "flash" sin criterios de aceptación (para probar el escalado del ruteo).
+    `bytes_enviados` acumula lo que se habría subido.
+    """
+
+    def __init__(self, latencia=0.0, min_tokens_contexto=0, tasa_error=0.0, semilla=None, tasa_incompletas=0.0):
+        self.latencia = latencia
+        self.min_tokens_contexto = min_tokens_contexto
+        self.tasa_error = tasa_error
+        self.tasa_incompletas = tasa_incompletas
+        self.contextos_creados = 0
+        self.solicitudes = 0
+        self.bytes_enviados = 0
+        self._azar = random.Random(semilla)
+        self._contextos = {}  # nombre -> (tokens, vence)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tokens(contenido):
+        return sum(len(parte) // 4 if isinstance(parte, str) else 258 for parte in contenido)
+
+    def generar(self, selected_model, contenido, contexto=None, stream=False):
+        with self._lock:
+            self.solicitudes += 1
+            self.bytes_enviados += bytes_contenido(contenido)
+            falla = self._azar.random() < self.tasa_error
+            incompleta = "flash" in selected_model and self._azar.random() < self.tasa_incompletas
+        if falla:
+            time.sleep(self.latencia)
+            if self._azar.random() < 0.5:
+                raise RuntimeError("429 Resource has been exhausted (e.g. check quota). (error simulado)")
+            raise RuntimeError("503 The service is currently unavailable (error simulado)")
+        tokens_contexto = 0
+        if contexto is not None:
+            with self._lock:
+                tokens_contexto, vence = self._contextos.get(contexto.name, (0, 0))
+            if time.time() >= vence:
+                raise RuntimeError(f"404 CachedContent not found (or expired): {contexto.name}")
+        imagenes = sum(1 for parte in contenido if not isinstance(parte, str))
+        fragmentos = [
+            f"**Historia de usuario** (respuesta local de {selected_model})\n\n",
+            "Como usuario de la app, quiero completar el flujo mostrado en el video ",
+            f"para lograr mi objetivo. Se analizaron {imagenes} pantallas.\n\n",
+            "**Criterios de aceptación**\n\n- Dado que estoy en la app, cuando sigo el flujo, entonces veo cada pantalla.\n",
+        ]
+        if incompleta:
+            fragmentos = fragmentos[:2]
+        # Solicitud empaquetada (ver `pipeline.Empaquetador`): una historia por video entre sus marcadores
+        videos = sorted({int(numero) for parte in contenido if isinstance(parte, str) for numero in re.findall(r"<<<HDU (\d+)>>>", parte)})
+        if videos:
+            fragmentos = [fragmento for numero in videos for fragmento in (f"<<<HDU {numero}>>>\n", *fragmentos, f"<<<FIN {numero}>>>\n")]
+        tokens_prompt = tokens_contexto + self._tokens(contenido)
+        tokens_respuesta = sum(len(fragmento) for fragmento in fragmentos) // 4
+        uso = SimpleNamespace(
+            prompt_token_count=tokens_prompt,
+            cached_content_token_count=tokens_contexto,
+            candidates_token_count=tokens_respuesta,
+            total_token_count=tokens_prompt + tokens_respuesta,
+        )
+        if stream:
+            return RespuestaLocal(fragmentos, uso, self.latencia)
+        time.sleep(self.latencia)
+        return RespuestaLocal(fragmentos, uso)
+
+    def minimo_tokens_contexto(self, selected_model):
+        return self.min_tokens_contexto
+
+    def crear_contexto(self, selected_model, texto, ttl_segundos):
+        tokens = len(texto) // 4
+        if tokens < self.min_tokens_contexto:
+            raise ValueError(f"400 Cached content is too small: {tokens} < {self.min_tokens_contexto} tokens")
+        with self._lock:
+            self.contextos_creados += 1
+            self.bytes_enviados += len(texto.encode("utf-8"))
+            nombre = f"cachedContents/local-{self.contextos_creados}"
+            self._contextos[nombre] = (tokens, time.time() + ttl_segundos)
+        return SimpleNamespace(name=nombre, model=selected_model)
+
+    def eliminar_contexto(self, contexto):
+        with self._lock:
+            self._contextos.pop(contexto.name, None)
+
+
+class GestorContextos:
+    """Registra el prompt estático como contexto cacheado y lo reutiliza entre solicitudes.
+
+    Hay un contexto vigente por modelo. Se vuelve a crear cuando vence (con
+    CONTEXTO_MARGEN_SEGUNDOS de anticipación), cuando cambia el texto del prompt o
+    cuando se invalida tras un error. El contexto anterior no se elimina al renovarlo
+    (puede haber solicitudes en curso que lo usan): vence solo por su TTL. Un prompt bajo
+    el mínimo de tokens del modelo (`cliente.minimo_tokens_contexto`) no se registra, y
+    si la API rechaza el contexto el rechazo se recuerda hasta el vencimiento; en ambos
+    casos `obtener` devuelve None (se avisa en el log una vez por modelo) y las
+    solicitudes envían el prompt completo. Es seguro entre hilos.
+    """
+
+    def __init__(self, cliente, ttl_segundos=CONTEXTO_TTL_MIN_DEFAULT * 60):
+        self.cliente = cliente
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._contextos = {}  # modelo -> (hash del texto, contexto o None, vence)
+        self._creando = {}  # modelo -> lock que serializa la creación de su contexto
+        self._avisados = set()  # modelos sin contexto ya informados en el log
+
+    def _vigente(self, selected_model, huella):
+        actual = self._contextos.get(selected_model)
+        if actual and actual[0] == huella and time.time() < actual[2] - CONTEXTO_MARGEN_SEGUNDOS:
+            return actual
+        return None
+
+    def obtener(self, selected_model, texto):
+        minimo = self.cliente.minimo_tokens_contexto(selected_model)
+        if len(texto) // 4 < minimo:
+            self._avisar(selected_model, f"el prompt (~{len(texto) // 4} tokens) está bajo el mínimo de {minimo} tokens del modelo")
+            return None
+        huella = hashlib.sha256(texto.encode("utf-8")).hexdigest()
+        with self._lock:
+            actual = self._vigente(selected_model, huella)
+            if actual:
+                return actual[1]
+            creando = self._creando.setdefault(selected_model, threading.Lock())
+        # Las llamadas a la API van fuera del lock global: crear el contexto de un modelo no
+        # bloquea a los hilos que usan el de otro; los del mismo modelo esperan y lo reutilizan
+        with creando:
+            with self._lock:
+                actual = self._vigente(selected_model, huella)
+                if actual:
+                    return actual[1]
+            # El contexto anterior no se elimina: las solicitudes en curso lo siguen usando hasta su TTL
+            try:
+                contexto = self.cliente.crear_contexto(selected_model, texto, self.ttl_segundos)
+            except Exception as e:
+                self._avisar(selected_model, f"la API rechazó el contexto ({e})")
+                contexto = None
+            with self._lock:
+                self._contextos[selected_model] = (huella, contexto, time.time() + self.ttl_segundos)
+            return contexto
+
+    def invalidar(self, selected_model, contexto=None):
+        """Olvida el contexto del modelo (p. ej. vencido en el servidor); el próximo `obtener` crea uno nuevo.
+
+        Con `contexto`, solo si sigue siendo el vigente (otro hilo puede haberlo reemplazado ya)
+        """
+        with self._lock:
+            actual = self._contextos.get(selected_model)
+            if actual is None or (contexto is not None and actual[1] is not contexto):
+                return
+            del self._contextos[selected_model]
+        if actual and actual[1] is not None:
+            self._eliminar(actual[1])
+
+    def _avisar(self, selected_model, motivo):
+        with self._lock:
+            if selected_model in self._avisados:
+                return
+            self._avisados.add(selected_model)
+        log.warning("Sin contexto cacheado para %s: %s; se envía el prompt completo", selected_model, motivo)
+
+    def _eliminar(self, contexto):
+        # Si ya no existe en el servidor no hay nada que liberar
+        try:
+            self.cliente.eliminar_contexto(contexto)
+        except Exception:
+            pass
+
+
+# Función para obtener el cliente de Gemini configurado (real o sustituto local)
+@lru_cache(maxsize=None)
+def obtener_cliente():
+    if os.getenv("GEMINI_BACKEND", "").lower() == "local":
+        return ClienteLocal(
+            latencia=float(os.getenv("GEMINI_LOCAL_LATENCIA", "0")),
+            tasa_error=float(os.getenv("GEMINI_LOCAL_ERRORES", "0")),
+            semilla=os.getenv("GEMINI_LOCAL_SEMILLA"),
+            tasa_incompletas=float(os.getenv("GEMINI_LOCAL_INCOMPLETAS", "0")),
+        )
+    return ClienteGemini()
+
+
+# Función para obtener el gestor de contextos compartido (None si está desactivado con HDU_CONTEXTO_CACHE=0)
+@lru_cache(maxsize=None)
+def obtener_contextos():
+    if os.getenv("HDU_CONTEXTO_CACHE", "1") == "0":
+        return None
+    ttl_min = float(os.getenv("HDU_CONTEXTO_TTL_MIN", CONTEXTO_TTL_MIN_DEFAULT))
+    return GestorContextos(obtener_cliente(), ttl_segundos=int(ttl_min * 60))
+
+
+# Función para obtener el límite adaptativo de solicitudes simultáneas compartido por el proceso
+@lru_cache(maxsize=None)
+def obtener_concurrencia():
+    return ConcurrenciaAdaptativa(int(os.getenv("GEMINI_CONCURRENCIA_MAX", CONCURRENCIA_MAX_DEFAULT)))
+
+
+# Función para llamar a Gemini con reintentos, backoff y el límite adaptativo de concurrencia
+def llamar_con_reintentos(llamada, contadores=None, tiempos=None, puede_reintentar=None, limitador=None):
+    """Ejecuta `llamada()` y la repite ante errores transitorios (429, 5xx, tiempo agotado).
+
+    Entre intentos espera un backoff exponencial con jitter completo; los errores
+    definitivos (400, 403, 404...) se propagan de inmediato. Cada intento ocupa un cupo
+    de `obtener_concurrencia()`, que se reduce a la mitad ante un 429 y crece con cada
+    éxito. Suma en `contadores` los reintentos y las respuestas por cuota (`limitados`) y en
+    `tiempos` los segundos de backoff (`espera_reintentos`) y de espera por cupo
+    (`espera_concurrencia`). `puede_reintentar()` permite vetar el reintento (p. ej.
+    si ya se mostraron fragmentos de una respuesta en streaming).
+
+    El primer intento usa la reserva que el llamador ya tomó de `limitador`
+    (`lote.LimitadorTasa`); cada reintento reserva otra solicitud del presupuesto por
+    minuto, sin tokens (los tokens de la respuesta se ajustan en la reserva original),
+    así una racha de 429 o 503 no supera el RPM configurado. La espera se suma en
+    `tiempos["espera_limite"]`.
+    """
+    contadores = {} if contadores is None else contadores
+    tiempos = {} if tiempos is None else tiempos
+    max_reintentos = int(os.getenv("GEMINI_REINTENTOS", REINTENTOS_DEFAULT))
+    base = float(os.getenv("GEMINI_REINTENTO_BASE_SEG", REINTENTO_BASE_SEGUNDOS))
+    tope = float(os.getenv("GEMINI_REINTENTO_TOPE_SEG", REINTENTO_TOPE_SEGUNDOS))
+    concurrencia = obtener_concurrencia()
+    intento = 0
+    while True:
+        tiempos["espera_concurrencia"] = tiempos.get("espera_concurrencia", 0) + concurrencia.adquirir()
+        try:
+            resultado = llamada()
+        except Exception as e:
+            limitado = codigo_error(e) == CODIGO_LIMITE_CUOTA
+            concurrencia.liberar(exito=False, limitado=limitado)
+            registro.fijar("hdu_concurrencia_limite", int(concurrencia.limite))
+            contadores["limitados"] = contadores.get("limitados", 0) + int(limitado)
+            if not es_reintentable(e) or intento >= max_reintentos or (puede_reintentar is not None and not puede_reintentar()):
+                raise
+            pausa = random.uniform(0, min(tope, base * 2 ** intento))
+            time.sleep(pausa)
+            tiempos["espera_reintentos"] = tiempos.get("espera_reintentos", 0) + pausa
+            contadores["reintentos"] = contadores.get("reintentos", 0) + 1
+            intento += 1
+            if limitador is not None:
+                inicio_espera = time.time()
+                limitador.adquirir(0)
+                tiempos["espera_limite"] = tiempos.get("espera_limite", 0) + time.time() - inicio_espera
+            continue
+        concurrencia.liberar(exito=True)
+        registro.fijar("hdu_concurrencia_limite", int(concurrencia.limite))
+        return resultado
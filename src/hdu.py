@@ -0,0 +1,222 @@
+import os
+import json
+from dotenv import load_dotenv
+from cache import escribir_atomico
+
+# Núcleo importable (sin Streamlit): prompt por defecto, modelos y archivos HDU.
+# Lo usan la app de Streamlit (main.py) y el servicio HTTP (api.py).
+
+
+# Función para cargar la API KEY de Gemini desde .env (el cliente la toma al crearse, ver `gemini.ClienteGemini`)
+def configurar_gemini():
+    load_dotenv()
+
+
+# Prompt por defecto para la generación de historias de usuario
+def default_prompt():
+    return """Role:
+You are an expert in writing high-quality, agile user stories for digital products, with deep knowledge of best practices, user-centric design, and clear, testable acceptance criteria.
+
+Task:
+You will receive a visual analysis of an app feature (screens/flows). Rewrite it into a professional, detailed user story using the structure and standards below, ensuring clarity, completeness, testability, and UI fidelity.
+
+Guidelines:
+- Use the classic user story format:
+  As a [type of user]
+  I want [goal or need]
+  So that [benefit or business value]
+
+- Add a Functional Context: Briefly describe how the feature fits in the broader user journey, system, or UI module.
+
+- Acceptance Criteria:
+  - Use clear, specific, and testable criteria.
+  - Prefer Gherkin syntax (Given / When / Then) or structured bullet points.
+  - Break down criteria by section, tab, or interaction step as needed.
+  - Include UI behavior details: hover states, color changes, tooltips, visibility toggles, responsiveness, icons, micro-interactions.
+  - For each tab/section, list all relevant behaviors and requirements.
+
+- Technical and Business Requirements:
+  - Field validations (min/max characters, format, required/optional)
+  - Conditional logic (e.g., show X only when Y is selected)
+  - Accessibility needs (ARIA labels, keyboard navigation, contrast)
+  - Analytics/tracking requirements
+  - Design consistency (UI tokens, reusable components)
+
+- User-Centric Focus:
+  - Focus on user goals, clarity, autonomy, and accessibility.
+  - Include messaging for error/success/empty states.
+  - Avoid technical jargon unless necessary.
+
+- INVEST Principle: All stories must be Independent, Negotiable, Valuable, Estimable, Small, Testable.
+
+- UI Detailing Requirement (Front-End Fidelity):
+  - Always include detailed UI expectations, even for minor design changes.
+  - Cover color scheme and states, font styling, tooltip text and behavior, animations, responsive layout, placement and spacing.
+
+- Follow the JetSMART reference story structure and level of detail.
+
+Reference Example:
+As a JetSMART user
+
+I want to clearly view the summary of my purchase, my personal details, the flight information, and have direct access to actions such as check-in, name change, change or refund requests,
+So that I can manage my booking independently without relying on support, with all information clear and accessible.
+
+Functional Context
+Once the user completes their purchase, they are automatically redirected (or can access through their email or "My Trips") to the itinerary page:
+booking.staging.jetsmart.com/V2/Itinerary
+
+The page has 5 tabs:
+Your Itinerary
+Booking Details
+Transactions
+Modify Your Booking
+Passengers
+
+🎯 Acceptance Criteria by Section/Tab
+General Header View
+Displays the text "Manage Your Trip" with a calendar icon.
+Shows the number of passengers.
+Clearly displays the PNR (e.g., D7ICPW).
+On the right, within a card-style box, it shows:
+Flight route: Santiago (SCL) → Antofagasta (ANF)
+Flight date and time: e.g., Sun 29/06, 01:00 - 03:10
+Passenger count
+Financial breakdown:
+Subtotal: $60,900
+Taxes and fees: $7,547
+Total: $0 CLP (if paid with miles)
+
+Tab: Your Itinerary
+Shows outbound flight details (origin, destination, time, flight number).
+Indicates whether the flight is direct or has stops/connections.
+Options such as:
+Resend itinerary email
+Display of promotional banners to add:
+Bags
+Seats
+Priority boarding
+Highlighted section for the Check-in button (if available):
+The button is shown only if there are less than 72h and more than 1h before the flight.
+The button updates its state if check-in has already been completed.
+
+Tab: Booking Details
+Displays the booking breakdown with the following elements:
+Passenger names
+Transaction breakdown: base fare, ancillaries (if any), taxes and fees
+Subtotals and total amount paid
+Indicates if the booking was paid with miles (0 CLP)
+Must include clear, readable icons with labels
+
+Tab: Transactions
+Technical breakdown of payments:
+Payment type (e.g., miles, credit card, voucher)
+Transaction status: approved, failed, refunded, etc.
+Amount per item
+Must include the authorization or reference code for each payment
+
+Tab: Modify Your Booking
+Includes 4 interactive actions:
+a. "Transfer" button (name change)
+Redirects to the "Passenger Information" section
+Enables editing of the Passenger Name field
+Validates that the flight is more than 2h away
+If the change is within the valid window but close to flight time:
+Show message: "This change has an additional cost."
+Redirect to the payment flow before saving the change
+Once saved, the name should update in the general view
+b. "Request change" button
+Redirects to: JetSMART – Fly SMART, Fly your way
+c. "Request refund" button
+Same link as "Request change" (unified flow): JetSMART – Fly SMART, Fly your way
+d. "Emergency medical change" button
+Redirects to the production environment: Changes and Refunds – Fly SMART, Fly your way
+
+Tab: Passengers
+Form to complete passenger contact details:
+Email
+Phone
+Country
+City
+Address
+Optional field: AAdvantage number
+The "Save Information" button stores the contact data locally
+For AAdvantage miles bookings, this step is mandatory to complete the process and enable check-in
+
+🔧 Technical and Business Requirements
+The Name field must be locked by default and only unlocked via "Transfer"
+The system must verify:
+Flight time vs current time
+Check-in status
+URLs must be dynamically built using PNR and passenger last name
+Validations must comply with JetSMART and SSR standards
+The design must remain responsive and accessible
+
+Instructions:
+Rewrite the visual analysis into a complete, professional user story, following all the above guidelines and the reference example. Be exhaustive and explicit in acceptance criteria and UI details."""
+
+default_gemini_models = [
+    "gemini-1.5-flash",
+    "gemini-2.5-pro",
+]
+
+# Función para verificar si ya existe HDU para un video
+def verificar_hdu_existente(video_path):
+    """Verifica si ya existen archivos HDU para el video dado"""
+    base_path = os.path.splitext(video_path)[0]
+    txt_path = base_path + "_HDU.txt"
+    json_path = base_path + "_HDU.json"
+    return os.path.exists(txt_path) and os.path.exists(json_path), txt_path, json_path
+
+# Función para cargar HDU existente
+def cargar_hdu_existente(video_path):
+    """Carga una HDU existente desde los archivos guardados"""
+    base_path = os.path.splitext(video_path)[0]
+    txt_path = base_path + "_HDU.txt"
+    json_path = base_path + "_HDU.json"
+    
+    try:
+        with open(txt_path, "r", encoding="utf-8") as f:
+            hdu_text = f.read()
+        with open(json_path, "r", encoding="utf-8") as f:
+            hdu_json = json.load(f)
+        return hdu_text, hdu_json, None
+    except Exception as e:
+        return None, None, f"Error al cargar HDU existente: {str(e)}"
+
+# Función para guardar HDU
+def guardar_hdu(video_path, hdu_text, hdu_json):
+    """Guarda los archivos HDU junto al video. Devuelve (txt_path, json_path, avisos)"""
+    base_path = os.path.splitext(video_path)[0]
+    txt_path = base_path + "_HDU.txt"
+    json_path = base_path + "_HDU.json"
+    # Avisar si existen
+    avisos = []
+    if os.path.exists(txt_path):
+        avisos.append(f"⚠️ Se sobreescribirá: {txt_path}")
+    if os.path.exists(json_path):
+        avisos.append(f"⚠️ Se sobreescribirá: {json_path}")
+    # Guardar archivos de forma atómica; el .json va al final para que un corte entre ambos
+    # no haga que verificar_hdu_existente dé el video por procesado
+    escribir_atomico(txt_path, hdu_text.encode("utf-8"))
+    escribir_atomico(json_path, json.dumps(hdu_json, ensure_ascii=False, indent=2).encode("utf-8"))
+    return txt_path, json_path, avisos
+
+# Función para obtener información de HDU existente
+def obtener_info_hdu_existente(video_path):
+    """Obtiene información detallada de una HDU existente"""
+    base_path = os.path.splitext(video_path)[0]
+    json_path = base_path + "_HDU.json"
+    
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            hdu_json = json.load(f)
+        
+        info = {
+            "video": hdu_json.get("video", "N/A"),
+            "modelo": hdu_json.get("modelo", "N/A"),
+            "timestamp": hdu_json.get("timestamp", "N/A"),
+            "ruta": hdu_json.get("ruta", "N/A")
+        }
+        return info, None
+    except Exception as e:
+        return None, f"Error al leer información de HDU: {str(e)}"
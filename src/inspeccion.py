@@ -0,0 +1,255 @@
+import os
+import math
+import time
+import signal
+import multiprocessing
+import cv2
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from video import leer_metadata, calcular_parametros_video, calcular_objetivos
+from pipeline import construir_prompt, estimar_tokens, estimar_tokens_imagen, dimensiones_enviadas, calcular_frames_segmentados, PROMPT_SEGMENTO, TOKENS_ANALISIS_SEGMENTO
+
+# Inspección previa de una carpeta (duración, fps, resolución y códec de cada video) en un pool de
+# procesos, y estimación de frames, tokens y tiempo del lote antes de enviar nada a Gemini
+INSPECCION_TIMEOUT_SEGUNDOS = float(os.getenv("HDU_INSPECCION_TIMEOUT", "10"))
+TIC_SEGUNDOS = 0.05
+ARCHIVOS_POR_GRUPO = 16
+EN_VUELO_POR_PROCESO = 2
+
+# Sin historial en la carpeta: megapíxeles decodificados por segundo en cada proceso de extracción
+# y segundos de respuesta de Gemini por solicitud
+MEGAPIXELES_POR_SEGUNDO_DEFAULT = 150
+API_SEGUNDOS_DEFAULT = 15
+ETAPAS_EXTRACCION = ("apertura", "decodificacion", "deduplicacion", "redimension", "codificacion")
+
+
+# Función para leer la metadata y el códec de un archivo (corre en un proceso del pool)
+def inspeccionar_archivo(video_path):
+    """Devuelve (size, mtime_ns, metadata); la metadata trae "error" si OpenCV no puede leer el video"""
+    try:
+        stat = os.stat(video_path)
+    except OSError as e:
+        return None, None, {"error": str(e)}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return stat.st_size, stat.st_mtime_ns, {"error": "No se pudo abrir el video"}
+        metadata = leer_metadata(cap)
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        metadata["codec"] = "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\0 ") or None
+    finally:
+        cap.release()
+    if not metadata["total_frames"] or not metadata["fps"]:
+        metadata["error"] = "El video no tiene frames legibles"
+    return stat.st_size, stat.st_mtime_ns, metadata
+
+
+# Función para inspeccionar un grupo de archivos en un mismo envío al pool (menos comunicación por archivo)
+def inspeccionar_grupo(paths):
+    return [inspeccionar_archivo(path) for path in paths]
+
+
+# Función que corre al iniciar cada worker del pool: informa su PID para poder terminarlo
+def registrar_worker(pids):
+    pids.put(os.getpid())
+
+
+# Función para terminar un pool con workers colgados (ProcessPoolExecutor no lo expone hasta Python 3.14)
+def terminar_pool(pool, pids):
+    """Termina los workers informados por `registrar_worker` y cierra el pool"""
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGTERM)
+        except OSError:
+            # Ya había terminado
+            pass
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+# Función para ejecutar una ronda de grupos en un pool hasta terminar, o hasta un grupo colgado o un worker caído
+def ejecutar_ronda(grupos, procesos, timeout, resultados):
+    """Guarda en `resultados` lo inspeccionado y devuelve (colgados, caidos): los grupos que superaron
+    `timeout` y, si un worker se cayó, los grupos enviados que quedaron sin resultado (en orden de envío)
+    """
+    pids = multiprocessing.SimpleQueue()
+    pool = ProcessPoolExecutor(max_workers=procesos, initializer=registrar_worker, initargs=(pids,))
+    cola = iter(grupos)
+    futuros = {}
+    orden = {}
+    en_curso = {}
+    colgados = []
+    roto = False
+    try:
+        restantes = set()
+        while not colgados and not roto:
+            # Se envían de a pocos grupos por worker: `wait` recorre solo los que están en vuelo
+            for grupo in cola:
+                futuro = pool.submit(inspeccionar_grupo, grupo)
+                futuros[futuro] = grupo
+                orden[futuro] = len(orden)
+                restantes.add(futuro)
+                if len(restantes) >= procesos * EN_VUELO_POR_PROCESO:
+                    break
+            if not restantes:
+                break
+            hechos, restantes = wait(restantes, timeout=TIC_SEGUNDOS, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                try:
+                    resultados.update(zip(futuros[futuro], futuro.result()))
+                except BrokenProcessPool:
+                    roto = True
+            # running() incluye los que esperan en la cola de llamadas detrás de un worker colgado:
+            # solo los `procesos` más antiguos se están leyendo de verdad
+            ahora = time.monotonic()
+            leyendo = sorted((futuro for futuro in restantes if futuro.running()), key=orden.get)[:procesos]
+            for futuro in leyendo:
+                if ahora - en_curso.setdefault(futuro, ahora) > timeout:
+                    colgados.append(futuro)
+    finally:
+        if colgados or roto:
+            terminar_pool(pool, pids)
+        else:
+            pool.shutdown(wait=True)
+    # Un worker puede caerse antes de que se lo vea en curso: sospechan todos los grupos enviados sin resultado
+    caidos = [grupo for grupo in futuros.values() if roto and grupo[0] not in resultados]
+    return [futuros[futuro] for futuro in colgados], caidos
+
+
+# Función para inspeccionar muchos videos en paralelo con un tiempo máximo por archivo
+def inspeccionar_videos(paths, max_procesos=None, timeout=INSPECCION_TIMEOUT_SEGUNDOS):
+    """Devuelve {path: (size, mtime_ns, metadata)}; size y mtime_ns son None si el archivo no se pudo leer.
+
+    Los archivos se envían al pool en grupos de `ARCHIVOS_POR_GRUPO`. Un grupo que pasa más
+    de `timeout` segundos en un worker (p. ej. un recurso de red colgado o un contenedor
+    dañado) se termina y sus archivos se repiten de a uno: el que vuelva a agotar el tiempo
+    se da por fallido. Si un worker se cae (OpenCV puede abortar con algunos archivos
+    dañados), los archivos en curso se repiten de a uno en un solo worker hasta dar con el
+    culpable; después se vuelve a inspeccionar en paralelo.
+    """
+    resultados = {}
+    pendientes = list(paths)
+    individuales = []
+    aislado = False
+    while pendientes:
+        resto = [path for path in pendientes if path not in individuales]
+        grupos = [[path] for path in individuales] + [resto[i:i + ARCHIVOS_POR_GRUPO] for i in range(0, len(resto), ARCHIVOS_POR_GRUPO)]
+        procesos = 1 if aislado else max(1, min(max_procesos or os.cpu_count() or 1, len(grupos)))
+        colgados, caidos = ejecutar_ronda(grupos, procesos, timeout, resultados)
+        individuales = []
+        for grupo in colgados:
+            if len(grupo) == 1:
+                resultados[grupo[0]] = (None, None, {"error": f"Tiempo agotado al leer el video ({timeout:.0f}s)"})
+            else:
+                individuales.extend(grupo)
+        if caidos and aislado and len(caidos[0]) == 1:
+            # Con un solo worker el culpable es el primer envío sin resultado
+            resultados[caidos[0][0]] = (None, None, {"error": "El proceso de lectura se cerró al abrir el video"})
+            aislado = False
+        elif caidos:
+            aislado = True
+            individuales = [path for grupo in caidos for path in grupo]
+        else:
+            aislado = False
+        pendientes = [path for path in pendientes if path not in resultados]
+    return resultados
+
+
+# Función para obtener la metadata de los videos de una carpeta (memoizada en el catálogo)
+def inspeccionar_carpeta(catalogo, carpeta, max_procesos=None, timeout=INSPECCION_TIMEOUT_SEGUNDOS):
+    """Devuelve {video_path: metadata}. Solo se inspeccionan los videos nuevos o modificados desde
+    la última vez (el catálogo descarta la metadata cuando cambian el tamaño o el mtime).
+    Espera un `catalogo.actualizar(carpeta)` previo
+    """
+    metadatas = catalogo.metadatas(carpeta)
+    faltantes = [path for path, metadata in metadatas.items() if metadata is None]
+    if faltantes:
+        inspeccionados = inspeccionar_videos(faltantes, max_procesos, timeout)
+        catalogo.registrar_metadatas(inspeccionados)
+        metadatas.update({path: metadata for path, (_, _, metadata) in inspeccionados.items()})
+    return metadatas
+
+
+# Función para estimar frames, solicitudes y tokens de entrada de un video a partir de su metadata
+def estimar_video(metadata, opciones, texto_prompt):
+    """Misma elección de frames que `pipeline.preparar_video` (sin decodificar); devuelve {frames, solicitudes, tokens}"""
+    frame_interval, max_frames, _ = calcular_parametros_video(None, metadata)
+    segmentacion = opciones["segmentacion"]
+    segmentado = segmentacion["activa"] and metadata["duration"] > segmentacion["duracion_minima"]
+    if segmentado:
+        max_frames = calcular_frames_segmentados(metadata, opciones)
+    # Con muestreo por intervalo un video corto no alcanza a llenar el máximo
+    frames = max_frames if opciones["muestreo"]["modo"] == "escenas" else max(1, len(calcular_objetivos(metadata, frame_interval, max_frames)))
+    tokens_frame = estimar_tokens_imagen(*dimensiones_enviadas(metadata, opciones["imagen"]))
+    if not segmentado:
+        return {"frames": frames, "solicitudes": 1, "tokens": estimar_tokens(texto_prompt, []) + frames * tokens_frame}
+    segmentos = math.ceil(frames / segmentacion["frames_por_segmento"])
+    tokens = segmentos * (len(PROMPT_SEGMENTO) // 4) + frames * tokens_frame + estimar_tokens(texto_prompt, []) + segmentos * TOKENS_ANALISIS_SEGMENTO
+    return {"frames": frames, "solicitudes": segmentos + 1, "tokens": tokens}
+
+
+# Función para calibrar los tiempos con las HDU ya generadas en la carpeta
+def calibrar_tiempos(historial):
+    """Recibe [(metadata, hdu_json)] y devuelve {megapixeles_por_segundo, api_segundos, videos}; sin historial usa los valores por defecto"""
+    megapixeles = extraccion = api = solicitudes = 0
+    for metadata, hdu_json in historial:
+        tiempos = hdu_json.get("tiempos") or {}
+        # Resultados del cache o frames ya extraídos no dicen nada de la decodificación ni de la API
+        if not tiempos.get("api") or "lectura_cache" in tiempos or not metadata or "error" in metadata:
+            continue
+        megapixeles += metadata["total_frames"] * metadata["width"] * metadata["height"] / 1e6
+        extraccion += sum(tiempos.get(etapa, 0) for etapa in ETAPAS_EXTRACCION)
+        api += tiempos["api"]
+        solicitudes += 1
+    if not solicitudes:
+        return {"megapixeles_por_segundo": MEGAPIXELES_POR_SEGUNDO_DEFAULT, "api_segundos": API_SEGUNDOS_DEFAULT, "videos": 0}
+    return {
+        "megapixeles_por_segundo": megapixeles / extraccion if extraccion else MEGAPIXELES_POR_SEGUNDO_DEFAULT,
+        "api_segundos": api / solicitudes,
+        "videos": solicitudes,
+    }
+
+
+# Función para estimar frames, tokens y tiempo de un lote antes de procesarlo
+def estimar_lote(metadatas, opciones, prompt, extra_context, max_procesos, max_concurrentes, rpm=0, tpm=0, historial=(), empaquetado=None):
+    """Recibe {video_path: metadata} (ver `inspeccionar_carpeta`) y devuelve un dict con videos, ilegibles,
+    duracion, frames, solicitudes, tokens, segundos (tiempo de pared) y la calibración usada.
+
+    El tiempo supone que la extracción (en procesos) y las solicitudes (en hilos) se solapan,
+    como en `lote.ejecutar_pipeline`: manda la etapa más lenta, más un video de llenado.
+    No descuenta los resultados que ya estén en el cache.
+    """
+    texto_prompt = construir_prompt(prompt, extra_context)
+    calibracion = calibrar_tiempos(historial)
+    estimacion = {"videos": 0, "ilegibles": [], "duracion": 0.0, "frames": 0, "solicitudes": 0, "tokens": 0}
+    extraccion = []
+    cortos = 0
+    for path, metadata in metadatas.items():
+        if not metadata or "error" in metadata:
+            estimacion["ilegibles"].append(path)
+            continue
+        video = estimar_video(metadata, opciones, texto_prompt)
+        estimacion["videos"] += 1
+        estimacion["duracion"] += metadata["duration"]
+        estimacion["frames"] += video["frames"]
+        estimacion["tokens"] += video["tokens"]
+        estimacion["solicitudes"] += video["solicitudes"]
+        if empaquetado and empaquetado["activo"] and video["solicitudes"] == 1 and metadata["duration"] <= empaquetado["duracion_maxima"]:
+            cortos += 1
+        # Los cambios de escena (y los candidatos de la deduplicación) recorren el video completo
+        megapixeles = metadata["total_frames"] * metadata["width"] * metadata["height"] / 1e6
+        extraccion.append(megapixeles / calibracion["megapixeles_por_segundo"])
+    # Clips cortos empaquetados: hasta `videos_maximos` por solicitud
+    if cortos:
+        estimacion["solicitudes"] -= cortos - math.ceil(cortos / empaquetado["videos_maximos"])
+    if extraccion:
+        etapas = [
+            sum(extraccion) / max(1, max_procesos),
+            estimacion["solicitudes"] * calibracion["api_segundos"] / max(1, max_concurrentes),
+            60 * estimacion["solicitudes"] / rpm if rpm else 0,
+            60 * estimacion["tokens"] / tpm if tpm else 0,
+        ]
+        estimacion["segundos"] = max(etapas) + sum(extraccion) / len(extraccion)
+    else:
+        estimacion["segundos"] = 0
+    estimacion["calibracion"] = calibracion
+    return estimacion
@@ -0,0 +1,268 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+VENTANA_SEGUNDOS = 60
+
+
+class LimitadorTasa:
+    """Presupuesto del lado del cliente de solicitudes y tokens por minuto (ventana deslizante).
+
+    Un valor `None` o 0 en `rpm`/`tpm` desactiva ese límite. Es seguro entre hilos.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self._lock = threading.Lock()
+        self._eventos = deque()  # [instante, tokens]
+
+    def _limpiar(self, ahora):
+        while self._eventos and ahora - self._eventos[0][0] >= VENTANA_SEGUNDOS:
+            self._eventos.popleft()
+
+    def adquirir(self, tokens):
+        """Bloquea hasta que la solicitud cabe en el presupuesto y devuelve su reserva"""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._limpiar(ahora)
+                usados = sum(evento[1] for evento in self._eventos)
+                cabe_rpm = self.rpm is None or len(self._eventos) < self.rpm
+                # Una solicitud mayor que todo el presupuesto se deja pasar cuando la ventana está vacía
+                cabe_tpm = self.tpm is None or usados + tokens <= self.tpm or not self._eventos
+                if cabe_rpm and cabe_tpm:
+                    reserva = [ahora, tokens]
+                    self._eventos.append(reserva)
+                    return reserva
+                espera = VENTANA_SEGUNDOS - (ahora - self._eventos[0][0])
+            time.sleep(max(espera, 0.05))
+
+    def ajustar(self, reserva, tokens_reales):
+        """Reemplaza la estimación de una reserva por los tokens reportados por la API"""
+        with self._lock:
+            reserva[1] = tokens_reales
+
+
+class ConcurrenciaAdaptativa:
+    """Límite de solicitudes en curso que se ajusta solo (AIMD).
+
+    Cada solicitud exitosa sube el límite en 1/límite (≈ +1 por cada ronda completa)
+    hasta `maximo`; una respuesta de límite de cuota (429) lo reduce a la mitad, a lo
+    más una vez por `ventana_segundos` para que una ráfaga de 429 simultáneos no lo
+    desplome. Es seguro entre hilos.
+    """
+
+    def __init__(self, maximo, minimo=1, ventana_segundos=1.0):
+        self.maximo = max(1, maximo)
+        self.minimo = max(1, min(minimo, self.maximo))
+        self.ventana_segundos = ventana_segundos
+        self.limite = float(self.maximo)
+        self.en_curso = 0
+        self._ultimo_recorte = 0.0
+        self._condicion = threading.Condition()
+
+    def adquirir(self):
+        """Bloquea hasta que hay cupo y devuelve los segundos esperados"""
+        inicio = time.monotonic()
+        with self._condicion:
+            while self.en_curso >= int(self.limite):
+                self._condicion.wait()
+            self.en_curso += 1
+        return time.monotonic() - inicio
+
+    def liberar(self, exito=True, limitado=False):
+        """Libera el cupo; `limitado` indica que la API respondió por exceso de cuota"""
+        with self._condicion:
+            self.en_curso -= 1
+            ahora = time.monotonic()
+            if limitado:
+                if ahora - self._ultimo_recorte >= self.ventana_segundos:
+                    self.limite = max(float(self.minimo), self.limite / 2)
+                    self._ultimo_recorte = ahora
+            elif exito:
+                self.limite = min(float(self.maximo), self.limite + 1 / self.limite)
+            self._condicion.notify_all()
+
+
+# Función para ejecutar tareas en paralelo entregando los resultados en orden
+def ejecutar_en_orden(items, funcion, max_concurrentes=4, al_completar=None):
+    """Ejecuta `funcion(item)` con a lo más `max_concurrentes` tareas en curso.
+
+    Es un generador que produce (indice, item, resultado) en el mismo orden de
+    `items`, de modo que los logs y archivos escritos por quien consume son
+    determinísticos. `al_completar(completados, total)` se invoca en el hilo que
+    consume (el hilo principal de Streamlit) cada vez que termina una tarea.
+    """
+    total = len(items)
+    listos = {}
+    siguiente = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrentes)) as pool:
+        futuros = {pool.submit(funcion, item): idx for idx, item in enumerate(items)}
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            listos[futuros[futuro]] = futuro.result()
+            if al_completar is not None:
+                al_completar(completados, total)
+            while siguiente in listos:
+                yield siguiente, items[siguiente], listos.pop(siguiente)
+                siguiente += 1
+
+
+# Función para solapar la etapa de CPU (extracción) con la etapa de red (Gemini) entre videos
+def ejecutar_pipeline(items, etapa_cpu, etapa_red, max_procesos=2, max_concurrentes=4, max_en_memoria=8, al_completar=None, al_fallar=None):
+    """Productor/consumidor de dos etapas con resultados en el orden de `items`.
+
+    `etapa_cpu(item)` corre en un pool de procesos (debe ser serializable, p. ej. un
+    `functools.partial` de una función de módulo) y su resultado pasa a
+    `etapa_red(preparado)`, que corre en un pool de hilos. A lo más `max_en_memoria`
+    items pueden estar entre el inicio de la extracción y el fin de la solicitud, lo
+    que acota cuántos conjuntos de frames decodificados viven en memoria a la vez.
+    Produce (indice, item, resultado) igual que `ejecutar_en_orden`.
+
+    Un item que falla no corta el lote: si `etapa_cpu` lanza una excepción se pasa a
+    `etapa_red` lo que devuelva `al_fallar(item, excepcion)` (p. ej.
+    `pipeline.preparado_con_error`) y, sin `al_fallar`, o si `etapa_red` lanza, el resultado
+    es (None, None, error, {}). Si un proceso se cae (OpenCV puede abortar con algunos
+    archivos dañados) el pool queda roto: se crea otro para los items siguientes y los que
+    estaban en curso se repiten de a uno en un pool aparte, así solo falla el culpable.
+
+    `etapa_red` puede devolver un `Future` en lugar del resultado (p. ej. un clip que espera
+    la solicitud de su paquete, ver `pipeline.Empaquetador`): el item sigue en curso sin
+    ocupar un hilo y su resultado es el del futuro; si ese resultado es invocable (una
+    continuación) se corre en el pool de hilos y su valor es el resultado.
+    """
+    total = len(items)
+    pendientes = iter(enumerate(items))
+    sospechosos = deque()  # índices en curso cuando se cayó un proceso
+    activos = {}  # futuro -> (etapa, indice)
+    listos = {}
+    siguiente = 0
+    completados = 0
+    en_memoria = 0
+    procesos = ProcessPoolExecutor(max_workers=max(1, max_procesos))
+    aislamiento = None
+    hilos = ThreadPoolExecutor(max_workers=max(1, max_concurrentes))
+
+    def terminar(idx, resultado):
+        nonlocal en_memoria, completados
+        listos[idx] = resultado
+        en_memoria -= 1
+        completados += 1
+        if al_completar is not None:
+            al_completar(completados, total)
+
+    def fallar(idx, error):
+        if al_fallar is None:
+            terminar(idx, (None, None, str(error) or type(error).__name__, {}))
+        else:
+            activos[hilos.submit(etapa_red, al_fallar(items[idx], error))] = ("red", idx)
+
+    try:
+        while True:
+            # Alimentar la etapa de CPU mientras haya cupo en la cola acotada
+            while en_memoria < max(1, max_en_memoria):
+                proximo = next(pendientes, None)
+                if proximo is None:
+                    break
+                idx, item = proximo
+                activos[procesos.submit(etapa_cpu, item)] = ("cpu", idx)
+                en_memoria += 1
+            # Sospechosos de a uno: si el proceso aislado se cae, el culpable es ese item
+            if sospechosos and not any(etapa == "aislado" for etapa, _ in activos.values()):
+                aislamiento = aislamiento or ProcessPoolExecutor(max_workers=1)
+                idx = sospechosos.popleft()
+                activos[aislamiento.submit(etapa_cpu, items[idx])] = ("aislado", idx)
+            if not activos:
+                break
+            hechos, _ = wait(activos, return_when=FIRST_COMPLETED)
+            roto = False
+            for futuro in hechos:
+                etapa, idx = activos.pop(futuro)
+                if etapa in ("red", "espera"):
+                    try:
+                        resultado = futuro.result()
+                        if isinstance(resultado, Future):
+                            activos[resultado] = ("espera", idx)
+                        elif etapa == "espera" and callable(resultado):
+                            activos[hilos.submit(resultado)] = ("red", idx)
+                        else:
+                            terminar(idx, resultado)
+                    except Exception as e:
+                        terminar(idx, (None, None, str(e) or type(e).__name__, {}))
+                    continue
+                try:
+                    preparado = futuro.result()
+                except BrokenProcessPool:
+                    if etapa == "cpu":
+                        roto = True
+                        sospechosos.append(idx)
+                    else:
+                        aislamiento.shutdown(wait=False)
+                        aislamiento = None
+                        fallar(idx, BrokenProcessPool("El proceso de extracción se cerró al procesar el video"))
+                    continue
+                except Exception as e:
+                    fallar(idx, e)
+                    continue
+                activos[hilos.submit(etapa_red, preparado)] = ("red", idx)
+            if roto:
+                # Los demás items del pool roto también fallarían: pasan a sospechosos y sigue un pool nuevo
+                for futuro, (etapa, idx) in list(activos.items()):
+                    if etapa == "cpu":
+                        del activos[futuro]
+                        sospechosos.append(idx)
+                procesos.shutdown(wait=False, cancel_futures=True)
+                procesos = ProcessPoolExecutor(max_workers=max(1, max_procesos))
+            while siguiente in listos:
+                yield siguiente, items[siguiente], listos.pop(siguiente)
+                siguiente += 1
+    finally:
+        procesos.shutdown(wait=True)
+        if aislamiento is not None:
+            aislamiento.shutdown(wait=True)
+        hilos.shutdown(wait=True)
+
+
+# Función para aplicar `funcion` al resultado de un futuro de la etapa de red (ver `ejecutar_pipeline`)
+def encadenar(futuro, funcion):
+    """Devuelve un `Future` con `funcion(resultado)`; si el resultado es una continuación, también lo es"""
+    siguiente = Future()
+
+    def al_terminar(futuro):
+        try:
+            resultado = futuro.result()
+        except Exception as e:
+            siguiente.set_exception(e)
+            return
+        siguiente.set_result((lambda: funcion(resultado())) if callable(resultado) else funcion(resultado))
+
+    futuro.add_done_callback(al_terminar)
+    return siguiente
+
+
+# Función para resumir los tiempos por etapa de un lote
+def resumir_tiempos(lista_tiempos):
+    """Recibe una lista de dicts {etapa: segundos} y devuelve {etapa: (total, promedio, máximo)}"""
+    por_etapa = {}
+    for tiempos in lista_tiempos:
+        for etapa, segundos in tiempos.items():
+            por_etapa.setdefault(etapa, []).append(segundos)
+    return {etapa: (sum(valores), sum(valores) / len(valores), max(valores)) for etapa, valores in por_etapa.items()}
+
+
+# Función para resumir el uso de tokens de un lote
+def resumir_tokens(lista_tokens):
+    """Recibe una lista de dicts {prompt, cacheados, respuesta, total} (o None) y devuelve sus sumas.
+
+    `cacheados` son los tokens de entrada servidos desde el contexto cacheado en vez de reenviarse.
+    """
+    resumen = {"solicitudes": 0, "prompt": 0, "cacheados": 0, "respuesta": 0, "total": 0}
+    for tokens in lista_tokens:
+        if not tokens:
+            continue
+        resumen["solicitudes"] += 1
+        for clave in ("prompt", "cacheados", "respuesta", "total"):
+            resumen[clave] += tokens.get(clave) or 0
+    return resumen
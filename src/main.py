@@ -1,38 +1,33 @@
 import streamlit as st
 import os
+import time
 import tempfile
-import cv2
-from PIL import Image
-import google.generativeai as genai
-from dotenv import load_dotenv
-import json
-import glob
 from datetime import datetime
-
-# Función para calcular parámetros óptimos según la duración del video
-def calcular_parametros_video(video_path):
-    """Calcula parámetros óptimos para el video basado en su duración"""
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = total_frames / fps if fps else 0
-    cap.release()
-    
-    # Estrategia adaptativa
-    if duration <= 30:
-        return 2, 8, "Detalle alto (video corto ≤30s)"
-    elif duration <= 60:
-        return 8, 8, "Balance medio (video mediano 30-60s)"
-    elif duration <= 120:
-        return 15, 8, "Cobertura completa (video largo 1-2min)"
-    else:
-        interval = max(int(duration / 8), 10)  # Mínimo 10 seg entre frames
-        return interval, 8, f"Distribución uniforme (video muy largo: {duration:.1f}s)"
-
-# Cargar la API KEY de Gemini desde .env
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+# Solo módulos livianos al importar: OpenCV y google.generativeai (vía pipeline) se cargan recién
+# al procesar el primer video, así la página se dibuja sin esperarlos
+from opciones import CONFIG_IMAGEN_DEFAULT, FORMATOS_IMAGEN_SOPORTADOS, MUESTREO_DEFAULT, DEDUPLICACION_DEFAULT, SEGMENTACION_DEFAULT, EMPAQUETADO_DEFAULT, normalizar_opciones
+from cache import guardar_stream, clave_resultado, buscar_resultado, escribir_atomico
+from functools import partial
+from concurrent.futures import Future
+from lote import LimitadorTasa, ejecutar_pipeline, encadenar, resumir_tiempos, resumir_tokens
+from bitacora import Bitacora, ultima_bitacora_pendiente
+from catalogo import Catalogo
+from ruteo import MODELO_AUTO, configuracion_ruteo, resumir_ruteo
+import metricas
+import hdu
+from hdu import default_prompt, default_gemini_models, verificar_hdu_existente, cargar_hdu_existente, obtener_info_hdu_existente
+
+# Cargar la API KEY de Gemini desde .env (una sola vez por proceso de Streamlit, no en cada rerun)
+@st.cache_resource
+def configurar_gemini():
+    hdu.configurar_gemini()
+
+configurar_gemini()
+
+# Configuración de videos subidos (variables de entorno / .env)
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "1024"))
+UPLOAD_RETENCION_HORAS = float(os.getenv("UPLOAD_RETENCION_HORAS", "24"))
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "user-stories-ai")
 
 st.set_page_config(page_title="User Story Pro", layout="centered")
 st.title("User Story Pro: Video to User Story with Gemini Vision")
@@ -41,167 +36,75 @@ st.write("""
 Sube un video de tu app (puede contener flujos, botones, pantallas, etc.). La IA analizará visualmente el video y generará una historia de usuario profesional.
 """)
 
-# Prompt editable para la generación de historias de usuario
-def default_prompt():
-    return """Role:
-You are an expert in writing high-quality, agile user stories for digital products, with deep knowledge of best practices, user-centric design, and clear, testable acceptance criteria.
-
-Task:
-You will receive a visual analysis of an app feature (screens/flows). Rewrite it into a professional, detailed user story using the structure and standards below, ensuring clarity, completeness, testability, and UI fidelity.
-
-Guidelines:
-- Use the classic user story format:
-  As a [type of user]
-  I want [goal or need]
-  So that [benefit or business value]
-
-- Add a Functional Context: Briefly describe how the feature fits in the broader user journey, system, or UI module.
-
-- Acceptance Criteria:
-  - Use clear, specific, and testable criteria.
-  - Prefer Gherkin syntax (Given / When / Then) or structured bullet points.
-  - Break down criteria by section, tab, or interaction step as needed.
-  - Include UI behavior details: hover states, color changes, tooltips, visibility toggles, responsiveness, icons, micro-interactions.
-  - For each tab/section, list all relevant behaviors and requirements.
-
-- Technical and Business Requirements:
-  - Field validations (min/max characters, format, required/optional)
-  - Conditional logic (e.g., show X only when Y is selected)
-  - Accessibility needs (ARIA labels, keyboard navigation, contrast)
-  - Analytics/tracking requirements
-  - Design consistency (UI tokens, reusable components)
-
-- User-Centric Focus:
-  - Focus on user goals, clarity, autonomy, and accessibility.
-  - Include messaging for error/success/empty states.
-  - Avoid technical jargon unless necessary.
-
-- INVEST Principle: All stories must be Independent, Negotiable, Valuable, Estimable, Small, Testable.
-
-- UI Detailing Requirement (Front-End Fidelity):
-  - Always include detailed UI expectations, even for minor design changes.
-  - Cover color scheme and states, font styling, tooltip text and behavior, animations, responsive layout, placement and spacing.
-
-- Follow the JetSMART reference story structure and level of detail.
-
-Reference Example:
-As a JetSMART user
-
-I want to clearly view the summary of my purchase, my personal details, the flight information, and have direct access to actions such as check-in, name change, change or refund requests,
-So that I can manage my booking independently without relying on support, with all information clear and accessible.
-
-Functional Context
-Once the user completes their purchase, they are automatically redirected (or can access through their email or "My Trips") to the itinerary page:
-booking.staging.jetsmart.com/V2/Itinerary
-
-The page has 5 tabs:
-Your Itinerary
-Booking Details
-Transactions
-Modify Your Booking
-Passengers
-
-🎯 Acceptance Criteria by Section/Tab
-General Header View
-Displays the text "Manage Your Trip" with a calendar icon.
-Shows the number of passengers.
-Clearly displays the PNR (e.g., D7ICPW).
-On the right, within a card-style box, it shows:
-Flight route: Santiago (SCL) → Antofagasta (ANF)
-Flight date and time: e.g., Sun 29/06, 01:00 - 03:10
-Passenger count
-Financial breakdown:
-Subtotal: $60,900
-Taxes and fees: $7,547
-Total: $0 CLP (if paid with miles)
-
-Tab: Your Itinerary
-Shows outbound flight details (origin, destination, time, flight number).
-Indicates whether the flight is direct or has stops/connections.
-Options such as:
-Resend itinerary email
-Display of promotional banners to add:
-Bags
-Seats
-Priority boarding
-Highlighted section for the Check-in button (if available):
-The button is shown only if there are less than 72h and more than 1h before the flight.
-The button updates its state if check-in has already been completed.
-
-Tab: Booking Details
-Displays the booking breakdown with the following elements:
-Passenger names
-Transaction breakdown: base fare, ancillaries (if any), taxes and fees
-Subtotals and total amount paid
-Indicates if the booking was paid with miles (0 CLP)
-Must include clear, readable icons with labels
-
-Tab: Transactions
-Technical breakdown of payments:
-Payment type (e.g., miles, credit card, voucher)
-Transaction status: approved, failed, refunded, etc.
-Amount per item
-Must include the authorization or reference code for each payment
-
-Tab: Modify Your Booking
-Includes 4 interactive actions:
-a. "Transfer" button (name change)
-Redirects to the "Passenger Information" section
-Enables editing of the Passenger Name field
-Validates that the flight is more than 2h away
-If the change is within the valid window but close to flight time:
-Show message: "This change has an additional cost."
-Redirect to the payment flow before saving the change
-Once saved, the name should update in the general view
-b. "Request change" button
-Redirects to: JetSMART – Fly SMART, Fly your way
-c. "Request refund" button
-Same link as "Request change" (unified flow): JetSMART – Fly SMART, Fly your way
-d. "Emergency medical change" button
-Redirects to the production environment: Changes and Refunds – Fly SMART, Fly your way
-
-Tab: Passengers
-Form to complete passenger contact details:
-Email
-Phone
-Country
-City
-Address
-Optional field: AAdvantage number
-The "Save Information" button stores the contact data locally
-For AAdvantage miles bookings, this step is mandatory to complete the process and enable check-in
-
-🔧 Technical and Business Requirements
-The Name field must be locked by default and only unlocked via "Transfer"
-The system must verify:
-Flight time vs current time
-Check-in status
-URLs must be dynamically built using PNR and passenger last name
-Validations must comply with JetSMART and SSR standards
-The design must remain responsive and accessible
-
-Instructions:
-Rewrite the visual analysis into a complete, professional user story, following all the above guidelines and the reference example. Be exhaustive and explicit in acceptance criteria and UI details."""
-
-default_gemini_models = [
-    "gemini-1.5-flash",
-    "gemini-2.5-pro",
-]
-
 with st.expander("Mostrar/editar prompt avanzado para la IA", expanded=False):
     extra_context = st.text_area("Contexto extra para la IA (opcional, ej: 'El video muestra el flujo de registro de usuarios en una app de viajes')", value="", height=70)
     prompt = st.text_area("Prompt para la IA (puedes personalizarlo)", value=default_prompt(), height=180)
 
-# Selector de modelo de Gemini Vision
+# Selector de modelo de Gemini Vision ("auto" elige por video según duración y cantidad de pantallas)
+config_ruteo = configuracion_ruteo()
 selected_model = st.selectbox(
     "Selecciona el modelo de Gemini Vision a utilizar:",
-    default_gemini_models,
+    [*default_gemini_models, MODELO_AUTO],
     index=0,
-    help="Puedes elegir entre los modelos disponibles de Google Gemini Vision."
+    format_func=lambda m: f"Automático ({config_ruteo['modelo_rapido']} / {config_ruteo['modelo_fuerte']})" if m == MODELO_AUTO else m,
+    help=f"Puedes elegir entre los modelos disponibles de Google Gemini Vision. En automático, los videos de hasta "
+         f"{config_ruteo['duracion_maxima']:.0f}s y {config_ruteo['escenas_maximas']} pantallas distintas usan el modelo rápido, "
+         f"y si su historia no tiene la estructura esperada se repite con el fuerte."
 )
 
+# Selección de frames y preparación de las imágenes antes de enviarlas a Gemini (menos bytes y tokens por frame)
+with st.expander("Opciones de frames e imágenes enviadas a la IA", expanded=False):
+    col1, col2 = st.columns(2)
+    with col1:
+        modo_muestreo = st.radio("Selección de frames", ["escenas", "intervalo"], index=0, format_func=lambda m: "Cambios de escena" if m == "escenas" else "Intervalo fijo según duración", help="Cambios de escena elige las pantallas más distintas dentro del mismo máximo de frames; si no detecta cambios usa el intervalo fijo")
+    with col2:
+        umbral_escena = st.slider("Sensibilidad a cambios de escena (umbral)", min_value=0.01, max_value=0.5, value=MUESTREO_DEFAULT["umbral"], step=0.01, help="Menor umbral = detecta cambios más sutiles (modales, toasts)")
+    col1, col2 = st.columns(2)
+    with col1:
+        deduplicar = st.checkbox("Descartar frames casi idénticos", value=DEDUPLICACION_DEFAULT["activa"], help="Compara un hash perceptual de cada frame y reemplaza los repetidos por otros instantes del video")
+    with col2:
+        umbral_dedup = st.slider("Distancia máxima para considerar frames iguales", min_value=0, max_value=64, value=DEDUPLICACION_DEFAULT["umbral"], help="Distancia de Hamming sobre un hash de 256 bits")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        max_lado = st.number_input("Lado mayor máximo (px, 0 = original)", min_value=0, max_value=4096, value=CONFIG_IMAGEN_DEFAULT["max_lado"], step=128)
+    with col2:
+        formato_imagen = st.selectbox("Formato", FORMATOS_IMAGEN_SOPORTADOS, index=FORMATOS_IMAGEN_SOPORTADOS.index(CONFIG_IMAGEN_DEFAULT["formato"]))
+    with col3:
+        calidad_imagen = st.slider("Calidad", min_value=10, max_value=100, value=CONFIG_IMAGEN_DEFAULT["calidad"], help="No aplica a PNG")
+    st.caption("Recorte de la interfaz del dispositivo (barra de estado, navegación), en % del alto/ancho:")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        recorte_arriba = st.number_input("Arriba %", min_value=0, max_value=45, value=0)
+    with col2:
+        recorte_abajo = st.number_input("Abajo %", min_value=0, max_value=45, value=0)
+    with col3:
+        recorte_izquierda = st.number_input("Izquierda %", min_value=0, max_value=45, value=0)
+    with col4:
+        recorte_derecha = st.number_input("Derecha %", min_value=0, max_value=45, value=0)
+    st.caption("Videos largos: análisis por segmentos en paralelo y una solicitud final que los fusiona en una sola HDU")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        segmentar = st.checkbox("Modo segmentado", value=SEGMENTACION_DEFAULT["activa"], help=f"Solo para videos de más de {SEGMENTACION_DEFAULT['duracion_minima']} segundos")
+    with col2:
+        presupuesto_tokens = st.number_input("Presupuesto de tokens por video", min_value=5000, max_value=1000000, value=SEGMENTACION_DEFAULT["presupuesto_tokens"], step=5000, help="Determina cuántos frames se extraen en total")
+    with col3:
+        frames_por_segmento = st.number_input("Frames por segmento", min_value=2, max_value=32, value=SEGMENTACION_DEFAULT["frames_por_segmento"])
+opciones = normalizar_opciones({
+    "muestreo": {"modo": modo_muestreo, "umbral": float(umbral_escena)},
+    "deduplicacion": {"activa": deduplicar, "umbral": int(umbral_dedup)},
+    "segmentacion": {"activa": segmentar, "presupuesto_tokens": int(presupuesto_tokens), "frames_por_segmento": int(frames_por_segmento)},
+    "imagen": {
+        "max_lado": int(max_lado),
+        "formato": formato_imagen,
+        "calidad": int(calidad_imagen),
+        "recorte": [int(recorte_arriba), int(recorte_abajo), int(recorte_izquierda), int(recorte_derecha)],
+    }
+})
+
 st.sidebar.title("Modo de uso")
 modo = st.sidebar.radio("Selecciona el modo de uso:", ["Subir video manualmente", "Procesar carpeta completa"], index=0)
+# La historia se muestra mientras Gemini la genera (solo en modo manual; en el masivo no hay salida por video)
+streaming = modo == "Subir video manualmente" and st.sidebar.checkbox("Mostrar la historia mientras se genera (streaming)", value=True)
 
 # Información adicional en el sidebar
 st.sidebar.markdown("---")
@@ -221,6 +124,11 @@ else:
     - Procesa todos los videos de una carpeta
     - Evita reprocesar videos con HDU existente
     - Opción de forzar reprocesamiento
+    - Solicitudes a Gemini en paralelo con límite de RPM/TPM
+    - Extracción de frames solapada con las solicitudes
+    - Bitácora por corrida: si se interrumpe, se puede reanudar
+    - Estimación de frames, tokens y tiempo antes de empezar
+    - Clips cortos agrupados en una sola solicitud (opcional)
     - Ideal para lotes grandes
     """)
 
@@ -228,6 +136,7 @@ st.sidebar.markdown("### 💰 Ahorro de costos")
 st.sidebar.success("""
 ✅ **Beneficios:**
 - Evita reprocesar videos ya analizados
+- Cache por contenido: re-subir el mismo video no vuelve a llamar a la API
 - Reduce costos de API de Gemini
 - Ahorra tiempo de procesamiento
 - Mantiene consistencia en análisis
@@ -243,6 +152,8 @@ Para cada video se crean:
 st.sidebar.markdown("### 🧠 Estrategia Adaptativa")
 st.sidebar.success("""
 🎯 **Nueva funcionalidad:**
+- Por defecto se eligen las pantallas más distintas (cambios de escena)
+- Intervalo fijo (también como respaldo):
 - Videos ≤30s: Detalle alto (2s entre frames)
 - Videos 30-60s: Balance medio (8s entre frames)  
 - Videos 1-2min: Cobertura completa (15s entre frames)
@@ -250,150 +161,406 @@ st.sidebar.success("""
 - Máximo 8 frames para optimizar costos API
 """)
 
-# Función para verificar si ya existe HDU para un video
-def verificar_hdu_existente(video_path):
-    """Verifica si ya existen archivos HDU para el video dado"""
-    base_path = os.path.splitext(video_path)[0]
-    txt_path = base_path + "_HDU.txt"
-    json_path = base_path + "_HDU.json"
-    return os.path.exists(txt_path) and os.path.exists(json_path), txt_path, json_path
-
-# Función para cargar HDU existente
-def cargar_hdu_existente(video_path):
-    """Carga una HDU existente desde los archivos guardados"""
-    base_path = os.path.splitext(video_path)[0]
-    txt_path = base_path + "_HDU.txt"
-    json_path = base_path + "_HDU.json"
-    
-    try:
-        with open(txt_path, "r", encoding="utf-8") as f:
-            hdu_text = f.read()
-        with open(json_path, "r", encoding="utf-8") as f:
-            hdu_json = json.load(f)
-        return hdu_text, hdu_json, None
-    except Exception as e:
-        return None, None, f"Error al cargar HDU existente: {str(e)}"
-
-# Función para guardar HDU
+# Función para guardar HDU (avisa en la interfaz si se sobreescriben archivos)
 def guardar_hdu(video_path, hdu_text, hdu_json):
-    base_path = os.path.splitext(video_path)[0]
-    txt_path = base_path + "_HDU.txt"
-    json_path = base_path + "_HDU.json"
-    # Avisar si existen
-    avisos = []
-    if os.path.exists(txt_path):
-        avisos.append(f"⚠️ Se sobreescribirá: {txt_path}")
-    if os.path.exists(json_path):
-        avisos.append(f"⚠️ Se sobreescribirá: {json_path}")
+    txt_path, json_path, avisos = hdu.guardar_hdu(video_path, hdu_text, hdu_json)
     for aviso in avisos:
         st.warning(aviso)
-    # Guardar archivos
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(hdu_text)
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(hdu_json, f, ensure_ascii=False, indent=2)
     return txt_path, json_path
 
-# Función para procesar un video y devolver HDU
-@st.cache_data(show_spinner=False)
-def procesar_video(video_path, prompt, extra_context, selected_model):
-    # Calcular parámetros óptimos para este video
-    frame_interval, max_frames, estrategia = calcular_parametros_video(video_path)
+# Función para mostrar en Streamlit la información del procesamiento de un video
+def mostrar_info_procesamiento(video_path, info):
+    if info.get("cache"):
+        st.info("♻️ Resultado obtenido desde el cache (sin costos de API)")
+        return
+    if "parametros" not in info:
+        return
+    frame_interval, max_frames, estrategia = info["parametros"]
+    metadata = info["metadata"]
     
     # Mostrar información de la estrategia en Streamlit
     st.info(f"📊 **Estrategia adaptativa:** {estrategia}")
     st.info(f"   • Intervalo entre frames: {frame_interval} segundos")
     st.info(f"   • Máximo de frames: {max_frames}")
     
-    # Extraer frames
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = total_frames / fps if fps else 0
-    
     # Mostrar información del video
     st.info(f"📹 **Video:** {os.path.basename(video_path)}")
-    st.info(f"   • Duración: {duration:.1f} segundos")
-    st.info(f"   • FPS: {fps:.1f}")
+    st.info(f"   • Duración: {metadata['duration']:.1f} segundos")
+    st.info(f"   • FPS: {metadata['fps']:.1f}")
     st.info(f"   • Cobertura estimada: {frame_interval * max_frames} segundos")
     
-    frames = []
-    timestamps = []
-    count = 0
-    for sec in range(0, int(duration), frame_interval):
-        cap.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
-        ret, frame = cap.read()
-        if ret:
-            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(img)
-            frames.append(pil_img)
-            timestamps.append(sec)
-            count += 1
-            if count >= max_frames:
-                break
-    cap.release()
-    if not frames:
-        return None, None, "No se pudieron extraer frames."
-    # Construir prompt
-    global_prompt = (
-        (extra_context + "\n\n" if extra_context.strip() else "") +
-        prompt +
-        "\n\nAnalyze the following sequence of app screens (frames extracted from a video) as a whole. "
-        "Describe the user flow, main actions, UI elements, and any relevant details you observe. "
-        "Then, based on this visual analysis, generate a single, complete, professional user story following all the guidelines."
-    )
-    vision_model = genai.GenerativeModel(selected_model)
+    # Mostrar ahorro de la preparación de imágenes
+    imagenes = info.get("imagenes")
+    if imagenes and imagenes["resolucion_enviada"]:
+        ancho, alto = imagenes["resolucion_enviada"]
+        st.info(f"🖼️ **Imágenes:** {ancho}x{alto} {imagenes['formato'].upper()}, "
+                f"{imagenes['bytes_enviados'] / 1024:.0f} KB enviados, "
+                f"~{imagenes['tokens_ahorrados']} tokens ahorrados")
+    
+    # Mostrar latencia de Gemini
+    tiempos = info.get("tiempos", {})
+    if "primer_token" in tiempos:
+        st.info(f"⏱️ **Gemini:** primer token en {tiempos['primer_token']:.1f}s, respuesta completa en {tiempos['api']:.1f}s")
+    
+    # Mostrar reintentos por errores transitorios y el tiempo de espera por cuota
+    contadores = info.get("contadores", {})
+    if contadores.get("reintentos"):
+        espera = tiempos.get("espera_reintentos", 0) + tiempos.get("espera_concurrencia", 0)
+        st.info(f"🔁 **Reintentos:** {contadores['reintentos']} ({contadores.get('limitados', 0)} por límite de cuota), {espera:.1f}s en espera")
+    
+    # Mostrar en qué se fue el tiempo de la extracción (apertura, decodificación, codificación...)
+    etapas = [etapa for etapa in ("lectura_cache", "apertura", "decodificacion", "deduplicacion", "redimension", "codificacion") if etapa in tiempos]
+    if etapas:
+        st.info("🔬 **Extracción:** " + ", ".join(f"{etapa} {tiempos[etapa]:.2f}s" for etapa in etapas))
+    
+    # Mostrar el modelo elegido por el ruteo automático y si se escaló al modelo fuerte
+    ruteo = info.get("ruteo")
+    if ruteo:
+        senales = ruteo["senales"]
+        st.info(f"🧭 **Ruteo:** {ruteo['modelo']} (ruta {ruteo['ruta']} por {ruteo['motivo']}: "
+                f"{senales['duracion']}s, {senales['escenas']} pantallas distintas)"
+                + (f"; escalado por falta de: {', '.join(ruteo['faltantes'])}" if ruteo["escalado"] else ""))
+    
+    # Mostrar si la HDU salió de una solicitud compartida con otros clips cortos
+    paquete = info.get("paquete")
+    if paquete:
+        st.info(f"📦 **Empaquetado:** video {paquete['posicion']} de {paquete['videos']} en una misma solicitud")
+    
+    # Mostrar tokens servidos desde el contexto cacheado (prompt estático)
+    tokens = info.get("tokens")
+    if tokens and tokens["cacheados"]:
+        st.info(f"🧾 **Tokens:** {tokens['prompt']} de entrada, {tokens['cacheados']} desde el contexto cacheado")
+    
+    # Mostrar segmentos analizados por separado (modo segmentado)
+    segmentos = info.get("segmentos")
+    if segmentos:
+        en_cache = sum(1 for segmento in segmentos if segmento["cache"])
+        st.info(f"🧩 **Modo segmentado:** {len(segmentos)} segmentos analizados en paralelo "
+                f"({en_cache} desde el cache, sin reenviar imágenes) y fusionados en una sola HDU")
+    
+    # Mostrar frames fusionados por deduplicación
+    deduplicacion = info.get("deduplicacion")
+    if deduplicacion and deduplicacion["fusionados"]:
+        st.info(f"🧹 **Deduplicación:** {len(deduplicacion['fusionados'])} frames casi idénticos reemplazados; "
+                f"instantes enviados: {', '.join(f'{t}s' for t in deduplicacion['conservados'])}")
+
+# Catálogo SQLite de videos y HDU (una instancia por proceso de Streamlit)
+@st.cache_resource
+def obtener_catalogo():
+    return Catalogo()
+
+# Endpoint /metrics opcional (HDU_METRICAS_PUERTO), iniciado una sola vez por proceso de Streamlit
+@st.cache_resource
+def iniciar_metricas():
+    return metricas.iniciar_servidor()
+
+iniciar_metricas()
+
+# Función para procesar un video y devolver HDU (st.cache_data solo guarda texto y JSON: los frames
+# viven en el cache de frames en disco y nunca pasan por los argumentos ni el resultado)
+@st.cache_data(show_spinner=False)
+def procesar_video(video_path, prompt, extra_context, selected_model, usar_cache=True, video_hash=None, opciones=None):
+    from pipeline import generar_hdu
+    hdu_text, hdu_json, error, info = generar_hdu(video_path, prompt, extra_context, selected_model, usar_cache, video_hash, opciones=opciones)
+    mostrar_info_procesamiento(video_path, info)
+    return hdu_text, hdu_json, error
+
+# Función para procesar un video mostrando la historia a medida que llegan los tokens
+def procesar_video_streaming(video_path, prompt, extra_context, selected_model, usar_cache=True, video_hash=None, opciones=None):
+    from pipeline import generar_hdu
+    salida = st.empty()
+    partes = []
+    def al_recibir(texto):
+        partes.append(texto)
+        salida.markdown("".join(partes) + " ▌")
+    hdu_text, hdu_json, error, info = generar_hdu(video_path, prompt, extra_context, selected_model, usar_cache, video_hash, opciones=opciones, al_recibir=al_recibir)
+    salida.empty()
+    mostrar_info_procesamiento(video_path, info)
+    return hdu_text, hdu_json, error
+
+# Función que ejecuta cada hilo de la etapa de red en el procesamiento masivo (sin llamadas a st.*)
+def procesar_video_en_lote(preparado, prompt, extra_context, selected_model, procesar_existentes, limitador, existentes=frozenset(), empaquetador=None):
+    existe_hdu = preparado["video_path"] in existentes
+    if existe_hdu and not procesar_existentes:
+        return existe_hdu, None
     try:
-        response = vision_model.generate_content([
-            global_prompt,
-            *frames
-        ])
-        hdu_text = response.text
-        hdu_json = {
-            "video": os.path.basename(video_path),
-            "ruta": video_path,
-            "timestamp": datetime.now().isoformat(),
-            "modelo": selected_model,
-            "prompt": prompt,
-            "extra_context": extra_context,
-            "hdu": hdu_text
-        }
-        return hdu_text, hdu_json, None
+        from pipeline import solicitar_hdu
+        if empaquetador is not None:
+            resultado = empaquetador.solicitar(preparado)
+            # Un clip que espera a su paquete devuelve un Future (no ocupa un hilo mientras tanto)
+            if isinstance(resultado, Future):
+                return encadenar(resultado, lambda resultado: (existe_hdu, resultado))
+            return existe_hdu, resultado
+        return existe_hdu, solicitar_hdu(preparado, prompt, extra_context, selected_model, limitador=limitador)
     except Exception as e:
-        return None, None, str(e)
-
-# Función para obtener información de HDU existente
-def obtener_info_hdu_existente(video_path):
-    """Obtiene información detallada de una HDU existente"""
-    base_path = os.path.splitext(video_path)[0]
-    json_path = base_path + "_HDU.json"
+        return existe_hdu, (None, None, str(e), {})
+
+# Función para ejecutar (o reanudar) un lote registrando cada video en la bitácora apenas termina; `config` es la
+# configuración registrada al iniciar la corrida (prompt, modelo, opciones y límites), no la de los widgets
+def ejecutar_lote(videos, bitacora, config, existentes=frozenset()):
+    from pipeline import Empaquetador, preparar_video, preparado_con_error
+    prompt, extra_context, selected_model, opciones = config["prompt"], config["extra_context"], config["modelo"], config["opciones"]
+    procesar_existentes, usar_cache, empaquetado = config["procesar_existentes"], config["usar_cache"], config.get("empaquetado")
+    limites = config["limites"]
+    limitador = LimitadorTasa(rpm=limites["rpm"], tpm=limites["tpm"])
+    max_procesos, max_concurrentes, max_en_memoria = limites["procesos"], limites["concurrentes"], limites["en_memoria"]
+    st.write(f"Procesando {len(videos)} videos...")
+    progreso = st.progress(0)
+    inicio_lote = time.time()
     
-    try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            hdu_json = json.load(f)
+    def al_completar(completados, total):
+        progreso.progress(completados / total)
+    
+    # Clips cortos empaquetados: solo el primer video de cada paquete ocupa un hilo mientras espera
+    empaquetador = None
+    if empaquetado and empaquetado["activo"]:
+        empaquetador = Empaquetador(prompt, extra_context, selected_model, limitador, empaquetado)
+    
+    # Extracción (procesos) y solicitudes a Gemini (hilos) se solapan entre videos,
+    # pero los resultados se escriben en el orden original
+    resultados = ejecutar_pipeline(
+        videos,
+        partial(preparar_video, prompt=prompt, extra_context=extra_context, selected_model=selected_model, usar_cache=usar_cache, opciones=opciones,
+                empaquetado=empaquetado),
+        lambda preparado: procesar_video_en_lote(preparado, prompt, extra_context, selected_model, procesar_existentes, limitador, existentes, empaquetador),
+        max_procesos=max_procesos,
+        max_concurrentes=max_concurrentes,
+        max_en_memoria=max_en_memoria,
+        al_completar=al_completar,
+        al_fallar=preparado_con_error,
+    )
+    for idx, video_path, (existe_hdu, resultado) in resultados:
+        if resultado is None:
+            st.write(f"⏭️ Omitiendo (HDU existente): {os.path.basename(video_path)}")
+            bitacora.registrar(video_path, "omitido")
+            metricas.registro.incrementar("hdu_videos_total", estado="omitido")
+            continue
         
-        info = {
-            "video": hdu_json.get("video", "N/A"),
-            "modelo": hdu_json.get("modelo", "N/A"),
-            "timestamp": hdu_json.get("timestamp", "N/A"),
-            "ruta": hdu_json.get("ruta", "N/A")
-        }
-        return info, None
-    except Exception as e:
-        return None, f"Error al leer información de HDU: {str(e)}"
+        st.write(f"🔄 Procesando: {os.path.basename(video_path)}")
+        
+        if existe_hdu and procesar_existentes:
+            st.write(f"  ⚠️ Reprocesando video con HDU existente")
+        
+        hdu_text, hdu_json, error, info = resultado
+        mostrar_info_procesamiento(video_path, info)
+        
+        if error:
+            st.error(f"❌ Error en {os.path.basename(video_path)}: {error}")
+            bitacora.registrar(video_path, "error", error=error, tiempos=info.get("tiempos", {}), tokens=info.get("tokens"), contadores=info.get("contadores"))
+            continue
+        
+        txt_path, json_path = guardar_hdu(video_path, hdu_text, hdu_json)
+        obtener_catalogo().registrar_hdu(video_path, hdu_text, hdu_json)
+        st.success(f"✅ HDU generada para {os.path.basename(video_path)}")
+        bitacora.registrar(video_path, "ok", txt=txt_path, json=json_path, tiempos=info.get("tiempos", {}), tokens=info.get("tokens"), contadores=info.get("contadores"), ruteo=info.get("ruteo"), paquete=info.get("paquete"))
+    metricas.registro.observar("hdu_lote_segundos", time.time() - inicio_lote)
+
+# Función para describir un video a partir de su metadata (ver `inspeccion.inspeccionar_carpeta`)
+def describir_metadata(metadata):
+    if not metadata or "error" in metadata:
+        return (metadata or {}).get("error", "sin metadata")
+    return f"{metadata['duration']:.1f}s, {metadata['width']}x{metadata['height']}, {metadata['fps']:.0f} fps, {metadata.get('codec') or 'códec desconocido'}"
+
+# Función para describir la configuración registrada de una corrida (para mostrarla antes de reanudarla)
+def describir_configuracion(config):
+    limites, opciones_corrida, empaquetado = config["limites"], config["opciones"], config.get("empaquetado") or {}
+    imagen = opciones_corrida["imagen"]
+    return [
+        f"- Modelo: {config['modelo']}",
+        f"- Reprocesar existentes: {'sí' if config['procesar_existentes'] else 'no'}",
+        f"- Contexto extra: {config['extra_context'] or '(ninguno)'}",
+        f"- Frames: {opciones_corrida['muestreo']['modo']}, deduplicación {'activa' if opciones_corrida['deduplicacion']['activa'] else 'inactiva'}, "
+        f"modo segmentado {'activo' if opciones_corrida['segmentacion']['activa'] else 'inactivo'}",
+        f"- Imágenes: {imagen['formato']}, lado máximo {imagen['max_lado'] or 'sin límite'}, calidad {imagen['calidad']}",
+        "- Clips cortos agrupados: " + (f"hasta {empaquetado['duracion_maxima']}s" if empaquetado.get("activo") else "no"),
+        f"- Límites: {limites['concurrentes']} solicitudes simultáneas, {limites['procesos']} procesos de extracción, "
+        f"{limites['en_memoria']} videos en memoria, {limites['rpm'] or 'sin límite de'} solicitudes/min, {limites['tpm'] or 'sin límite de'} tokens/min",
+    ]
+
+# Función para formatear una duración en segundos como h/min/s
+def formatear_duracion(segundos):
+    minutos, segundos = divmod(int(round(segundos)), 60)
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas}h {minutos:02d}min" if horas else f"{minutos}min {segundos:02d}s" if minutos else f"{segundos}s"
+
+# Función para mostrar el resumen de una corrida y guardar su log (a partir de la bitácora completa)
+def resumir_lote(carpeta, bitacora, config):
+    _, eventos, _ = bitacora.leer()
+    estados = [evento["estado"] for evento in bitacora.estados().values()]
+    videos_procesados = estados.count("ok")
+    videos_omitidos = estados.count("omitido")
+    errores = estados.count("error")
+    
+    # Resumen final
+    st.write("---")
+    st.write("📋 **Resumen del procesamiento:**")
+    st.write(f"- Videos procesados: {videos_procesados}")
+    st.write(f"- Videos omitidos: {videos_omitidos}")
+    st.write(f"- Errores: {errores}")
+    
+    # Tiempos por etapa: permiten ver si el cuello de botella es la decodificación o la API
+    resumen_tiempos = resumir_tiempos([evento["tiempos"] for evento in eventos if "tiempos" in evento])
+    lineas_tiempos = [f"- {etapa}: total {total:.1f}s, promedio {promedio:.1f}s, máximo {maximo:.1f}s" for etapa, (total, promedio, maximo) in resumen_tiempos.items()]
+    if lineas_tiempos:
+        st.write("⏱️ **Tiempos por etapa:**")
+        st.write("\n".join(lineas_tiempos))
+    
+    # Tokens del prompt estático servidos desde el contexto cacheado en lugar de reenviarse
+    resumen_tokens = resumir_tokens([evento.get("tokens") for evento in eventos])
+    linea_tokens = None
+    if resumen_tokens["solicitudes"]:
+        porcentaje = 100 * resumen_tokens["cacheados"] / max(resumen_tokens["prompt"], 1)
+        linea_tokens = (f"- Tokens de entrada: {resumen_tokens['prompt']}, desde contexto cacheado: "
+                        f"{resumen_tokens['cacheados']} ({porcentaje:.0f}%), de respuesta: {resumen_tokens['respuesta']}")
+        st.write("🧾 **Tokens:**")
+        st.write(linea_tokens)
+    
+    # Reintentos por errores transitorios (429, 5xx) que no llegaron a contarse como error
+    reintentos = sum((evento.get("contadores") or {}).get("reintentos", 0) for evento in eventos)
+    linea_reintentos = None
+    if reintentos:
+        limitados = sum((evento.get("contadores") or {}).get("limitados", 0) for evento in eventos)
+        linea_reintentos = f"- Reintentos: {reintentos} ({limitados} por límite de cuota)"
+        st.write("🔁 **Reintentos:**")
+        st.write(linea_reintentos)
+    
+    # Ruteo automático: videos, tasa de escalado, latencia y tokens por ruta (para ajustar los umbrales)
+    lineas_ruteo = [
+        f"- {ruta}: {r['videos']} videos, {r['escalados']} escalados ({100 * r['escalados'] / r['videos']:.0f}%), "
+        f"latencia promedio {r['api'] / r['videos']:.1f}s, {r['tokens'] // r['videos']} tokens promedio"
+        for ruta, r in resumir_ruteo([evento.get("ruteo") for evento in eventos if evento["estado"] == "ok"]).items()
+    ]
+    if lineas_ruteo:
+        st.write("🧭 **Ruteo:**")
+        st.write("\n".join(lineas_ruteo))
+    
+    # Clips cortos que compartieron solicitud (el resto se pidió por separado)
+    empaquetados = [evento["paquete"] for evento in eventos if evento["estado"] == "ok" and evento.get("paquete")]
+    linea_paquetes = None
+    if empaquetados:
+        solicitudes = sum(1 for paquete in empaquetados if paquete["posicion"] == 1)
+        linea_paquetes = f"- Videos empaquetados: {len(empaquetados)} en {solicitudes} solicitudes"
+        st.write("📦 **Empaquetado:**")
+        st.write(linea_paquetes)
+    
+    # Detalle por video en el orden en que ocurrió (incluye los intentos de corridas reanudadas)
+    log_lines = []
+    for evento in eventos:
+        if evento["estado"] == "ok":
+            log_lines.append(f"OK: {evento['video']} -> {evento['txt']}, {evento['json']}")
+        elif evento["estado"] == "error":
+            log_lines.append(f"ERROR: {evento['video']}: {evento['error']}")
+        else:
+            log_lines.append(f"OMITIDO: {evento['video']} - HDU existente")
+    
+    # Guardar log
+    lineas = [
+        "Resumen del procesamiento:",
+        f"- Videos procesados: {videos_procesados}",
+        f"- Videos omitidos: {videos_omitidos}",
+        f"- Errores: {errores}",
+        f"- Total de videos encontrados: {config['encontrados']}",
+        f"- Videos con HDU existente: {config['con_hdu']}",
+        f"- Videos sin HDU: {config['sin_hdu']}",
+        f"- Reprocesar existentes: {config['procesar_existentes']}",
+        f"- Modelo: {config['modelo']}",
+        f"- Solicitudes simultáneas: {config['limites']['concurrentes']}",
+        f"- Procesos de extracción: {config['limites']['procesos']}",
+        f"- Bitácora: {bitacora.path}",
+        "",
+    ]
+    if lineas_tiempos:
+        lineas += ["Tiempos por etapa:", *lineas_tiempos, ""]
+    if linea_tokens:
+        lineas += ["Tokens:", linea_tokens, ""]
+    if linea_reintentos:
+        lineas += ["Reintentos:", linea_reintentos, ""]
+    if lineas_ruteo:
+        lineas += ["Ruteo:", *lineas_ruteo, ""]
+    if linea_paquetes:
+        lineas += ["Empaquetado:", linea_paquetes, ""]
+    lineas += ["Detalle por video:", *log_lines]
+    log_path = os.path.join(carpeta, f"procesamiento_hdu_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    escribir_atomico(log_path, "\n".join(lineas).encode("utf-8"))
+    bitacora.finalizar({"procesados": videos_procesados, "omitidos": videos_omitidos, "errores": errores, "log": log_path})
+    
+    st.info(f"📄 Log guardado en: {log_path}")
+
+# Función para eliminar copias de videos subidos (y sus HDU) abandonadas hace más de UPLOAD_RETENCION_HORAS
+def purgar_subidas():
+    limite = time.time() - UPLOAD_RETENCION_HORAS * 3600
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file() and entry.stat().st_mtime < limite:
+            os.remove(entry.path)
+
+# Función para eliminar la copia en disco del video subido (sus archivos HDU se conservan)
+def eliminar_video_subido(subida):
+    if os.path.exists(subida["video_path"]):
+        os.remove(subida["video_path"])
+
+# Función para copiar el video subido a disco por bloques, una sola vez por archivo
+def obtener_subida(uploaded_file):
+    """Devuelve {"file_id", "video_path", "video_hash"} del video subido en esta sesión.
+
+    La copia se hace por bloques calculando el hash en la misma pasada (memoria O(chunk)
+    en lugar de `uploaded_file.read()`); los reruns de Streamlit reutilizan la misma copia.
+    Lanza ValueError si el video supera UPLOAD_MAX_MB.
+    """
+    file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    subida = st.session_state.get("subida")
+    if subida and subida["file_id"] == file_id:
+        return subida
+    if subida:
+        eliminar_video_subido(subida)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    purgar_subidas()
+    fd, video_path = tempfile.mkstemp(suffix=".mp4", dir=UPLOAD_DIR)
+    os.close(fd)
+    uploaded_file.seek(0)
+    try:
+        video_hash, _ = guardar_stream(uploaded_file, video_path, max_bytes=UPLOAD_MAX_MB * 1024 * 1024)
+    except BaseException:
+        os.remove(video_path)
+        st.session_state.pop("subida", None)
+        raise
+    subida = st.session_state["subida"] = {"file_id": file_id, "video_path": video_path, "video_hash": video_hash}
+    return subida
+
+# Función para volver a copiar el video subido si se eliminó tras guardar su HDU (p. ej. para reprocesar)
+def asegurar_video_subido(uploaded_file, subida):
+    if not os.path.exists(subida["video_path"]):
+        uploaded_file.seek(0)
+        guardar_stream(uploaded_file, subida["video_path"])
+    return subida["video_path"]
 
 if modo == "Subir video manualmente":
     uploaded_file = st.file_uploader("Sube un video (mp4, mov, avi)", type=["mp4", "mov", "avi"])
     if uploaded_file:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmpfile:
-            tmpfile.write(uploaded_file.read())
-            video_path = tmpfile.name
+        try:
+            subida = obtener_subida(uploaded_file)
+        except ValueError as e:
+            st.error(f"Error: {e}")
+            st.stop()
+        video_path, video_hash = subida["video_path"], subida["video_hash"]
+        procesar = procesar_video_streaming if streaming else procesar_video
         
-        st.video(video_path)
+        st.video(uploaded_file)
         
         # Verificar si ya existe HDU para este video
         existe_hdu, txt_path, json_path = verificar_hdu_existente(video_path)
         
+        # Buscar en el cache por contenido: una re-subida idéntica reutiliza la HDU generada
+        if not existe_hdu:
+            hdu_text, hdu_json = buscar_resultado(clave_resultado(video_hash, selected_model, prompt, extra_context, opciones))
+            if hdu_text is not None:
+                hdu_json.update({"video": os.path.basename(video_path), "ruta": video_path})
+                txt_path, json_path = guardar_hdu(video_path, hdu_text, hdu_json)
+                existe_hdu = True
+        
+        # Con la HDU ya guardada la copia del video solo se necesita para reprocesar
+        if existe_hdu:
+            eliminar_video_subido(subida)
+        
         if existe_hdu:
             st.success("✅ Se encontró una HDU existente para este video.")
             st.info("Para evitar costos adicionales, se cargará la HDU existente en lugar de reprocesar el video.")
@@ -424,35 +591,18 @@ if modo == "Subir video manualmente":
                     # Continuar con el procesamiento normal
                     st.info("Extrayendo frames del video...")
                     
-                    # Calcular parámetros óptimos para este video
-                    frame_interval, max_frames, estrategia = calcular_parametros_video(video_path)
-                    st.info(f"📊 **Estrategia adaptativa:** {estrategia}")
+                    # Extraer frames (o leerlos del cache de frames: el video se decodifica una vez por configuración)
+                    asegurar_video_subido(uploaded_file, subida)
+                    from pipeline import extraer_frames_cacheados
+                    frames, timestamps, parametros, _, _ = extraer_frames_cacheados(video_path, video_hash, opciones)
+                    st.info(f"📊 **Estrategia adaptativa:** {parametros[2]}")
                     
-                    cap = cv2.VideoCapture(video_path)
-                    fps = cap.get(cv2.CAP_PROP_FPS)
-                    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                    duration = total_frames / fps if fps else 0
-                    frames = []
-                    timestamps = []
-                    count = 0
-                    for sec in range(0, int(duration), frame_interval):
-                        cap.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
-                        ret, frame = cap.read()
-                        if ret:
-                            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                            pil_img = Image.fromarray(img)
-                            frames.append(pil_img)
-                            timestamps.append(sec)
-                            count += 1
-                            if count >= max_frames:
-                                break
-                    cap.release()
                     st.write(f"Se extrajeron {len(frames)} frames para análisis IA.")
-                    st.image(frames, caption=[f"Frame {i+1} ({t}s)" for i, t in enumerate(timestamps)], width=180)
+                    st.image([frame["data"] for frame in frames], caption=[f"Frame {i+1} ({t}s)" for i, t in enumerate(timestamps)], width=180)
                     
                     if st.button("✅ Confirmar reprocesamiento"):
                         st.info("Enviando frames a Gemini Vision para análisis global del video...")
-                        hdu_text, hdu_json, error = procesar_video(video_path, prompt, extra_context, selected_model)
+                        hdu_text, hdu_json, error = procesar(video_path, prompt, extra_context, selected_model, usar_cache=False, video_hash=video_hash, opciones=opciones)
                         if error:
                             st.error(f"Error: {error}")
                         else:
@@ -460,39 +610,23 @@ if modo == "Subir video manualmente":
                             st.markdown(hdu_text)
                             # Guardar archivos en la carpeta temporal
                             txt_path, json_path = guardar_hdu(video_path, hdu_text, hdu_json)
+                            eliminar_video_subido(subida)
                             st.info(f"Archivos guardados:\n- {txt_path}\n- {json_path}")
         else:
             # No existe HDU, procesar normalmente
             st.info("Extrayendo frames del video...")
             
-            # Calcular parámetros óptimos para este video
-            frame_interval, max_frames, estrategia = calcular_parametros_video(video_path)
-            st.info(f"📊 **Estrategia adaptativa:** {estrategia}")
+            # Extraer frames (o leerlos del cache de frames: el video se decodifica una vez por configuración)
+            asegurar_video_subido(uploaded_file, subida)
+            from pipeline import extraer_frames_cacheados
+            frames, timestamps, parametros, _, _ = extraer_frames_cacheados(video_path, video_hash, opciones)
+            st.info(f"📊 **Estrategia adaptativa:** {parametros[2]}")
             
-            cap = cv2.VideoCapture(video_path)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = total_frames / fps if fps else 0
-            frames = []
-            timestamps = []
-            count = 0
-            for sec in range(0, int(duration), frame_interval):
-                cap.set(cv2.CAP_PROP_POS_MSEC, sec * 1000)
-                ret, frame = cap.read()
-                if ret:
-                    img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_img = Image.fromarray(img)
-                    frames.append(pil_img)
-                    timestamps.append(sec)
-                    count += 1
-                    if count >= max_frames:
-                        break
-            cap.release()
             st.write(f"Se extrajeron {len(frames)} frames para análisis IA.")
-            st.image(frames, caption=[f"Frame {i+1} ({t}s)" for i, t in enumerate(timestamps)], width=180)
+            st.image([frame["data"] for frame in frames], caption=[f"Frame {i+1} ({t}s)" for i, t in enumerate(timestamps)], width=180)
             if st.button("Analizar video y generar historia de usuario"):
                 st.info("Enviando frames a Gemini Vision para análisis global del video...")
-                hdu_text, hdu_json, error = procesar_video(video_path, prompt, extra_context, selected_model)
+                hdu_text, hdu_json, error = procesar(video_path, prompt, extra_context, selected_model, video_hash=video_hash, opciones=opciones)
                 if error:
                     st.error(f"Error: {error}")
                 else:
@@ -500,7 +634,11 @@ if modo == "Subir video manualmente":
                     st.markdown(hdu_text)
                     # Guardar archivos en la carpeta temporal
                     txt_path, json_path = guardar_hdu(video_path, hdu_text, hdu_json)
+                    eliminar_video_subido(subida)
                     st.info(f"Archivos guardados:\n- {txt_path}\n- {json_path}")
+    elif "subida" in st.session_state:
+        # El usuario quitó el video: liberar su copia en disco
+        eliminar_video_subido(st.session_state.pop("subida"))
 
 elif modo == "Procesar carpeta completa":
     st.write("### Procesamiento masivo de videos en carpeta")
@@ -510,29 +648,83 @@ elif modo == "Procesar carpeta completa":
     st.write("#### Opciones de procesamiento:")
     procesar_existentes = st.checkbox("Reprocesar videos que ya tienen HDU (genera costos adicionales)", value=False)
     mostrar_resumen = st.checkbox("Mostrar resumen de videos encontrados", value=True)
-    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        max_concurrentes = st.number_input("Solicitudes simultáneas", min_value=1, max_value=32, value=4, help="Cantidad máxima de videos procesándose en paralelo contra Gemini")
+    with col2:
+        limite_rpm = st.number_input("Solicitudes por minuto", min_value=0, value=0, help="Presupuesto del lado del cliente (0 = sin límite)")
+    with col3:
+        limite_tpm = st.number_input("Tokens por minuto", min_value=0, value=0, step=10000, help="Presupuesto del lado del cliente (0 = sin límite)")
+    col4, col5 = st.columns(2)
+    with col4:
+        max_procesos = st.number_input("Procesos de extracción", min_value=1, max_value=32, value=max(1, (os.cpu_count() or 2) // 2), help="Procesos que decodifican y codifican frames mientras otros videos esperan a Gemini")
+    with col5:
+        max_en_memoria = st.number_input("Videos en memoria", min_value=1, max_value=64, value=8, help="Máximo de videos con frames extraídos esperando o en curso contra Gemini")
+    col6, col7 = st.columns(2)
+    with col6:
+        empaquetar = st.checkbox("Agrupar clips cortos en una sola solicitud", value=EMPAQUETADO_DEFAULT["activo"], help="Envía varios videos cortos juntos (una sección de frames por video) y separa la respuesta en una HDU por video; si falla, cada video se pide por separado")
+    with col7:
+        duracion_paquete = st.number_input("Duración máxima para agrupar (s)", min_value=1, max_value=120, value=EMPAQUETADO_DEFAULT["duracion_maxima"], disabled=not empaquetar)
+    empaquetado = dict(EMPAQUETADO_DEFAULT, activo=empaquetar, duracion_maxima=int(duracion_paquete))
+    # Configuración de la corrida: se guarda en la bitácora para reanudarla tal como empezó
+    configuracion = {
+        "modelo": selected_model,
+        "prompt": prompt,
+        "extra_context": extra_context,
+        "opciones": opciones,
+        "empaquetado": empaquetado,
+        "limites": {"rpm": int(limite_rpm), "tpm": int(limite_tpm), "procesos": int(max_procesos),
+                    "concurrentes": int(max_concurrentes), "en_memoria": int(max_en_memoria)},
+    }
+
     if carpeta:
         if not os.path.isdir(carpeta):
             st.error("La ruta ingresada no es una carpeta válida.")
         else:
-            patrones = ["**/*.mp4", "**/*.mov", "**/*.avi"]
-            lista_videos = []
-            for patron in patrones:
-                lista_videos.extend(glob.glob(os.path.join(carpeta, patron), recursive=True))
+            # Reanudar la última corrida interrumpida: solo se envían los videos que la bitácora no da por
+            # terminados, sin volver a recorrer la carpeta ni revisar los archivos _HDU
+            bitacora_pendiente = ultima_bitacora_pendiente(carpeta)
+            if bitacora_pendiente:
+                inicio_pendiente, _, _ = bitacora_pendiente.leer()
+                pendientes = bitacora_pendiente.pendientes()
+                terminados = len(inicio_pendiente["videos"]) - len(pendientes)
+                st.warning(f"⏸️ Hay una corrida sin terminar ({inicio_pendiente['fecha'][:19]}): "
+                           f"{terminados} de {len(inicio_pendiente['videos'])} videos completados.")
+                # Se reanuda con la configuración registrada al iniciarla; las bitácoras anteriores a que se
+                # registrara completa toman lo que falte de la configuración actual
+                config = {**configuracion, **inicio_pendiente["config"]}
+                faltantes = [clave for clave in configuracion if clave not in inicio_pendiente["config"]]
+                with st.expander("Configuración con la que se reanudará", expanded=False):
+                    st.write("\n".join(describir_configuracion(config)))
+                    st.text_area("Prompt registrado", value=config["prompt"], height=120, disabled=True)
+                    if faltantes:
+                        st.caption(f"La bitácora no registró {', '.join(faltantes)}: se usa la configuración actual.")
+                if st.button(f"▶️ Reanudar última corrida ({len(pendientes)} videos pendientes)"):
+                    bitacora_pendiente.reanudar()
+                    if pendientes:
+                        ejecutar_lote(pendientes, bitacora_pendiente, config)
+                    resumir_lote(carpeta, bitacora_pendiente, config)
+                    st.stop()
+            
+            # Una pasada incremental por la carpeta (solo se listan los directorios que cambiaron);
+            # la lista de videos y cuáles ya tienen HDU salen del catálogo
+            catalogo = obtener_catalogo()
+            catalogo.actualizar(carpeta)
+            videos_catalogo = catalogo.videos(carpeta)
+            lista_videos = [video_path for video_path, _ in videos_catalogo]
             
             if not lista_videos:
                 st.warning("No se encontraron videos en la carpeta seleccionada.")
             else:
-                # Analizar qué videos ya tienen HDU
-                videos_con_hdu = []
-                videos_sin_hdu = []
+                # Duración, fps, resolución y códec de cada video, leídos en paralelo (solo los nuevos o
+                # modificados: el resto sale del catálogo)
+                from inspeccion import inspeccionar_carpeta, estimar_lote
+                with st.spinner("Inspeccionando videos..."):
+                    metadatas = inspeccionar_carpeta(catalogo, carpeta)
                 
-                for video_path in lista_videos:
-                    existe_hdu, _, _ = verificar_hdu_existente(video_path)
-                    if existe_hdu:
-                        videos_con_hdu.append(video_path)
-                    else:
-                        videos_sin_hdu.append(video_path)
+                # Analizar qué videos ya tienen HDU
+                videos_con_hdu = [video_path for video_path, tiene_hdu in videos_catalogo if tiene_hdu]
+                videos_sin_hdu = [video_path for video_path, tiene_hdu in videos_catalogo if not tiene_hdu]
                 
                 if mostrar_resumen:
                     st.write(f"📊 **Resumen de videos encontrados:**")
@@ -548,7 +740,7 @@ elif modo == "Procesar carpeta completa":
                     if videos_sin_hdu:
                         st.write("**Videos sin HDU:**")
                         for video in videos_sin_hdu:
-                            st.write(f"  ⏳ {os.path.basename(video)}")
+                            st.write(f"  ⏳ {os.path.basename(video)} ({describir_metadata(metadatas.get(video))})")
                 
                 # Determinar qué videos procesar
                 videos_a_procesar = []
@@ -559,64 +751,39 @@ elif modo == "Procesar carpeta completa":
                     videos_a_procesar = videos_sin_hdu
                     st.success(f"✅ Se procesarán solo los {len(videos_sin_hdu)} videos sin HDU existente")
                 
+                # Estimación previa del lote (sin decodificar frames ni llamar a Gemini), calibrada con los
+                # tiempos de las HDU ya generadas en la carpeta
+                if videos_a_procesar:
+                    estimacion = estimar_lote(
+                        {video: metadatas.get(video) for video in videos_a_procesar}, opciones, prompt, extra_context,
+                        int(max_procesos), int(max_concurrentes), limite_rpm, limite_tpm, catalogo.historial(carpeta), empaquetado,
+                    )
+                    calibracion = estimacion["calibracion"]
+                    st.info(f"🔮 **Estimación:** {estimacion['videos']} videos ({estimacion['duracion'] / 60:.1f} min de video), "
+                            f"~{estimacion['frames']} frames, ~{estimacion['tokens']:,} tokens de entrada en "
+                            f"{estimacion['solicitudes']} solicitudes, ~{formatear_duracion(estimacion['segundos'])} con "
+                            f"{int(max_procesos)} procesos y {int(max_concurrentes)} solicitudes simultáneas"
+                            + (f" (tiempos calibrados con {calibracion['videos']} HDU de esta carpeta)" if calibracion["videos"] else "")
+                            + ". No descuenta resultados que ya estén en el cache.")
+                    if estimacion["ilegibles"]:
+                        st.warning(f"⚠️ {len(estimacion['ilegibles'])} videos no se pudieron leer (dañados o incompletos) y fallarán al procesarlos:")
+                        for video in estimacion["ilegibles"]:
+                            st.write(f"  ❌ {os.path.basename(video)}: {(metadatas.get(video) or {}).get('error', 'sin metadata')}")
+                
                 if videos_a_procesar:
                     if st.button(f"🚀 Iniciar procesamiento de {len(videos_a_procesar)} videos"):
-                        st.write(f"Procesando {len(videos_a_procesar)} videos...")
-                        log_lines = []
-                        progreso = st.progress(0)
-                        videos_procesados = 0
-                        videos_omitidos = 0
-                        errores = 0
-                        
-                        for idx, video_path in enumerate(videos_a_procesar):
-                            existe_hdu, _, _ = verificar_hdu_existente(video_path)
-                            
-                            if existe_hdu and not procesar_existentes:
-                                st.write(f"⏭️ Omitiendo (HDU existente): {os.path.basename(video_path)}")
-                                log_lines.append(f"OMITIDO: {video_path} - HDU existente")
-                                videos_omitidos += 1
-                                continue
-                            
-                            st.write(f"🔄 Procesando: {os.path.basename(video_path)}")
-                            
-                            if existe_hdu and procesar_existentes:
-                                st.write(f"  ⚠️ Reprocesando video con HDU existente")
-                            
-                            hdu_text, hdu_json, error = procesar_video(video_path, prompt, extra_context, selected_model)
-                            
-                            if error:
-                                st.error(f"❌ Error en {os.path.basename(video_path)}: {error}")
-                                log_lines.append(f"ERROR: {video_path}: {error}")
-                                errores += 1
-                                continue
-                            
-                            txt_path, json_path = guardar_hdu(video_path, hdu_text, hdu_json)
-                            st.success(f"✅ HDU generada para {os.path.basename(video_path)}")
-                            log_lines.append(f"OK: {video_path} -> {txt_path}, {json_path}")
-                            videos_procesados += 1
-                            progreso.progress((idx+1)/len(videos_a_procesar))
-                        
-                        # Resumen final
-                        st.write("---")
-                        st.write("📋 **Resumen del procesamiento:**")
-                        st.write(f"- Videos procesados: {videos_procesados}")
-                        st.write(f"- Videos omitidos: {videos_omitidos}")
-                        st.write(f"- Errores: {errores}")
-                        
-                        # Guardar log
-                        log_path = os.path.join(carpeta, f"procesamiento_hdu_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-                        with open(log_path, "w", encoding="utf-8") as flog:
-                            flog.write(f"Resumen del procesamiento:\n")
-                            flog.write(f"- Videos procesados: {videos_procesados}\n")
-                            flog.write(f"- Videos omitidos: {videos_omitidos}\n")
-                            flog.write(f"- Errores: {errores}\n")
-                            flog.write(f"- Total de videos encontrados: {len(lista_videos)}\n")
-                            flog.write(f"- Videos con HDU existente: {len(videos_con_hdu)}\n")
-                            flog.write(f"- Videos sin HDU: {len(videos_sin_hdu)}\n")
-                            flog.write(f"- Reprocesar existentes: {procesar_existentes}\n\n")
-                            flog.write("Detalle por video:\n")
-                            flog.write("\n".join(log_lines))
-                        
-                        st.info(f"📄 Log guardado en: {log_path}")
+                        # La bitácora se escribe antes de empezar: si la corrida se corta se puede reanudar
+                        bitacora = Bitacora.crear(
+                            carpeta, videos_a_procesar,
+                            **configuracion,
+                            procesar_existentes=procesar_existentes,
+                            usar_cache=not procesar_existentes,
+                            encontrados=len(lista_videos),
+                            con_hdu=len(videos_con_hdu),
+                            sin_hdu=len(videos_sin_hdu),
+                        )
+                        config = bitacora.leer()[0]["config"]
+                        ejecutar_lote(videos_a_procesar, bitacora, config, existentes=frozenset(videos_con_hdu))
+                        resumir_lote(carpeta, bitacora, config)
                 else:
-                    st.info("No hay videos para procesar con la configuración actual.") 
+                    st.info("No hay videos para procesar con la configuración actual.")
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Métricas del pipeline en el formato de texto de Prometheus (sin dependencias externas)
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DESCRIPCIONES = {
+    "hdu_videos_total": ("counter", "Videos terminados por estado (ok, error, cache, omitido)"),
+    "hdu_etapa_segundos": ("histogram", "Duración de cada etapa del procesamiento de un video"),
+    "hdu_lote_segundos": ("histogram", "Duración de cada corrida del procesamiento masivo"),
+    "hdu_frames_total": ("counter", "Frames enviados a Gemini"),
+    "hdu_frames_descartados_total": ("counter", "Frames casi idénticos descartados por la deduplicación"),
+    "hdu_bytes_enviados_total": ("counter", "Bytes enviados a Gemini (texto e imágenes)"),
+    "hdu_solicitudes_total": ("counter", "Solicitudes enviadas a Gemini"),
+    "hdu_reintentos_total": ("counter", "Solicitudes a Gemini repetidas tras un error"),
+    "hdu_limitados_total": ("counter", "Respuestas de Gemini por exceso de cuota (429)"),
+    "hdu_concurrencia_limite": ("gauge", "Límite adaptativo actual de solicitudes simultáneas a Gemini"),
+    "hdu_tokens_total": ("counter", "Tokens reportados por Gemini por tipo"),
+    "hdu_cache_aciertos_total": ("counter", "Aciertos por cache (resultado, frames, segmentos, contexto)"),
+    "hdu_ruteo_total": ("counter", "Videos con modelo automático por ruta, modelo final y escalado"),
+    "hdu_ruteo_api_segundos": ("histogram", "Latencia de Gemini por ruta (incluye el escalado)"),
+    "hdu_ruteo_tokens_total": ("counter", "Tokens por ruta del modelo automático"),
+}
+
+
+# Función para medir un bloque de código y acumular sus segundos en un dict de tiempos
+@contextmanager
+def medir(tiempos, etapa):
+    """Suma la duración del bloque a `tiempos[etapa]` (un dict serializable, apto entre procesos)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos[etapa] = tiempos.get(etapa, 0) + time.perf_counter() - inicio
+
+
+class Registro:
+    """Contadores, medidores e histogramas con etiquetas, seguros entre hilos.
+
+    Solo vive en el proceso principal: la etapa de extracción (pool de procesos)
+    devuelve sus tiempos en el dict `preparado` y se registran al terminar el video.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}  # (nombre, etiquetas) -> valor (contadores y medidores)
+        self._histogramas = {}  # (nombre, etiquetas) -> [conteos por bucket, suma, cantidad]
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, **etiquetas):
+        """Reemplaza el valor de un medidor"""
+        with self._lock:
+            self._contadores[(nombre, tuple(sorted(etiquetas.items())))] = valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.setdefault(clave, [[0] * len(BUCKETS_SEGUNDOS), 0.0, 0])
+            for i, limite in enumerate(BUCKETS_SEGUNDOS):
+                if valor <= limite:
+                    histograma[0][i] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+
+    def exponer(self):
+        """Devuelve todas las métricas en el formato de texto de Prometheus"""
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {clave: (list(conteos), suma, cantidad) for clave, (conteos, suma, cantidad) in self._histogramas.items()}
+        lineas = []
+        for nombre in sorted({nombre for nombre, _ in [*contadores, *histogramas]}):
+            tipo, descripcion = DESCRIPCIONES.get(nombre, ("untyped", nombre))
+            lineas += [f"# HELP {nombre} {descripcion}", f"# TYPE {nombre} {tipo}"]
+            for (n, etiquetas), valor in sorted(contadores.items()):
+                if n == nombre:
+                    lineas.append(f"{nombre}{formatear_etiquetas(etiquetas)} {valor}")
+            for (n, etiquetas), (conteos, suma, cantidad) in sorted(histogramas.items()):
+                if n != nombre:
+                    continue
+                for limite, conteo in zip(BUCKETS_SEGUNDOS, conteos):
+                    lineas.append(f"{nombre}_bucket{formatear_etiquetas(etiquetas + (('le', str(limite)),))} {conteo}")
+                lineas.append(f"{nombre}_bucket{formatear_etiquetas(etiquetas + (('le', '+Inf'),))} {cantidad}")
+                lineas.append(f"{nombre}_sum{formatear_etiquetas(etiquetas)} {suma}")
+                lineas.append(f"{nombre}_count{formatear_etiquetas(etiquetas)} {cantidad}")
+        return "\n".join(lineas) + "\n"
+
+
+# Función para formatear las etiquetas de una muestra ({clave="valor",...})
+def formatear_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    escapar = lambda valor: str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{clave}="{escapar(valor)}"' for clave, valor in etiquetas) + "}"
+
+
+# Registro compartido por la app, la API y el procesamiento masivo
+registro = Registro()
+
+
+# Función para registrar en las métricas el resultado de un video
+def registrar_video(info, error=None):
+    """Vuelca los tiempos por etapa y los contadores de `info` (ver `pipeline.solicitar_hdu`)"""
+    estado = "cache" if info.get("cache") else ("error" if error else "ok")
+    registro.incrementar("hdu_videos_total", estado=estado)
+    for etapa, segundos in info.get("tiempos", {}).items():
+        registro.observar("hdu_etapa_segundos", segundos, etapa=etapa)
+    contadores = info.get("contadores", {})
+    for clave in ("frames", "frames_descartados", "bytes_enviados", "solicitudes", "reintentos", "limitados"):
+        if contadores.get(clave):
+            registro.incrementar(f"hdu_{clave}_total", contadores[clave])
+    for cache in ("resultado", "frames", "segmentos", "contexto"):
+        if contadores.get(f"cache_{cache}"):
+            registro.incrementar("hdu_cache_aciertos_total", contadores[f"cache_{cache}"], cache=cache)
+    for tipo in ("prompt", "cacheados", "respuesta"):
+        if (info.get("tokens") or {}).get(tipo):
+            registro.incrementar("hdu_tokens_total", info["tokens"][tipo], tipo=tipo)
+    ruteo = info.get("ruteo")
+    if ruteo and not error:
+        registro.incrementar("hdu_ruteo_total", ruta=ruteo["ruta"], modelo=ruteo["modelo"], escalado=str(ruteo["escalado"]).lower())
+        registro.observar("hdu_ruteo_api_segundos", ruteo.get("api", 0), ruta=ruteo["ruta"])
+        registro.incrementar("hdu_ruteo_tokens_total", ruteo.get("tokens", 0), ruta=ruteo["ruta"])
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = registro.exponer().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+# Función para exponer /metrics en un hilo aparte (HDU_METRICAS_PUERTO; la API usa su propio endpoint)
+def iniciar_servidor(puerto=None):
+    """Devuelve el servidor iniciado, o None si no hay puerto configurado"""
+    puerto = puerto or int(os.getenv("HDU_METRICAS_PUERTO", "0"))
+    if not puerto:
+        return None
+    servidor = ThreadingHTTPServer(("0.0.0.0", puerto), _ManejadorMetricas)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
@@ -0,0 +1,63 @@
+# Opciones de generación por defecto. Este módulo no importa OpenCV ni Gemini, de modo que
+# la interfaz se puede dibujar sin cargarlos (se cargan recién al procesar un video)
+
+# Formatos de imagen soportados para enviar a Gemini (ver `video.FORMATOS_IMAGEN`)
+FORMATOS_IMAGEN_SOPORTADOS = ("jpeg", "webp", "png")
+
+# Preparación de imagen por defecto: lado mayor máximo (0 = sin reducir), recorte en % y codificación
+CONFIG_IMAGEN_DEFAULT = {
+    "max_lado": 1536,
+    "recorte": [0, 0, 0, 0],
+    "formato": "jpeg",
+    "calidad": 85,
+}
+
+# Selección de frames por defecto: por cambios de escena, con el intervalo fijo como respaldo
+MUESTREO_DEFAULT = {
+    "modo": "escenas",
+    "umbral": 0.08,
+    "fps_analisis": 2,
+}
+
+# Deduplicación por hash perceptual: distancia de Hamming máxima (sobre 256 bits) para considerar dos frames iguales
+DEDUPLICACION_DEFAULT = {
+    "activa": True,
+    "umbral": 10,
+}
+
+# Modo segmentado (map-reduce) para videos largos: los frames se reparten en segmentos que se
+# analizan en paralelo y una solicitud final fusiona los análisis en una sola HDU
+SEGMENTACION_DEFAULT = {
+    "activa": False,
+    "duracion_minima": 120,  # segundos; los videos más cortos usan el modo normal
+    "frames_por_segmento": 8,
+    "presupuesto_tokens": 40000,  # total estimado de todas las solicitudes de un video
+    "concurrentes": 4,
+}
+
+# Empaquetado de clips cortos en el procesamiento masivo: varios videos en una sola solicitud, con una
+# sección de frames por video y una historia por video en la respuesta (ver `pipeline.Empaquetador`).
+# No forma parte de OPCIONES_DEFAULT: solo entra en la clave del cache cuando está activo
+EMPAQUETADO_DEFAULT = {
+    "activo": False,
+    "duracion_maxima": 15,  # segundos; los videos más largos se envían solos
+    "videos_maximos": 6,
+    "presupuesto_tokens": 30000,  # tokens estimados de entrada por solicitud empaquetada
+    "espera_segundos": 2.0,  # cuánto espera un paquete incompleto a que lleguen más clips
+}
+
+# Opciones de generación por defecto (forman parte de la clave del cache de resultados)
+OPCIONES_DEFAULT = {
+    "imagen": CONFIG_IMAGEN_DEFAULT,
+    "muestreo": MUESTREO_DEFAULT,
+    "deduplicacion": DEDUPLICACION_DEFAULT,
+    "segmentacion": SEGMENTACION_DEFAULT,
+}
+
+
+# Función para completar las opciones de generación con los valores por defecto
+def normalizar_opciones(opciones=None):
+    normalizadas = {clave: dict(valor) for clave, valor in OPCIONES_DEFAULT.items()}
+    for clave, valor in (opciones or {}).items():
+        normalizadas.setdefault(clave, {}).update(valor)
+    return normalizadas
@@ -0,0 +1,713 @@
+import os
+import re
+import math
+import time
+import threading
+from concurrent.futures import Future, InvalidStateError
+from datetime import datetime
+from functools import partial
+from video import extraer_frames_codificados, leer_metadata_archivo
+from opciones import EMPAQUETADO_DEFAULT, normalizar_opciones
+from cache import calcular_hash_video, clave_resultado, buscar_resultado, guardar_resultado, buscar_entrada, guardar_entrada, clave_frames, buscar_binario, guardar_binario, CACHE_FRAMES_MAX_MB_DEFAULT
+from gemini import obtener_cliente, obtener_contextos, bytes_contenido, llamar_con_reintentos, es_contexto_invalido
+from lote import ejecutar_en_orden, resumir_tokens
+from metricas import registrar_video
+from ruteo import MODELO_AUTO, configuracion_ruteo, calcular_senales, elegir_ruta, verificar_estructura
+
+# Tokens que Gemini cobra por imagen pequeña o por cada tile de 768x768 (estimación del lado del cliente)
+TOKENS_POR_IMAGEN = 258
+LADO_IMAGEN_PEQUENA = 384
+LADO_TILE = 768
+
+# Tokens estimados de la respuesta de cada segmento (entran a la solicitud final), tokens reservados
+# para el prompt de la solicitud final y límites de frames. La reserva es fija para que los frames
+# elegidos (y los análisis de segmento en el cache) no dependan del texto del prompt
+TOKENS_ANALISIS_SEGMENTO = 600
+TOKENS_RESERVA_FUSION = 3000
+FRAMES_MINIMOS_SEGMENTADO = 8
+SEGUNDOS_MIN_ENTRE_FRAMES = 2
+PROMPT_SEGMENTO = (
+    "You are analyzing segment {numero} of {total} of a screen recording of an app, covering {inicio}s to {fin}s. "
+    "Describe, in order, every screen shown, its UI elements, the user actions and transitions, and any data entered or displayed. "
+    "Be factual and detailed; do not write a user story yet."
+)
+INSTRUCCION_FUSION = (
+    "The video was analyzed in {total} consecutive segments. Instead of the frames, you receive the written analysis "
+    "of each segment, in order. Merge them into a single coherent user flow and generate a single, complete, "
+    "professional user story following all the guidelines."
+)
+INSTRUCCION_VIDEO = (
+    "Analyze the following sequence of app screens (frames extracted from a video) as a whole. "
+    "Describe the user flow, main actions, UI elements, and any relevant details you observe. "
+    "Then, based on this visual analysis, generate a single, complete, professional user story following all the guidelines."
+)
+INSTRUCCION_PAQUETE = (
+    "The frames below come from {total} different short screen recordings. Each recording starts with a line "
+    "'=== VIDEO n: name ===' followed by its own frames. Analyze each video independently (never mix screens "
+    "between videos) and generate one single, complete, professional user story per video, following all the "
+    "guidelines. Respond only with the {total} stories, in order, each one enclosed in its markers: {marcadores}"
+)
+MARCADOR_HISTORIA = re.compile(r"<<<HDU (\d+)>>>\s*(.*?)\s*(?:<<<FIN \1>>>|(?=<<<HDU \d+>>>)|\Z)", re.DOTALL)
+# Tokens estimados de la etiqueta de cada video dentro de una solicitud empaquetada
+TOKENS_ETIQUETA_VIDEO = 20
+# Un video que espera la respuesta de su paquete más de esto se pide por separado (el paquete quedó colgado)
+ESPERA_PAQUETE_MAXIMA_SEGUNDOS = 600
+
+# Función para construir el prompt completo enviado junto a los frames
+def construir_prompt(prompt, extra_context, instruccion=INSTRUCCION_VIDEO):
+    """Sin `extra_context` ni `instruccion` el resultado es la parte estática, que se registra como contexto cacheado.
+
+    `instruccion` cierra el prompt con lo que se pide para los frames; las solicitudes empaquetadas
+    pasan None y llevan INSTRUCCION_PAQUETE, así ambas comparten el mismo contexto cacheado.
+    """
+    return (
+        (extra_context + "\n\n" if extra_context.strip() else "") +
+        prompt +
+        ("\n\n" + instruccion if instruccion else "")
+    )
+
+
+# Función para construir la clave del cache de un resultado obtenido en una solicitud empaquetada
+def clave_empaquetada(video_hash, selected_model, prompt, extra_context, opciones, empaquetado):
+    """Solo estos resultados llevan el empaquetado en la clave: activarlo no invalida los pedidos por separado"""
+    return clave_resultado(video_hash, selected_model, prompt, extra_context, dict(opciones, empaquetado=dict(EMPAQUETADO_DEFAULT, **empaquetado)))
+
+
+# Función para estimar los tokens de una imagen según sus dimensiones
+def estimar_tokens_imagen(ancho, alto):
+    """Imágenes con ambos lados ≤384px cuestan 258 tokens; las mayores se dividen en tiles de 768x768"""
+    if ancho <= LADO_IMAGEN_PEQUENA and alto <= LADO_IMAGEN_PEQUENA:
+        return TOKENS_POR_IMAGEN
+    return math.ceil(ancho / LADO_TILE) * math.ceil(alto / LADO_TILE) * TOKENS_POR_IMAGEN
+
+
+# Función para estimar los tokens de entrada de una solicitud
+def estimar_tokens(texto, dimensiones):
+    """Estimación aproximada: ~4 caracteres por token de texto más el costo de cada imagen (ancho, alto)"""
+    return len(texto) // 4 + sum(estimar_tokens_imagen(ancho, alto) for ancho, alto in dimensiones)
+
+
+# Función para leer el uso de tokens reportado por la API
+def resumir_uso(response):
+    """Devuelve {prompt, cacheados, respuesta, total} o None si la respuesta no trae usage_metadata"""
+    uso = getattr(response, "usage_metadata", None)
+    if uso is None:
+        return None
+    return {
+        "prompt": uso.prompt_token_count,
+        "cacheados": getattr(uso, "cached_content_token_count", 0) or 0,
+        "respuesta": uso.candidates_token_count,
+        "total": uso.total_token_count,
+    }
+
+
+# Función para resumir el ahorro de la preparación de imágenes de un video
+def resumir_imagenes(frames, dimensiones, config_imagen):
+    """Compara bytes y tokens estimados de los frames enviados contra los frames originales sin procesar"""
+    bytes_crudos = sum(crudos for _, _, crudos in dimensiones)
+    bytes_enviados = sum(len(frame["data"]) for frame in frames)
+    tokens_original = sum(estimar_tokens_imagen(*original) for original, _, _ in dimensiones)
+    tokens_enviados = sum(estimar_tokens_imagen(*enviado) for _, enviado, _ in dimensiones)
+    return {
+        **config_imagen,
+        "resolucion_original": list(dimensiones[0][0]) if dimensiones else None,
+        "resolucion_enviada": list(dimensiones[0][1]) if dimensiones else None,
+        "bytes_crudos": bytes_crudos,
+        "bytes_enviados": bytes_enviados,
+        "bytes_ahorrados": bytes_crudos - bytes_enviados,
+        "tokens_imagen_original": tokens_original,
+        "tokens_imagen_enviados": tokens_enviados,
+        "tokens_ahorrados": tokens_original - tokens_enviados,
+    }
+
+
+# Función para estimar las dimensiones con que se envían los frames de un video
+def dimensiones_enviadas(metadata, config_imagen):
+    """Aplica a la resolución del video el mismo recorte y reducción que `video.preparar_frame`"""
+    arriba, abajo, izquierda, derecha = config_imagen["recorte"]
+    ancho = metadata["width"] * (100 - izquierda - derecha) / 100
+    alto = metadata["height"] * (100 - arriba - abajo) / 100
+    max_lado = config_imagen["max_lado"]
+    if max_lado and max(ancho, alto) > max_lado:
+        escala = max_lado / max(ancho, alto)
+        ancho, alto = ancho * escala, alto * escala
+    return max(1, round(ancho)), max(1, round(alto))
+
+
+# Función para calcular cuántos frames caben en el presupuesto de tokens del modo segmentado
+def calcular_frames_segmentados(metadata, opciones):
+    """Descuenta el prompt de la solicitud final y reparte el resto entre frames, textos y análisis de segmento"""
+    segmentacion = opciones["segmentacion"]
+    tokens_frame = estimar_tokens_imagen(*dimensiones_enviadas(metadata, opciones["imagen"]))
+    por_frame = tokens_frame + (len(PROMPT_SEGMENTO) // 4 + TOKENS_ANALISIS_SEGMENTO) / segmentacion["frames_por_segmento"]
+    frames = int((segmentacion["presupuesto_tokens"] - TOKENS_RESERVA_FUSION) / por_frame)
+    return max(min(frames, int(metadata["duration"] / SEGUNDOS_MIN_ENTRE_FRAMES)), FRAMES_MINIMOS_SEGMENTADO)
+
+
+# Función para dividir los frames (en orden temporal) en segmentos de tamaño parejo
+def dividir_segmentos(cantidad, frames_por_segmento):
+    """Devuelve [(desde, hasta)] índices de frames; cada límite cae en un cambio de escena elegido"""
+    total = math.ceil(cantidad / frames_por_segmento)
+    limites = [round(k * cantidad / total) for k in range(total + 1)]
+    return list(zip(limites[:-1], limites[1:]))
+
+
+# Función para extraer los frames codificados de un video pasando por el cache de frames
+def extraer_frames_cacheados(video_path, video_hash, opciones=None):
+    """Igual que `video.extraer_frames_codificados`, pero el video se decodifica una sola vez por configuración.
+
+    Los frames ya codificados se guardan en disco (sección "frames" del cache, con LRU
+    por bytes hasta HDU_CACHE_FRAMES_MAX_MB) con una clave que depende del hash del
+    video y de las opciones de imagen, muestreo, deduplicación y segmentación. La
+    previsualización, el reprocesamiento y la generación leen del mismo cache.
+    Devuelve (frames, timestamps, parametros, metadata, detalle); `detalle["cache"]`
+    indica si los frames salieron del cache (sus tiempos son entonces los de la lectura).
+    """
+    opciones = normalizar_opciones(opciones)
+    clave_opciones = {k: opciones[k] for k in ("imagen", "muestreo", "deduplicacion", "segmentacion")}
+    clave = clave_frames(video_hash, clave_opciones)
+    inicio = time.perf_counter()
+    cabecera, bloques = buscar_binario("frames", clave)
+    if cabecera is not None:
+        frames = [{"mime_type": mime_type, "data": data} for mime_type, data in zip(cabecera["mime_types"], bloques)]
+        detalle = dict(cabecera["detalle"], cache=True, tiempos={"lectura_cache": time.perf_counter() - inicio})
+        return frames, cabecera["timestamps"], tuple(cabecera["parametros"]), cabecera["metadata"], detalle
+
+    # Modo segmentado: más frames (según el presupuesto de tokens) para repartir en segmentos
+    max_frames = None
+    segmentacion = opciones["segmentacion"]
+    if segmentacion["activa"]:
+        metadata = leer_metadata_archivo(video_path)
+        if metadata["duration"] > segmentacion["duracion_minima"]:
+            max_frames = calcular_frames_segmentados(metadata, opciones)
+    frames, timestamps, parametros, metadata, detalle = extraer_frames_codificados(video_path, opciones["imagen"], opciones["muestreo"], opciones["deduplicacion"], max_frames)
+    cabecera = {
+        "mime_types": [frame["mime_type"] for frame in frames],
+        "timestamps": timestamps,
+        "parametros": list(parametros),
+        "metadata": metadata,
+        "detalle": detalle,
+    }
+    max_mb = float(os.getenv("HDU_CACHE_FRAMES_MAX_MB", CACHE_FRAMES_MAX_MB_DEFAULT))
+    guardar_binario("frames", clave, cabecera, [frame["data"] for frame in frames], max_mb)
+    return frames, timestamps, parametros, metadata, dict(detalle, cache=False)
+
+
+# Función para la etapa de CPU: hash, cache y extracción de frames
+def preparar_video(video_path, prompt, extra_context, selected_model, usar_cache=True, video_hash=None, opciones=None, empaquetado=None):
+    """Etapa de CPU del pipeline. Devuelve un dict serializable (apto para un pool de procesos).
+
+    Si el resultado ya está en el cache, `preparado["cache"]` trae (hdu_text, hdu_json)
+    y no se decodifica el video. Con `empaquetado` activo también sirve un resultado
+    obtenido en una solicitud empaquetada (ver `clave_empaquetada`).
+    """
+    inicio = time.time()
+    opciones = normalizar_opciones(opciones)
+    preparado = {"video_path": video_path, "cache": None, "tiempos": {}, "contadores": {}, "opciones": opciones, "inicio": inicio}
+    # Buscar en el cache persistente por contenido (sin decodificar ni llamar a Gemini)
+    if video_hash is None:
+        try:
+            video_hash = calcular_hash_video(video_path)
+        except Exception as e:
+            # Archivo borrado o ilegible (p. ej. después de listar la carpeta): error de este video, no del lote
+            preparado["error"] = f"Error al leer el video: {str(e)}"
+            preparado["listo"] = time.time()
+            return preparado
+    preparado["video_hash"] = video_hash
+    preparado["clave"] = clave_resultado(video_hash, selected_model, prompt, extra_context, opciones)
+    preparado["tiempos"]["hash"] = time.time() - inicio
+    claves = [preparado["clave"]]
+    if empaquetado and empaquetado["activo"]:
+        claves.append(clave_empaquetada(video_hash, selected_model, prompt, extra_context, opciones, empaquetado))
+    for clave in claves if usar_cache else ():
+        hdu_text, hdu_json = buscar_resultado(clave)
+        if hdu_text is not None:
+            hdu_json.update({"video": os.path.basename(video_path), "ruta": video_path})
+            preparado["cache"] = (hdu_text, hdu_json)
+            preparado["contadores"]["cache_resultado"] = 1
+            preparado["listo"] = time.time()
+            return preparado
+
+    # Extraer frames (una sola pasada por el video) y codificarlos
+    inicio_extraccion = time.time()
+    try:
+        frames, timestamps, parametros, metadata, detalle = extraer_frames_cacheados(video_path, video_hash, opciones)
+        preparado.update({"frames": frames, "timestamps": timestamps, "parametros": parametros, "metadata": metadata})
+        # En modo segmentado (video largo) los frames se reparten en segmentos
+        segmentacion = opciones["segmentacion"]
+        segmentado = segmentacion["activa"] and metadata["duration"] > segmentacion["duracion_minima"]
+        preparado["segmentos"] = dividir_segmentos(len(frames), segmentacion["frames_por_segmento"]) if segmentado and frames else None
+        preparado["dimensiones"] = [enviado for _, enviado, _ in detalle["dimensiones"]]
+        preparado["imagenes"] = resumir_imagenes(frames, detalle["dimensiones"], opciones["imagen"])
+        preparado["deduplicacion"] = detalle["deduplicacion"]
+        preparado["pantallas"] = detalle.get("pantallas")
+        # Sub-etapas de la extracción (apertura, decodificación, deduplicación, redimensión, codificación)
+        preparado["tiempos"].update(detalle["tiempos"])
+        preparado["contadores"].update({
+            "frames": len(frames),
+            "frames_descartados": len(detalle["deduplicacion"].get("fusionados", [])),
+            "cache_frames": int(detalle["cache"]),
+        })
+    except Exception as e:
+        preparado["error"] = f"Error al extraer frames: {str(e)}"
+    preparado["tiempos"]["extraccion"] = time.time() - inicio_extraccion
+    preparado["listo"] = time.time()
+    return preparado
+
+
+# Función para armar el resultado de la etapa de CPU de un video cuya extracción no terminó
+def preparado_con_error(video_path, error):
+    """Para `lote.ejecutar_pipeline(al_fallar=...)`: p. ej. un proceso de extracción que se cayó"""
+    ahora = time.time()
+    return {"video_path": video_path, "cache": None, "tiempos": {}, "contadores": {}, "inicio": ahora, "listo": ahora,
+            "error": f"Error al extraer frames: {str(error) or type(error).__name__}"}
+
+
+# Función para enviar una solicitud con el prompt estático como contexto cacheado
+def generar_con_contexto(selected_model, prompt, extra_context, partes, tiempos, inicio_api, al_recibir=None, contadores=None, limitador=None,
+                         instruccion=INSTRUCCION_VIDEO):
+    """Envía `partes` (frames o texto) precedidas del prompt y devuelve la respuesta de Gemini.
+
+    El prompt estático viaja como contexto cacheado (ver `gemini.GestorContextos`) y solo
+    se envían el contexto extra, `instruccion` y `partes`; si el contexto no está disponible
+    se envía el prompt completo. Con `al_recibir` la respuesta se pide en streaming. Registra en
+    `tiempos["primer_token"]` los segundos desde `inicio_api` hasta el primer fragmento y
+    en `contadores` las solicitudes, bytes enviados, reintentos y usos del contexto cacheado.
+    Los errores transitorios se reintentan con backoff (ver `gemini.llamar_con_reintentos`)
+    mientras no haya llegado ningún fragmento de la respuesta; con `limitador`, cada
+    reintento reserva otra solicitud del presupuesto por minuto.
+    """
+    cliente = obtener_cliente()
+    contextos = obtener_contextos()
+    contadores = {} if contadores is None else contadores
+    for intento in range(2):
+        contexto = contextos.obtener(selected_model, construir_prompt(prompt, "", None)) if contextos else None
+        if contexto is None:
+            contenido = [construir_prompt(prompt, extra_context, instruccion), *partes]
+        else:
+            contenido = [*([extra_context] if extra_context.strip() else []), *([instruccion] if instruccion else []), *partes]
+
+        def llamada():
+            contadores["solicitudes"] = contadores.get("solicitudes", 0) + 1
+            contadores["bytes_enviados"] = contadores.get("bytes_enviados", 0) + bytes_contenido(contenido)
+            if al_recibir is None:
+                response = cliente.generar(selected_model, contenido, contexto)
+                tiempos["primer_token"] = time.time() - inicio_api
+            else:
+                response = cliente.generar(selected_model, contenido, contexto, stream=True)
+                for fragmento in response:
+                    if "primer_token" not in tiempos:
+                        tiempos["primer_token"] = time.time() - inicio_api
+                    if fragmento.parts:
+                        al_recibir(fragmento.text)
+            return response
+
+        try:
+            response = llamar_con_reintentos(llamada, contadores, tiempos, puede_reintentar=lambda: "primer_token" not in tiempos, limitador=limitador)
+            if contexto is not None:
+                contadores["cache_contexto"] = 1
+            return response
+        except Exception as e:
+            # Un contexto vencido o eliminado en el servidor se vuelve a crear una sola vez; cualquier otro
+            # error (cuota agotada tras los reintentos, solicitud inválida...) no tiene que ver con el contexto
+            if contexto is None or intento or "primer_token" in tiempos or not es_contexto_invalido(e):
+                raise
+            contadores["reintentos"] = contadores.get("reintentos", 0) + 1
+            contextos.invalidar(selected_model, contexto)
+            if limitador is not None:
+                limitador.adquirir(0)
+
+
+# Función para analizar los segmentos de un video largo en paralelo (fase "map" del modo segmentado)
+def analizar_segmentos(preparado, selected_model, limitador=None):
+    """Devuelve un dict por segmento {inicio, fin, timestamps, analisis, cache, tokens, contadores, tiempos}, en orden.
+
+    Cada análisis se guarda en el cache (sección "segmentos") con una clave que depende
+    del video, el modelo, el texto del segmento, la configuración de imagen y los
+    instantes de sus frames, pero no del prompt de la HDU: cambiar solo el prompt de
+    la fusión no vuelve a enviar imágenes.
+    """
+    frames = preparado["frames"]
+    timestamps = preparado["timestamps"]
+    segmentos = preparado["segmentos"]
+    duracion = round(preparado["metadata"]["duration"], 1)
+    cliente = obtener_cliente()
+
+    def analizar(indice):
+        desde, hasta = segmentos[indice]
+        inicio, fin = timestamps[desde], timestamps[hasta] if hasta < len(timestamps) else duracion
+        texto = PROMPT_SEGMENTO.format(numero=indice + 1, total=len(segmentos), inicio=inicio, fin=fin)
+        segmento = {"inicio": inicio, "fin": fin, "timestamps": timestamps[desde:hasta], "cache": False, "tokens": None, "contadores": {}, "tiempos": {}}
+        clave = clave_resultado(preparado["video_hash"], selected_model, texto, "", {"imagen": preparado["opciones"]["imagen"], "timestamps": segmento["timestamps"]})
+        entrada = buscar_entrada("segmentos", clave)
+        if entrada is not None:
+            return dict(segmento, analisis=entrada["analisis"], cache=True)
+        reserva = limitador.adquirir(estimar_tokens(texto, preparado["dimensiones"][desde:hasta])) if limitador is not None else None
+        contenido = [texto, *frames[desde:hasta]]
+        contadores = segmento["contadores"]
+
+        def llamada():
+            contadores["solicitudes"] = contadores.get("solicitudes", 0) + 1
+            contadores["bytes_enviados"] = contadores.get("bytes_enviados", 0) + bytes_contenido(contenido)
+            return cliente.generar(selected_model, contenido)
+
+        response = llamar_con_reintentos(llamada, contadores, segmento["tiempos"], limitador=limitador)
+        segmento.update(analisis=response.text, tokens=resumir_uso(response))
+        if reserva is not None and segmento["tokens"] is not None:
+            limitador.ajustar(reserva, segmento["tokens"]["total"])
+        guardar_entrada("segmentos", clave, {"analisis": segmento["analisis"], "timestamps": segmento["timestamps"]})
+        return segmento
+
+    concurrentes = preparado["opciones"]["segmentacion"]["concurrentes"]
+    return [segmento for _, _, segmento in ejecutar_en_orden(list(range(len(segmentos))), analizar, max_concurrentes=concurrentes)]
+
+
+# Función para la etapa de red: solicitud a Gemini
+def solicitar_hdu(preparado, prompt, extra_context, selected_model, limitador=None, al_recibir=None):
+    """Etapa de red del pipeline. Devuelve (hdu_text, hdu_json, error, info).
+
+    Con `al_recibir` la respuesta se pide en streaming y cada fragmento de texto se
+    entrega a `al_recibir(texto)` apenas llega; la HDU guardada es el texto completo.
+    En ambos modos `tiempos` registra el primer token (`primer_token`) y la latencia total (`api`).
+    En modo segmentado primero se analizan los segmentos (`tiempos["segmentos"]`) y la
+    solicitud final recibe sus análisis en lugar de los frames.
+    `info` trae los tiempos por etapa (incluidas las sub-etapas de la extracción y el
+    `total` del video) y los contadores de frames, bytes, solicitudes, reintentos y
+    aciertos de cache; ambos se guardan en el _HDU.json y se suman a `metricas.registro`.
+    Con `selected_model="auto"` el modelo se elige por video (ver `ruteo`) e `info["ruteo"]`
+    registra la ruta, las señales, si se escaló al modelo fuerte, la latencia y los tokens.
+    """
+    tiempos = dict(preparado["tiempos"])
+    tiempos["espera_cola"] = max(time.time() - preparado["listo"], 0)
+    info = {"cache": preparado["cache"] is not None, "tiempos": tiempos, "contadores": dict(preparado["contadores"])}
+    hdu_text, hdu_json, error = enviar_solicitud(preparado, prompt, extra_context, selected_model, info, limitador, al_recibir)
+    tiempos.setdefault("total", time.time() - preparado["inicio"])
+    registrar_video(info, error)
+    return hdu_text, hdu_json, error, info
+
+
+# Función con la solicitud a Gemini de `solicitar_hdu` (completa `info` y devuelve (hdu_text, hdu_json, error))
+def enviar_solicitud(preparado, prompt, extra_context, selected_model, info, limitador=None, al_recibir=None):
+    tiempos = info["tiempos"]
+    contadores = info["contadores"]
+    if preparado["cache"] is not None:
+        hdu_text, hdu_json = preparado["cache"]
+        return hdu_text, hdu_json, None
+
+    if preparado.get("error"):
+        return None, None, preparado["error"]
+
+    frames = preparado["frames"]
+    info.update({k: preparado[k] for k in ("parametros", "metadata", "timestamps", "imagenes", "deduplicacion")})
+    if not frames:
+        return None, None, "No se pudieron extraer frames."
+
+    # Modelo "auto": la ruta se elige con señales ya calculadas en la extracción
+    ruteo = None
+    modelo = selected_model
+    if selected_model == MODELO_AUTO:
+        config = configuracion_ruteo()
+        senales = calcular_senales(preparado)
+        ruta, motivo = elegir_ruta(senales, config)
+        modelo = config[f"modelo_{ruta}"]
+        ruteo = info["ruteo"] = {"ruta": ruta, "motivo": motivo, "senales": senales, "modelo": modelo, "escalado": False}
+
+    global_prompt = construir_prompt(prompt, extra_context)
+    inicio_api = time.time()
+    try:
+        segmentos = None
+        lista_tokens = []
+        partes = frames
+        dimensiones = preparado["dimensiones"]
+        if preparado.get("segmentos"):
+            # Con ruteo, los segmentos (descripciones) van al modelo rápido y solo la fusión a la ruta elegida
+            segmentos = analizar_segmentos(preparado, config["modelo_rapido"] if ruteo else modelo, limitador)
+            tiempos["segmentos"] = time.time() - inicio_api
+            lista_tokens = [segmento["tokens"] for segmento in segmentos]
+            partes = [INSTRUCCION_FUSION.format(total=len(segmentos)) + "\n\n" + "\n\n".join(
+                f"Segment {numero} ({segmento['inicio']}s - {segmento['fin']}s):\n{segmento['analisis']}"
+                for numero, segmento in enumerate(segmentos, start=1)
+            )]
+            dimensiones = []
+            info["segmentos"] = [{k: v for k, v in segmento.items() if k != "analisis"} for segmento in segmentos]
+            # Solicitudes, reintentos y esperas de los segmentos cuentan para el video
+            for segmento in segmentos:
+                for destino, origen in ((contadores, segmento["contadores"]), (tiempos, segmento["tiempos"])):
+                    for clave, valor in origen.items():
+                        destino[clave] = destino.get(clave, 0) + valor
+            contadores["cache_segmentos"] = sum(1 for segmento in segmentos if segmento["cache"])
+        tokens_estimados = estimar_tokens(global_prompt + "".join(p for p in partes if isinstance(p, str)), dimensiones)
+        reserva = None
+        if limitador is not None:
+            inicio_espera = time.time()
+            reserva = limitador.adquirir(tokens_estimados)
+            tiempos["espera_limite"] = time.time() - inicio_espera
+            # La espera por el límite de tasa no cuenta como latencia de la API
+            inicio_api += tiempos["espera_limite"]
+        response = generar_con_contexto(modelo, prompt, extra_context, partes, tiempos, inicio_api, al_recibir, contadores, limitador)
+        hdu_text = response.text
+        tiempos["api"] = time.time() - inicio_api
+        tokens = resumir_uso(response)
+        if reserva is not None and tokens is not None:
+            limitador.ajustar(reserva, tokens["total"])
+        lista_tokens.append(tokens)
+        if ruteo is not None:
+            ruteo["api"] = tiempos["api"]
+            faltantes = verificar_estructura(hdu_text) if ruteo["ruta"] == "rapido" and config["escalar"] else []
+            if faltantes:
+                # La HDU del modelo rápido no tiene la estructura esperada: se repite con el fuerte (sin streaming).
+                # Si el escalado falla se conserva la HDU del modelo rápido
+                ruteo.update(escalado=True, faltantes=faltantes)
+                tiempos_escalado = {}
+                reserva = limitador.adquirir(tokens_estimados) if limitador is not None else None
+                inicio_escalado = time.time()
+                try:
+                    response = generar_con_contexto(config["modelo_fuerte"], prompt, extra_context, partes, tiempos_escalado, inicio_escalado, None, contadores, limitador)
+                    modelo = ruteo["modelo"] = config["modelo_fuerte"]
+                    hdu_text = response.text
+                    lista_tokens.append(resumir_uso(response))
+                    if reserva is not None and lista_tokens[-1] is not None:
+                        limitador.ajustar(reserva, lista_tokens[-1]["total"])
+                except Exception as e:
+                    ruteo["error_escalado"] = str(e)
+                tiempos["escalado"] = time.time() - inicio_escalado
+                for clave in ("espera_concurrencia", "espera_reintentos"):
+                    if clave in tiempos_escalado:
+                        tiempos[clave] = tiempos.get(clave, 0) + tiempos_escalado[clave]
+                ruteo["api"] += tiempos["escalado"]
+        # Tokens de todas las solicitudes del video (segmentos, fusión y escalado)
+        tokens = resumir_tokens(lista_tokens) if len(lista_tokens) > 1 else tokens
+        info["tokens"] = tokens
+        if ruteo is not None:
+            ruteo["tokens"] = (tokens or {}).get("total", 0)
+        tiempos["total"] = time.time() - preparado["inicio"]
+        hdu_json = construir_hdu_json(preparado, prompt, extra_context, modelo, hdu_text, info, segmentos=segmentos)
+        guardar_resultado(preparado["clave"], hdu_text, hdu_json)
+        return hdu_text, hdu_json, None
+    except Exception as e:
+        tiempos["api"] = time.time() - inicio_api
+        return None, None, str(e)
+
+
+class Paquete:
+    """Clips cortos que viajan juntos en una solicitud (ver `Empaquetador`)"""
+
+    def __init__(self):
+        self.preparados = []
+        self.tokens = 0
+        self.cerrado = threading.Event()  # no admite más videos
+        self.futuros = {}  # posición -> Future del resultado de cada video que espera al primero
+        self.respondido = False  # llegó la respuesta: el vencimiento ya no libera a los demás videos
+        self.vencido = False  # los demás videos ya se pidieron por separado: la respuesta solo sirve al primero
+
+
+class Empaquetador:
+    """Etapa de red del procesamiento masivo que agrupa clips cortos en una sola solicitud.
+
+    `solicitar(preparado)` se llama desde los hilos de `lote.ejecutar_pipeline` y devuelve
+    lo mismo que `solicitar_hdu`. Los videos de hasta `duracion_maxima` segundos se suman
+    al paquete abierto mientras quepan en `presupuesto_tokens` y `videos_maximos`; el hilo
+    del primer video espera hasta `espera_segundos` a que se llene y envía una solicitud
+    con una sección de frames por video, pidiendo una historia por video entre marcadores.
+    Cada historia se guarda como la HDU de su video. Los videos cuya historia falta (o no
+    pasa la verificación, con el modelo "auto") y todos los de un paquete que falla se
+    vuelven a pedir por separado. Solo el hilo del primer video espera al paquete: los
+    demás reciben un `Future` que este completa (ver `lote.ejecutar_pipeline`), así que no
+    ocupan hilos de la etapa de red; si el paquete no responde en `espera_segundos` +
+    ESPERA_PAQUETE_MAXIMA_SEGUNDOS se piden por separado y la respuesta tardía solo se usa
+    para el primero. La solicitud empaquetada reemplaza la instrucción de una sola historia
+    (INSTRUCCION_VIDEO) por INSTRUCCION_PAQUETE.
+    """
+
+    def __init__(self, prompt, extra_context, selected_model, limitador=None, config=None):
+        self.prompt = prompt
+        self.extra_context = extra_context
+        self.selected_model = selected_model
+        self.limitador = limitador
+        self.config = dict(EMPAQUETADO_DEFAULT, **(config or {}))
+        self._lock = threading.Lock()
+        self._abierto = None
+
+    def admite(self, preparado):
+        if preparado["cache"] is not None or preparado.get("error") or preparado.get("segmentos") or not preparado.get("frames"):
+            return False
+        return preparado["metadata"]["duration"] <= self.config["duracion_maxima"]
+
+    def solicitar(self, preparado):
+        if not self.admite(preparado):
+            return solicitar_hdu(preparado, self.prompt, self.extra_context, self.selected_model, self.limitador)
+        tokens = estimar_tokens("", preparado["dimensiones"]) + TOKENS_ETIQUETA_VIDEO
+        with self._lock:
+            paquete = self._abierto
+            if paquete is not None and paquete.tokens + tokens > self.config["presupuesto_tokens"]:
+                paquete.cerrado.set()
+                paquete = None
+            lider = paquete is None
+            if lider:
+                paquete = self._abierto = Paquete()
+            posicion = len(paquete.preparados)
+            paquete.preparados.append(preparado)
+            if not lider:
+                futuro = paquete.futuros[posicion] = Future()
+            paquete.tokens += tokens
+            if len(paquete.preparados) >= self.config["videos_maximos"]:
+                paquete.cerrado.set()
+            if paquete.cerrado.is_set():
+                self._abierto = None
+        if not lider:
+            return futuro
+        vencimiento = threading.Timer(self.config["espera_segundos"] + ESPERA_PAQUETE_MAXIMA_SEGUNDOS, self.vencer, (paquete,))
+        vencimiento.daemon = True
+        vencimiento.start()
+        resultados = []
+        # Los demás videos del paquete se resuelven pase lo que pase
+        try:
+            paquete.cerrado.wait(self.config["espera_segundos"])
+            resultados = self.enviar(paquete)
+        finally:
+            vencimiento.cancel()
+            self.resolver(paquete, resultados)
+        if resultados and resultados[0] is not None:
+            return resultados[0]
+        # Sin historia propia en la respuesta del paquete: solicitud individual
+        return solicitar_hdu(preparado, self.prompt, self.extra_context, self.selected_model, self.limitador)
+
+    def cerrar(self, paquete):
+        """Cierra el paquete a nuevos videos y devuelve sus preparados"""
+        with self._lock:
+            paquete.cerrado.set()
+            if self._abierto is paquete:
+                self._abierto = None
+            return list(paquete.preparados)
+
+    def vencer(self, paquete):
+        """Pide por separado los videos de un paquete que no respondió a tiempo, salvo que la respuesta ya esté llegando"""
+        with self._lock:
+            if paquete.respondido:
+                return
+            paquete.vencido = True
+        self.resolver(paquete, [])
+
+    def resolver(self, paquete, resultados):
+        """Completa el `Future` de cada video que espera al paquete con su resultado, o con su solicitud individual"""
+        self.cerrar(paquete)
+        for posicion, futuro in paquete.futuros.items():
+            resultado = resultados[posicion] if posicion < len(resultados) else None
+            if resultado is None:
+                resultado = partial(solicitar_hdu, paquete.preparados[posicion], self.prompt, self.extra_context, self.selected_model, self.limitador)
+            try:
+                futuro.set_result(resultado)
+            except InvalidStateError:
+                # Ya resuelto por el vencimiento (o por la respuesta que llegó después)
+                pass
+
+    def enviar(self, paquete):
+        """Devuelve por video (hdu_text, hdu_json, error, info) o None si debe pedirse por separado"""
+        preparados = self.cerrar(paquete)
+        if len(preparados) < 2:
+            return [None] * len(preparados)
+        modelo = configuracion_ruteo()["modelo_rapido"] if self.selected_model == MODELO_AUTO else self.selected_model
+        total = len(preparados)
+        partes = [INSTRUCCION_PAQUETE.format(total=total, marcadores=" ".join(f"<<<HDU {n}>>> ... <<<FIN {n}>>>" for n in range(1, total + 1)))]
+        dimensiones = []
+        for numero, preparado in enumerate(preparados, start=1):
+            partes.append(f"=== VIDEO {numero}: {os.path.basename(preparado['video_path'])} ({preparado['metadata']['duration']:.0f}s) ===")
+            partes.extend(preparado["frames"])
+            dimensiones.extend(preparado["dimensiones"])
+        tiempos = {}
+        contadores = {}
+        inicio_envio = inicio_api = time.time()
+        try:
+            reserva = None
+            if self.limitador is not None:
+                reserva = self.limitador.adquirir(estimar_tokens(construir_prompt(self.prompt, self.extra_context, None) + partes[0], dimensiones))
+                tiempos["espera_limite"] = time.time() - inicio_api
+                inicio_api += tiempos["espera_limite"]
+            response = generar_con_contexto(modelo, self.prompt, self.extra_context, partes, tiempos, inicio_api, None, contadores, self.limitador,
+                                            instruccion=None)
+            respuesta = response.text
+            tiempos["api"] = time.time() - inicio_api
+            tokens = resumir_uso(response)
+            if reserva is not None and tokens is not None:
+                self.limitador.ajustar(reserva, tokens["total"])
+        except Exception:
+            return [None] * total
+        with self._lock:
+            paquete.respondido = True
+            vencido = paquete.vencido
+        historias = {int(numero): texto for numero, texto in MARCADOR_HISTORIA.findall(respuesta)}
+        # Los tokens del paquete se reparten entre los videos según sus tokens de imagen estimados
+        pesos = [estimar_tokens("", preparado["dimensiones"]) + TOKENS_ETIQUETA_VIDEO for preparado in preparados]
+        resultados = []
+        for posicion, (preparado, peso) in enumerate(zip(preparados, pesos)):
+            hdu_text = historias.get(posicion + 1, "").strip()
+            faltantes = verificar_estructura(hdu_text) if self.selected_model == MODELO_AUTO else ([] if hdu_text else ["historia"])
+            # Tras el vencimiento los demás videos ya tienen su solicitud individual: no se guardan ni registran dos veces
+            if faltantes or (vencido and posicion):
+                resultados.append(None)
+                continue
+            resultados.append(self.resultado_video(preparado, posicion, total, modelo, hdu_text, inicio_envio, tiempos, contadores if posicion == 0 else {},
+                                                   tokens and {clave: round(valor * peso / sum(pesos)) for clave, valor in tokens.items()}))
+        return resultados
+
+    def resultado_video(self, preparado, posicion, total, modelo, hdu_text, inicio_envio, tiempos_paquete, contadores_paquete, tokens):
+        """Arma (hdu_text, hdu_json, None, info) de un video del paquete, lo guarda en el cache y lo registra.
+
+        Las solicitudes, bytes y reintentos del paquete se cuentan en su primer video (así
+        los totales de las métricas son exactos) y los tokens se reparten entre todos.
+        """
+        tiempos = dict(preparado["tiempos"])
+        # Incluye la espera a que se completara el paquete
+        tiempos["espera_cola"] = max(inicio_envio - preparado["listo"], 0)
+        tiempos.update(tiempos_paquete)
+        contadores = dict(preparado["contadores"], empaquetados=1)
+        for clave, valor in contadores_paquete.items():
+            contadores[clave] = contadores.get(clave, 0) + valor
+        tiempos["total"] = time.time() - preparado["inicio"]
+        info = {"cache": False, "tiempos": tiempos, "contadores": contadores, "tokens": tokens}
+        info.update({k: preparado[k] for k in ("parametros", "metadata", "timestamps", "imagenes", "deduplicacion")})
+        if self.selected_model == MODELO_AUTO:
+            info["ruteo"] = {"ruta": "rapido", "motivo": "paquete", "senales": calcular_senales(preparado), "modelo": modelo,
+                             "escalado": False, "api": tiempos_paquete.get("api", 0), "tokens": (tokens or {}).get("total", 0)}
+        info["paquete"] = {"videos": total, "posicion": posicion + 1}
+        hdu_json = construir_hdu_json(preparado, self.prompt, self.extra_context, modelo, hdu_text, info, paquete=info["paquete"])
+        clave = clave_empaquetada(preparado["video_hash"], self.selected_model, self.prompt, self.extra_context, preparado["opciones"], self.config)
+        guardar_resultado(clave, hdu_text, hdu_json)
+        registrar_video(info)
+        return hdu_text, hdu_json, None, info
+
+
+# Función para armar el _HDU.json de un video a partir de lo registrado en `info`
+def construir_hdu_json(preparado, prompt, extra_context, modelo, hdu_text, info, segmentos=None, paquete=None):
+    video_path = preparado["video_path"]
+    return {
+        "video": os.path.basename(video_path),
+        "ruta": video_path,
+        "timestamp": datetime.now().isoformat(),
+        "modelo": modelo,
+        "ruteo": info.get("ruteo"),
+        "prompt": prompt,
+        "extra_context": extra_context,
+        "video_hash": preparado["video_hash"],
+        "tiempos": info["tiempos"],
+        "tokens": info.get("tokens"),
+        "contadores": info["contadores"],
+        "imagenes": preparado["imagenes"],
+        "timestamps_frames": preparado["timestamps"],
+        "deduplicacion": preparado["deduplicacion"],
+        "segmentos": segmentos,
+        "paquete": paquete,
+        "hdu": hdu_text
+    }
+
+
+# Función para generar la HDU de un video (sin dependencias de Streamlit)
+def generar_hdu(video_path, prompt, extra_context, selected_model, usar_cache=True, video_hash=None, limitador=None, opciones=None, al_recibir=None):
+    """Extrae frames, llama a Gemini y devuelve (hdu_text, hdu_json, error, info).
+
+    `info` resume lo ocurrido (cache, estrategia, metadata, tiempos por etapa) para
+    que la interfaz lo muestre. Es seguro llamarla desde hilos de trabajo: no usa `st.*`.
+    `al_recibir` activa el modo streaming (ver `solicitar_hdu`).
+    """
+    preparado = preparar_video(video_path, prompt, extra_context, selected_model, usar_cache, video_hash, opciones)
+    return solicitar_hdu(preparado, prompt, extra_context, selected_model, limitador, al_recibir)
@@ -0,0 +1,87 @@
+import os
+import re
+
+# Ruteo de modelos por video (modelo "auto"): un modelo rápido para flujos cortos y simples y uno
+# fuerte para los largos o con muchas pantallas, con escalado si la respuesta rápida no tiene la
+# estructura esperada. No importa OpenCV ni Gemini (lo usa la interfaz al dibujar la página)
+MODELO_AUTO = "auto"
+RUTEO_DEFAULT = {
+    "modelo_rapido": "gemini-1.5-flash",
+    "modelo_fuerte": "gemini-2.5-pro",
+    "duracion_maxima": 60,  # segundos; los videos más largos van al modelo fuerte
+    "escenas_maximas": 12,  # pantallas distintas detectadas (aunque solo se envíen las del presupuesto de frames)
+    "escalar": True,  # repetir con el modelo fuerte si la HDU del rápido no pasa la verificación
+}
+LARGO_MINIMO_HDU = 200
+
+# Partes que debe tener una HDU (formato del prompt por defecto, en inglés o en español)
+ESTRUCTURA_HDU = {
+    "rol": re.compile(r"\b(as an?|como)\b", re.IGNORECASE),
+    "objetivo": re.compile(r"\b(i want|quiero)\b", re.IGNORECASE),
+    "beneficio": re.compile(r"\b(so that|para (que|poder|lograr)|de modo que|con el fin de)\b", re.IGNORECASE),
+    "criterios": re.compile(r"acceptance criteria|criterios de aceptaci[oó]n", re.IGNORECASE),
+}
+
+
+# Función para leer la configuración del ruteo (variables de entorno HDU_RUTEO_* / .env)
+def configuracion_ruteo():
+    return {
+        "modelo_rapido": os.getenv("HDU_RUTEO_MODELO_RAPIDO", RUTEO_DEFAULT["modelo_rapido"]),
+        "modelo_fuerte": os.getenv("HDU_RUTEO_MODELO_FUERTE", RUTEO_DEFAULT["modelo_fuerte"]),
+        "duracion_maxima": float(os.getenv("HDU_RUTEO_DURACION_MAX", RUTEO_DEFAULT["duracion_maxima"])),
+        "escenas_maximas": int(os.getenv("HDU_RUTEO_ESCENAS_MAX", RUTEO_DEFAULT["escenas_maximas"])),
+        "escalar": os.getenv("HDU_RUTEO_ESCALAR", "1") != "0",
+    }
+
+
+# Función para calcular las señales de ruteo de un video ya preparado (sin llamar a Gemini)
+def calcular_senales(preparado):
+    """Duración, pantallas detectadas, frames enviados, presupuesto de frames, descartados y modo segmentado.
+
+    Con muestreo por intervalo (o frames de un cache anterior) no hay conteo de pantallas y se usan los frames enviados.
+    """
+    return {
+        "duracion": round(preparado["metadata"]["duration"], 1),
+        "escenas": preparado.get("pantallas") or len(preparado["frames"]),
+        "frames": len(preparado["frames"]),
+        "presupuesto": preparado["parametros"][1],
+        "descartados": len(preparado["deduplicacion"].get("fusionados", [])),
+        "segmentado": bool(preparado.get("segmentos")),
+    }
+
+
+# Función para elegir la ruta ("rapido" o "fuerte") a partir de las señales
+def elegir_ruta(senales, config):
+    """Devuelve (ruta, motivo)"""
+    if senales["segmentado"]:
+        return "fuerte", "segmentado"
+    if senales["duracion"] > config["duracion_maxima"]:
+        return "fuerte", "duracion"
+    if senales["escenas"] > config["escenas_maximas"]:
+        return "fuerte", "escenas"
+    return "rapido", "simple"
+
+
+# Función para verificar la estructura de una HDU (chequeo rápido, sin llamar a Gemini)
+def verificar_estructura(hdu_text):
+    """Devuelve la lista de partes que faltan (vacía si la HDU está completa)"""
+    texto = hdu_text or ""
+    faltantes = [parte for parte, patron in ESTRUCTURA_HDU.items() if not patron.search(texto)]
+    if len(texto.strip()) < LARGO_MINIMO_HDU:
+        faltantes.append("largo")
+    return faltantes
+
+
+# Función para resumir el ruteo de un lote (eventos de la bitácora o infos de `solicitar_hdu`)
+def resumir_ruteo(lista_ruteo):
+    """Recibe una lista de dicts `ruteo` (o None) y devuelve {ruta: {videos, escalados, api, tokens}} con sumas"""
+    resumen = {}
+    for ruteo in lista_ruteo:
+        if not ruteo:
+            continue
+        ruta = resumen.setdefault(ruteo["ruta"], {"videos": 0, "escalados": 0, "api": 0.0, "tokens": 0})
+        ruta["videos"] += 1
+        ruta["escalados"] += int(ruteo["escalado"])
+        ruta["api"] += ruteo.get("api") or 0
+        ruta["tokens"] += ruteo.get("tokens") or 0
+    return resumen
@@ -0,0 +1,271 @@
+import math
+import cv2
+from escenas import seleccionar_escenas, deduplicar_frames
+from metricas import medir
+from opciones import CONFIG_IMAGEN_DEFAULT, MUESTREO_DEFAULT, DEDUPLICACION_DEFAULT
+
+# Formatos de imagen soportados para enviar a Gemini: extensión, mime type y flag de calidad de OpenCV
+FORMATOS_IMAGEN = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", None),
+}
+
+# Con deduplicación se extraen más candidatos que el máximo de frames para completar los cupos liberados
+FACTOR_CANDIDATOS = 2
+
+
+# Función para leer la metadata de un video ya abierto
+def leer_metadata(cap):
+    """Lee fps, cantidad de frames, duración y resolución de un cv2.VideoCapture abierto"""
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return {
+        "fps": fps,
+        "total_frames": total_frames,
+        "duration": total_frames / fps if fps else 0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+
+
+# Función para leer la metadata de un archivo de video sin decodificar frames
+def leer_metadata_archivo(video_path):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return leer_metadata(cap)
+    finally:
+        cap.release()
+
+
+# Función para calcular parámetros óptimos según la duración del video
+def calcular_parametros_video(video_path, metadata=None):
+    """Calcula parámetros óptimos para el video basado en su duración.
+
+    Si se entrega `metadata` (ver `leer_metadata`) no se vuelve a abrir el archivo.
+    """
+    if metadata is None:
+        metadata = leer_metadata_archivo(video_path)
+    duration = metadata["duration"]
+
+    # Estrategia adaptativa
+    if duration <= 30:
+        return 2, 8, "Detalle alto (video corto ≤30s)"
+    elif duration <= 60:
+        return 8, 8, "Balance medio (video mediano 30-60s)"
+    elif duration <= 120:
+        return 15, 8, "Cobertura completa (video largo 1-2min)"
+    else:
+        interval = max(int(duration / 8), 10)  # Mínimo 10 seg entre frames
+        return interval, 8, f"Distribución uniforme (video muy largo: {duration:.1f}s)"
+
+
+# Función para calcular los frames objetivo de un muestreo por intervalo
+def calcular_objetivos(metadata, frame_interval, max_frames, desplazamiento=0):
+    """Devuelve una lista ordenada de (indice_frame, segundo) a muestrear desde `desplazamiento`"""
+    fps = metadata["fps"]
+    if not fps:
+        return []
+    objetivos = []
+    sec = desplazamiento
+    while sec < int(metadata["duration"]) and len(objetivos) < max_frames:
+        objetivos.append((int(round(sec * fps)), round(sec, 1)))
+        sec += frame_interval
+    return objetivos
+
+
+# Función para muestrear frames recorriendo el video una sola vez
+def muestrear_frames(cap, objetivos, reducir=None):
+    """Recorre el stream con grab() y decodifica con retrieve() solo los frames objetivo.
+
+    Evita `cap.set(cv2.CAP_PROP_POS_MSEC, ...)`, que obliga al decodificador a
+    volver al keyframe anterior en cada muestra. Devuelve (frames_bgr, segundos).
+    Con `reducir` (función frame -> frame) cada frame se reduce apenas se decodifica.
+    """
+    frames = []
+    timestamps = []
+    pendientes = iter(objetivos)
+    objetivo = next(pendientes, None)
+    idx = 0
+    while objetivo is not None:
+        if not cap.grab():
+            break
+        if idx >= objetivo[0]:
+            ret, frame = cap.retrieve()
+            if ret:
+                frames.append(reducir(frame) if reducir else frame)
+                timestamps.append(objetivo[1])
+            objetivo = next(pendientes, None)
+        idx += 1
+    return frames, timestamps
+
+
+# Función para muestrear candidatos por intervalo fijo, en orden de prioridad
+def muestrear_candidatos_intervalo(cap, metadata, frame_interval, max_candidatos, con_intermedios=False, reducir=None):
+    """Devuelve [(frame, segundo)]: primero los del intervalo fijo y, si `con_intermedios`
+    y faltan candidatos, los puntos a mitad de intervalo (para completar cupos liberados)."""
+    primarios = calcular_objetivos(metadata, frame_interval, max_candidatos)
+    secundarios = []
+    if con_intermedios and len(primarios) < max_candidatos:
+        secundarios = calcular_objetivos(metadata, frame_interval, max_candidatos - len(primarios), frame_interval / 2)
+    frames, timestamps = muestrear_frames(cap, sorted(primarios + secundarios), reducir)
+    por_segundo = dict(zip(timestamps, frames))
+    return [(por_segundo[sec], sec) for _, sec in primarios + secundarios if sec in por_segundo]
+
+
+# Función para extraer los frames BGR de un video con la estrategia adaptativa
+def extraer_frames_bgr(video_path, muestreo=None, deduplicacion=None, max_frames=None, tiempos=None, conteo=None, reducir=None):
+    """Abre el video una vez, calcula la estrategia y extrae los frames (arrays BGR de OpenCV).
+
+    `muestreo["modo"]` puede ser "escenas" (cambios de pantalla, ver `escenas.py`) o
+    "intervalo" (intervalo fijo según la duración). Si la selección por escenas no
+    obtiene frames se usa el intervalo fijo como respaldo. Con `deduplicacion["activa"]`
+    se extraen más candidatos, se descartan los casi idénticos (hash perceptual) y los
+    cupos liberados se completan con otros instantes.
+    Devuelve (frames, timestamps, parametros, metadata, registro_dedup), donde
+    `parametros` es la tupla (frame_interval, max_frames, estrategia) de
+    `calcular_parametros_video` y `registro_dedup` es {} si no hubo deduplicación.
+    Con `max_frames` se reemplaza el máximo de la estrategia adaptativa (modo segmentado)
+    y el intervalo fijo se ajusta para repartir esos frames en toda la duración.
+    Con `tiempos` (dict) se registran los segundos de apertura, decodificación y deduplicación,
+    y con `conteo` (dict) las pantallas detectadas por la selección por escenas. Con `reducir`
+    (función frame -> frame) los candidatos se reducen apenas se decodifican: nunca se
+    retiene más de un frame a resolución completa.
+    """
+    muestreo = dict(MUESTREO_DEFAULT, **(muestreo or {}))
+    deduplicacion = dict(DEDUPLICACION_DEFAULT, **(deduplicacion or {}))
+    factor = FACTOR_CANDIDATOS if deduplicacion["activa"] else 1
+    tiempos = {} if tiempos is None else tiempos
+    with medir(tiempos, "apertura"):
+        cap = cv2.VideoCapture(video_path)
+        metadata = leer_metadata(cap)
+    try:
+        segmentado = bool(max_frames)
+        if segmentado:
+            frame_interval = max(1, round(metadata["duration"] / max_frames, 1))
+            estrategia = f"Segmentado ({max_frames} frames en total, cada {frame_interval}s)"
+        else:
+            frame_interval, max_frames, estrategia = calcular_parametros_video(video_path, metadata)
+        candidatos = []  # (frame, segundo) en orden de prioridad
+        por_escenas = False
+        with medir(tiempos, "decodificacion"):
+            if muestreo["modo"] == "escenas":
+                frames, timestamps, puntajes = seleccionar_escenas(cap, metadata, max_frames * factor, muestreo["umbral"], muestreo["fps_analisis"], conteo, reducir)
+                orden = sorted(range(len(frames)), key=lambda i: puntajes[i], reverse=True)
+                candidatos = [(frames[i], timestamps[i]) for i in orden]
+                por_escenas = bool(candidatos)
+                cupo = min(max_frames, len(candidatos))
+                if not candidatos:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            if not candidatos:
+                candidatos = muestrear_candidatos_intervalo(cap, metadata, frame_interval, max_frames * factor, deduplicacion["activa"], reducir)
+                cupo = len(calcular_objetivos(metadata, frame_interval, max_frames))
+    finally:
+        cap.release()
+
+    registro_dedup = {}
+    if deduplicacion["activa"]:
+        # Solo se completan los cupos liberados: nunca se envían más frames que sin deduplicación
+        with medir(tiempos, "deduplicacion"):
+            frames, timestamps, registro_dedup = deduplicar_frames(candidatos, cupo, deduplicacion["umbral"])
+    else:
+        elegidos = sorted(candidatos[:max_frames], key=lambda candidato: candidato[1])
+        frames = [frame for frame, _ in elegidos]
+        timestamps = [sec for _, sec in elegidos]
+    if por_escenas:
+        estrategia = f"{'Segmentado por cambios' if segmentado else 'Cambios'} de escena ({len(frames)} pantallas distintas, máx. {max_frames})"
+    return frames, timestamps, (frame_interval, max_frames, estrategia), metadata, registro_dedup
+
+
+# Función para recortar y reducir un frame antes de codificarlo
+def preparar_frame(frame, max_lado=0, recorte=None):
+    """Recorta la interfaz del dispositivo y reduce el frame para que su lado mayor no supere `max_lado`.
+
+    `recorte` es (arriba, abajo, izquierda, derecha) en porcentaje del alto/ancho. El
+    recorte es una vista de NumPy (sin copia); solo `cv2.resize` genera un array nuevo.
+    """
+    if recorte and any(recorte):
+        alto, ancho = frame.shape[:2]
+        arriba, abajo, izquierda, derecha = recorte
+        frame = frame[int(alto * arriba / 100):alto - int(alto * abajo / 100),
+                      int(ancho * izquierda / 100):ancho - int(ancho * derecha / 100)]
+    alto, ancho = frame.shape[:2]
+    if max_lado and max(alto, ancho) > max_lado:
+        escala = max_lado / max(alto, ancho)
+        frame = cv2.resize(frame, (max(1, round(ancho * escala)), max(1, round(alto * escala))), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+# Función para acotar la memoria pico de la extracción de un video (frames BGR en memoria a la vez)
+def memoria_maxima_extraccion(metadata, config_imagen=None, max_frames=8, deduplicacion=True):
+    """Cota en bytes de los frames retenidos por `extraer_frames_codificados` para un video.
+
+    Un frame decodificado a resolución completa (el actual) más uno que OpenCV puede estar
+    entregando, más los candidatos ya reducidos (`max_frames`, o el doble con deduplicación)
+    y sus imágenes codificadas (a lo sumo del tamaño del frame reducido). No incluye los
+    buffers internos del decodificador (FFmpeg), que no dependen de la cantidad de frames.
+    """
+    config = dict(CONFIG_IMAGEN_DEFAULT, **(config_imagen or {}))
+    ancho, alto = metadata["width"], metadata["height"]
+    arriba, abajo, izquierda, derecha = config["recorte"]
+    ancho_reducido = ancho * (100 - izquierda - derecha) / 100
+    alto_reducido = alto * (100 - arriba - abajo) / 100
+    if config["max_lado"] and max(ancho_reducido, alto_reducido) > config["max_lado"]:
+        escala = config["max_lado"] / max(ancho_reducido, alto_reducido)
+        ancho_reducido, alto_reducido = ancho_reducido * escala, alto_reducido * escala
+    candidatos = max_frames * (FACTOR_CANDIDATOS if deduplicacion else 1)
+    reducido = math.ceil(ancho_reducido) * math.ceil(alto_reducido) * 3
+    return 2 * ancho * alto * 3 + candidatos * reducido + max_frames * reducido
+
+
+# Función para codificar un frame BGR como imagen lista para enviar a Gemini
+def codificar_frame(frame, formato="webp", calidad=None):
+    """Codifica directamente desde el array de OpenCV (sin pasar por PIL) y devuelve un blob {mime_type, data}.
+
+    Sin `calidad`, WebP se codifica sin pérdida (como lo hacía el SDK con imágenes PIL).
+    """
+    extension, mime_type, flag_calidad = FORMATOS_IMAGEN[formato]
+    if formato == "webp" and calidad is None:
+        calidad = 101  # >100 = sin pérdida en OpenCV
+    parametros = [flag_calidad, int(calidad)] if flag_calidad is not None and calidad is not None else []
+    ok, buffer = cv2.imencode(extension, frame, parametros)
+    if not ok:
+        raise ValueError("No se pudo codificar el frame")
+    return {"mime_type": mime_type, "data": buffer.tobytes()}
+
+
+# Función para extraer los frames de un video ya codificados (serializables entre procesos)
+def extraer_frames_codificados(video_path, config_imagen=None, muestreo=None, deduplicacion=None, max_frames=None):
+    """Igual que `extraer_frames_bgr`, pero con cada frame preparado y codificado según `config_imagen`.
+
+    Devuelve (frames, timestamps, parametros, metadata, detalle), donde `detalle` trae
+    "dimensiones" (por frame: (ancho, alto) original, (ancho, alto) enviado, bytes crudos),
+    "deduplicacion" (registro de `deduplicar_frames`), "tiempos" (segundos por sub-etapa) y
+    "pantallas" (pantallas detectadas por escenas, aunque no todas se envíen; None con intervalo fijo).
+
+    Cada candidato se recorta y reduce apenas se decodifica (la deduplicación compara los
+    frames ya recortados), así que la memoria pico por video en curso queda acotada por
+    `memoria_maxima_extraccion`: los frames de resolución completa nunca se acumulan.
+    """
+    config = dict(CONFIG_IMAGEN_DEFAULT, **(config_imagen or {}))
+    tiempos = {}
+    conteo = {}
+
+    def reducir(frame):
+        with medir(tiempos, "redimension"):
+            reducido = preparar_frame(frame, config["max_lado"], config["recorte"])
+        # Un recorte sin reducción es una vista que retendría el frame completo
+        return reducido if reducido is frame or reducido.base is None else reducido.copy()
+
+    frames_bgr, timestamps, parametros, metadata, registro_dedup = extraer_frames_bgr(video_path, muestreo, deduplicacion, max_frames, tiempos, conteo, reducir)
+    # La redimensión ocurre durante la decodificación: se informa por separado
+    if "decodificacion" in tiempos:
+        tiempos["decodificacion"] = max(tiempos["decodificacion"] - tiempos.get("redimension", 0), 0)
+    original = (metadata["width"], metadata["height"])
+    frames = []
+    dimensiones = []
+    for frame in frames_bgr:
+        with medir(tiempos, "codificacion"):
+            frames.append(codificar_frame(frame, config["formato"], config["calidad"]))
+        dimensiones.append((original, (frame.shape[1], frame.shape[0]), original[0] * original[1] * 3))
+    return frames, timestamps, parametros, metadata, {"dimensiones": dimensiones, "deduplicacion": registro_dedup, "tiempos": tiempos, "pantallas": conteo.get("pantallas")}
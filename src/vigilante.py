@@ -0,0 +1,305 @@
+"""Procesamiento continuo (sin navegador) de una carpeta compartida de grabaciones.
+
+Genera la HDU de cada video nuevo o modificado apenas termina de escribirse, con el
+mismo núcleo que el modo carpeta (extracción en un pool de procesos, solicitudes a
+Gemini en un pool de hilos). Los cambios se detectan con notificaciones del sistema de
+archivos (`pip install watchdog`) y, como respaldo, sondeando el catálogo incremental.
+
+Uso:
+    python src/vigilante.py /ruta/a/la/carpeta [--modelo gemini-1.5-flash|auto] [--concurrentes 4]
+        [--procesos 2] [--en-memoria 8] [--estable 3] [--sondeo 10] [--sin-notificaciones]
+"""
+import os
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hdu
+import metricas
+from catalogo import Catalogo, EXTENSIONES_VIDEO
+from lote import LimitadorTasa
+from pipeline import preparar_video, solicitar_hdu, normalizar_opciones
+from ruteo import MODELO_AUTO
+
+# Un archivo se da por terminado cuando su tamaño y mtime no cambian durante estos segundos
+SEGUNDOS_ESTABLE_DEFAULT = 3
+# Intervalo de sondeo del catálogo sin notificaciones, y de reconciliación con notificaciones
+# (recupera eventos perdidos, p. ej. en recursos de red)
+SONDEO_SEGUNDOS_DEFAULT = 10
+RECONCILIACION_SEGUNDOS_DEFAULT = 300
+TIC_SEGUNDOS = 0.5
+
+log = logging.getLogger("vigilante")
+
+
+class Vigilante:
+    """Detecta videos nuevos o modificados bajo `carpeta` y genera su HDU.
+
+    Un video se procesa si no tiene HDU o si es más reciente que su _HDU.json. Antes
+    de encolarlo se espera a que su tamaño y mtime estén estables por
+    `segundos_estable`; el archivo no se abre en el hilo principal (un MP4 a medio copiar
+    o dañado puede colgar o tirar a OpenCV): si la copia se pausó más que eso, la
+    extracción falla en el pool y el video se repite cuando el archivo vuelve a cambiar.
+    Un video que falla no se reintenta hasta que el archivo cambie. Si
+    un proceso de extracción se cae (OpenCV puede abortar con archivos dañados) se crea
+    otro pool y los videos que estaban en curso se repiten de a uno en un proceso
+    aparte, como en `lote.ejecutar_pipeline`: solo el que vuelve a tirarlo falla.
+    """
+
+    def __init__(self, carpeta, prompt, extra_context, selected_model, opciones=None, max_procesos=2, max_concurrentes=4, max_en_memoria=8,
+                 limitador=None, segundos_estable=SEGUNDOS_ESTABLE_DEFAULT, sondeo_segundos=None, usar_notificaciones=True, catalogo=None):
+        self.carpeta = os.path.abspath(carpeta)
+        self.prompt = prompt
+        self.extra_context = extra_context
+        self.selected_model = selected_model
+        self.opciones = normalizar_opciones(opciones)
+        self.max_procesos = max_procesos
+        self.max_concurrentes = max_concurrentes
+        self.max_en_memoria = max_en_memoria
+        self.limitador = limitador
+        self.segundos_estable = segundos_estable
+        self.usar_notificaciones = usar_notificaciones
+        self.sondeo_segundos = sondeo_segundos
+        self.catalogo = catalogo or Catalogo()
+        self._lock = threading.Lock()
+        self._candidatos = {}  # path -> [size, mtime_ns, estable_desde, detectado]
+        self._en_proceso = set()
+        self._fallidos = {}  # path -> (size, mtime_ns) del intento fallido
+        self._sospechosos = deque()  # (path, detectado, firma) en curso cuando se cayó un proceso
+        self._aislamiento = None  # pool de un solo proceso para repetir los sospechosos de a uno
+        self._aislado = False
+        self._conocidos = None  # última foto del catálogo {path: (size, mtime_ns, tiene_hdu)}
+        self._sondear_ya = threading.Event()
+
+    def notificar(self, path):
+        """Marca un archivo como candidato (se llama desde el hilo de notificaciones o del sondeo)"""
+        nombre = os.path.basename(path)
+        if nombre.startswith(".") or not nombre.lower().endswith(EXTENSIONES_VIDEO):
+            return
+        with self._lock:
+            self._candidatos.setdefault(os.path.abspath(path), [None, None, None, time.time()])
+
+    def sondear(self):
+        """Sincroniza el catálogo (solo relista directorios modificados) y marca videos sin HDU o cambiados.
+
+        Sobrescribir un video en su lugar no cambia el mtime del directorio, así que el catálogo
+        no lo relista: además se compara el tamaño y mtime actuales de cada video conocido
+        (un `stat` por archivo) para detectarlo también sin notificaciones.
+        """
+        self.catalogo.actualizar(self.carpeta)
+        archivos = self.catalogo.archivos(self.carpeta)
+        for path, (size, mtime_ns, tiene_hdu) in archivos.items():
+            anterior = self._conocidos.get(path) if self._conocidos is not None else None
+            if not tiene_hdu or (self._conocidos is not None and (anterior is None or anterior[:2] != (size, mtime_ns))):
+                self.notificar(path)
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.notificar(path)
+        self._conocidos = archivos
+
+    def requiere_hdu(self, video_path):
+        existe, _, json_path = hdu.verificar_hdu_existente(video_path)
+        return not existe or os.path.getmtime(video_path) > os.path.getmtime(json_path)
+
+    def revisar_candidatos(self):
+        """Encola los candidatos que terminaron de escribirse"""
+        ahora = time.monotonic()
+        with self._lock:
+            candidatos = [(path, estado) for path, estado in self._candidatos.items() if path not in self._en_proceso]
+        for path, estado in candidatos:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._candidatos.pop(path, None)
+                continue
+            if estado[:2] != [stat.st_size, stat.st_mtime_ns]:
+                estado[:3] = [stat.st_size, stat.st_mtime_ns, ahora]
+                continue
+            if ahora - estado[2] < self.segundos_estable:
+                continue
+            with self._lock:
+                fallido = self._fallidos.get(path) == (stat.st_size, stat.st_mtime_ns)
+            if fallido or not self.requiere_hdu(path):
+                with self._lock:
+                    self._candidatos.pop(path, None)
+                continue
+            with self._lock:
+                # Como `max_en_memoria` en `lote.ejecutar_pipeline`: los frames de cada video en curso viven
+                # en memoria hasta su solicitud; el resto espera como candidato
+                if len(self._en_proceso) >= max(1, self.max_en_memoria):
+                    break
+                self._candidatos.pop(path, None)
+                self._en_proceso.add(path)
+            self.encolar(path, estado[3], (stat.st_size, stat.st_mtime_ns))
+
+    def encolar(self, video_path, detectado, firma, aislado=False):
+        log.info("En cola: %s%s", video_path, " (en un proceso aparte)" if aislado else "")
+        argumentos = (preparar_video, video_path, self.prompt, self.extra_context, self.selected_model, True, None, self.opciones)
+        if aislado:
+            if self._aislamiento is None:
+                self._aislamiento = ProcessPoolExecutor(max_workers=1)
+            futuro = self._aislamiento.submit(*argumentos)
+        else:
+            try:
+                futuro = self._procesos.submit(*argumentos)
+            except BrokenProcessPool:
+                # Los videos en curso al caerse el pool se repiten en `_solicitar`; este sigue en un pool nuevo
+                log.warning("El pool de extracción quedó roto: se crea uno nuevo")
+                self._procesos.shutdown(wait=False, cancel_futures=True)
+                self._procesos = ProcessPoolExecutor(max_workers=max(1, self.max_procesos))
+                futuro = self._procesos.submit(*argumentos)
+        futuro.add_done_callback(lambda preparado: self._al_extraer(video_path, preparado, detectado, firma, aislado))
+
+    def _al_extraer(self, video_path, futuro, detectado, firma, aislado):
+        try:
+            self._hilos.submit(self._solicitar, video_path, futuro, detectado, firma, aislado)
+        except RuntimeError:
+            # El vigilante se está deteniendo: el video se procesa en la próxima ejecución
+            with self._lock:
+                self._en_proceso.discard(video_path)
+                if aislado:
+                    self._aislado = False
+
+    def despachar_sospechosos(self):
+        """Repite de a uno, en un proceso aparte, los videos en curso cuando se cayó un proceso"""
+        with self._lock:
+            if self._aislado or not self._sospechosos:
+                return
+            self._aislado = True
+            video_path, detectado, firma = self._sospechosos.popleft()
+        self.encolar(video_path, detectado, firma, aislado=True)
+
+    def _solicitar(self, video_path, futuro, detectado, firma, aislado=False):
+        repetir = False
+        try:
+            try:
+                preparado = futuro.result()
+            except BrokenProcessPool:
+                if aislado:
+                    # Solo con este video en el proceso: es el que lo tira
+                    with self._lock:
+                        roto, self._aislamiento = self._aislamiento, None
+                    roto.shutdown(wait=False)
+                    raise RuntimeError("El proceso de extracción se cerró al procesar el video")
+                # Puede haber caído por otro video del pool: se repite de a uno
+                log.warning("Proceso de extracción caído con %s en curso: se repetirá en un proceso aparte", video_path)
+                with self._lock:
+                    self._sospechosos.append((video_path, detectado, firma))
+                repetir = True
+                return
+            hdu_text, hdu_json, error, info = solicitar_hdu(preparado, self.prompt, self.extra_context, self.selected_model, self.limitador)
+            if error:
+                raise RuntimeError(error)
+            txt_path, json_path, avisos = hdu.guardar_hdu(video_path, hdu_text, hdu_json)
+            self.catalogo.registrar_hdu(video_path, hdu_text, hdu_json)
+            with self._lock:
+                self._fallidos.pop(video_path, None)
+            origen = "cache" if info.get("cache") else f"{info.get('contadores', {}).get('reintentos', 0)} reintentos"
+            if info.get("ruteo"):
+                origen += f", {info['ruteo']['modelo']}" + (" tras escalar" if info["ruteo"]["escalado"] else "")
+            log.info("HDU generada: %s -> %s (%.1fs desde que se detectó, %s)", video_path, json_path, time.time() - detectado, origen)
+        except Exception as e:
+            with self._lock:
+                self._fallidos[video_path] = firma
+            log.error("Error en %s: %s (se reintentará cuando el archivo cambie)", video_path, e)
+        finally:
+            with self._lock:
+                if not repetir:
+                    self._en_proceso.discard(video_path)
+                if aislado:
+                    self._aislado = False
+
+    def _iniciar_notificaciones(self):
+        """Devuelve el observador de watchdog iniciado, o None si no está disponible"""
+        if not self.usar_notificaciones:
+            return None
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            log.warning("watchdog no está instalado: se usa solo el sondeo (pip install watchdog)")
+            return None
+        vigilante = self
+
+        class Manejador(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    # Carpetas nuevas o movidas: el catálogo encuentra sus videos
+                    if event.event_type in ("created", "moved"):
+                        vigilante._sondear_ya.set()
+                    return
+                vigilante.notificar(getattr(event, "dest_path", "") or event.src_path)
+
+        observador = Observer()
+        observador.schedule(Manejador(), self.carpeta, recursive=True)
+        observador.start()
+        return observador
+
+    def ejecutar(self, detener=None):
+        """Procesa la carpeta hasta que se active `detener` (threading.Event) o Ctrl+C"""
+        detener = detener or threading.Event()
+        self._procesos = ProcessPoolExecutor(max_workers=max(1, self.max_procesos))
+        self._hilos = ThreadPoolExecutor(max_workers=max(1, self.max_concurrentes))
+        observador = self._iniciar_notificaciones()
+        sondeo = self.sondeo_segundos or (RECONCILIACION_SEGUNDOS_DEFAULT if observador else SONDEO_SEGUNDOS_DEFAULT)
+        log.info("Vigilando %s (%s, sondeo cada %ss)", self.carpeta, "notificaciones" if observador else "solo sondeo", sondeo)
+        proximo_sondeo = 0
+        try:
+            while not detener.is_set():
+                if self._sondear_ya.is_set() or time.monotonic() >= proximo_sondeo:
+                    self._sondear_ya.clear()
+                    self.sondear()
+                    proximo_sondeo = time.monotonic() + sondeo
+                self.revisar_candidatos()
+                self.despachar_sospechosos()
+                detener.wait(TIC_SEGUNDOS)
+        except KeyboardInterrupt:
+            log.info("Deteniendo...")
+        finally:
+            if observador is not None:
+                observador.stop()
+                observador.join()
+            self._procesos.shutdown(wait=True)
+            if self._aislamiento is not None:
+                self._aislamiento.shutdown(wait=True)
+            self._hilos.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta")
+    parser.add_argument("--modelo", default=hdu.default_gemini_models[0], choices=[*hdu.default_gemini_models, MODELO_AUTO], help="auto = ruteo por video (ver ruteo.py)")
+    parser.add_argument("--prompt", help="Archivo con el prompt (por defecto el de la app)")
+    parser.add_argument("--contexto", default="", help="Contexto extra para la IA")
+    parser.add_argument("--concurrentes", type=int, default=4, help="Solicitudes simultáneas a Gemini")
+    parser.add_argument("--procesos", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Procesos de extracción")
+    parser.add_argument("--en-memoria", type=int, default=8, help="Máximo de videos entre la extracción y el fin de su solicitud")
+    parser.add_argument("--estable", type=float, default=SEGUNDOS_ESTABLE_DEFAULT, help="Segundos sin cambios para dar un archivo por escrito")
+    parser.add_argument("--sondeo", type=float, default=None, help=f"Segundos entre sondeos del catálogo (por defecto {SONDEO_SEGUNDOS_DEFAULT}, o {RECONCILIACION_SEGUNDOS_DEFAULT} con notificaciones)")
+    parser.add_argument("--sin-notificaciones", action="store_true", help="No usar watchdog (solo sondeo)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    hdu.configurar_gemini()
+    metricas.iniciar_servidor()
+    prompt = hdu.default_prompt()
+    if args.prompt:
+        with open(args.prompt, "r", encoding="utf-8") as f:
+            prompt = f.read()
+    limitador = LimitadorTasa(rpm=int(os.getenv("GEMINI_RPM", "0")), tpm=int(os.getenv("GEMINI_TPM", "0")))
+    Vigilante(
+        args.carpeta, prompt, args.contexto, args.modelo, max_procesos=args.procesos, max_concurrentes=args.concurrentes,
+        max_en_memoria=args.en_memoria, limitador=limitador, segundos_estable=args.estable, sondeo_segundos=args.sondeo, usar_notificaciones=not args.sin_notificaciones,
+    ).ejecutar()
+
+
+if __name__ == "__main__":
+    main()